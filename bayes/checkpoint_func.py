@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Metropolis-Hastings with bounds which saves its full state to a checkpoint file so a long chain can be resumed after a crash or a preempted job.
+
+The checkpoint holds everything needed to continue the chain exactly:
+- the iteration reached and the draws and log posteriors so far
+- the current parameter values and their log posterior (so the posterior isn't recomputed on resume)
+- the proposal scale (which can change if adaptiterations > 0)
+- the number of proposals accepted (in total and in the current adaptation window) and the number where posteriorfunc raised an error
+- the state of the numpy Generator used for all the random numbers
+
+So a resumed chain gives exactly the same draws as one that was never interrupted.
+
+The checkpoint is two files so each checkpoint only writes the draws since the previous one (rewriting the whole chain every time would make the total I/O quadratic in the length of the chain):
+- the draws file (checkpointfile + '_draws') holds one row per iteration (the draws then the log posterior) as raw little-endian float64. New rows are only ever appended.
+- the state file (checkpointfile) is small and holds:
+    - magic bytes and a format version
+    - the length of a JSON header and the header (iteration, counts, Generator state, the settings of the chain, a running CRC32 of the rows in the draws file)
+    - the current values and scale as raw little-endian float64
+    - a CRC32 of everything before it
+At each checkpoint I first cut the draws file back to the rows in the last state file (rows from a crash after appending are dropped), append the new rows and fsync it. Then the state file is written to a temporary file, fsynced and renamed over the old one (and the folder is fsynced). So a crash at any point leaves the previous checkpoint intact.
+The settings of the chain (bounds, starting values, seed, number of iterations) are saved in the header and a checkpoint is only resumed if they match.
+"""
+import os
+from pathlib import Path
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import json
+import struct
+import time
+import zlib
+
+import numpy as np
+
+# Defaults:{{{1
+magic = b'DSGEMHCK'
+formatversion = 2
+# target acceptance rate when adapting the proposal scale
+targetacceptance_default = 0.234
+
+# Checkpoint File:{{{1
+def fsyncfolder(folder):
+    """
+    fsync a folder so a rename within it is durable. Not possible on every platform.
+    """
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def getdrawsfile(filename):
+    return(str(filename) + '_draws')
+
+
+def savecheckpoint(filename, state):
+    """
+    Append the draws since the last checkpoint to the draws file and then atomically write the rest of state (as returned by metropolis_checkpoint) to filename.
+    state['drawsiteration'] and state['drawscrc'] are the rows already in the draws file and their CRC32. They are updated here.
+    """
+    filename = str(filename)
+    iteration = state['iteration']
+    nparams = len(state['currentvalues'])
+
+    # append the new rows
+    drawsfile = getdrawsfile(filename)
+    drawsiteration = state['drawsiteration']
+    rowbytes = np.ascontiguousarray(np.column_stack((state['draws'][drawsiteration: iteration], state['logposts'][drawsiteration: iteration])), dtype = '<f8').tobytes()
+    with open(drawsfile, 'r+b' if os.path.isfile(drawsfile) else 'wb') as f:
+        f.truncate(8 * (nparams + 1) * drawsiteration)
+        f.seek(0, os.SEEK_END)
+        f.write(rowbytes)
+        f.flush()
+        os.fsync(f.fileno())
+    state['drawscrc'] = zlib.crc32(rowbytes, state['drawscrc'])
+    state['drawsiteration'] = iteration
+
+    header = {key: state[key] for key in ['iteration', 'numaccepted', 'windowaccepted', 'numerrors', 'currentlogpost', 'settings', 'drawscrc']}
+    # the Generator state contains integers too large for JSON numbers
+    header['rngstate'] = json.dumps(state['rngstate'], default = str)
+    header['nparams'] = nparams
+    headerbytes = json.dumps(header).encode('utf-8')
+
+    parts = [magic, struct.pack('<IQ', formatversion, len(headerbytes)), headerbytes]
+    for array in [state['currentvalues'], state['scale']]:
+        parts.append(np.ascontiguousarray(array, dtype = '<f8').tobytes())
+    crc = 0
+    for part in parts:
+        crc = zlib.crc32(part, crc)
+
+    tempfilename = filename + '_temp'
+    with open(tempfilename, 'wb') as f:
+        for part in parts:
+            f.write(part)
+        f.write(struct.pack('<I', crc))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tempfilename, filename)
+    fsyncfolder(os.path.dirname(os.path.abspath(filename)))
+
+
+def readheader(filename):
+    """
+    Return the header of the state file filename and the position of the arrays after it.
+    """
+    with open(filename, 'rb') as f:
+        start = f.read(len(magic) + 12)
+        if len(start) < len(magic) + 12 or start[: len(magic)] != magic:
+            raise ValueError('Not a checkpoint file: ' + str(filename) + '.')
+        version, headerlength = struct.unpack('<IQ', start[len(magic): ])
+        if version != formatversion:
+            raise ValueError('Unknown checkpoint format version: ' + str(version) + '.')
+        header = json.loads(f.read(headerlength).decode('utf-8'))
+
+    return(header, len(magic) + 12 + headerlength)
+
+
+def loadcheckpoint(filename, numiterations = None):
+    """
+    Read a checkpoint written by savecheckpoint.
+    numiterations: the size of the draws array to return (the draws not reached yet are nan). Defaults to the number of iterations in the settings.
+    Raises a ValueError if the state file or the draws file is corrupt.
+    """
+    with open(filename, 'rb') as f:
+        content = f.read()
+
+    if len(content) < len(magic) + 16 or content[: len(magic)] != magic:
+        raise ValueError('Not a checkpoint file: ' + str(filename) + '.')
+    crc = struct.unpack('<I', content[-4: ])[0]
+    if zlib.crc32(content[: -4]) != crc:
+        raise ValueError('Checkpoint file is corrupt (CRC mismatch): ' + str(filename) + '.')
+
+    header, position = readheader(filename)
+
+    iteration = header['iteration']
+    nparams = header['nparams']
+
+    def readarray(size):
+        nonlocal position
+        array = np.frombuffer(content[position: position + 8 * size], dtype = '<f8').astype(float)
+        position = position + 8 * size
+        return(array)
+
+    state = {}
+    state['iteration'] = iteration
+    state['numaccepted'] = header['numaccepted']
+    state['windowaccepted'] = header['windowaccepted']
+    state['numerrors'] = header.get('numerrors', 0)
+    state['currentlogpost'] = header['currentlogpost']
+    state['settings'] = header['settings']
+    state['rngstate'] = json.loads(header['rngstate'])
+    for key in ['state', 'inc']:
+        if key in state['rngstate'].get('state', {}):
+            state['rngstate']['state'][key] = int(state['rngstate']['state'][key])
+    state['currentvalues'] = readarray(nparams)
+    state['scale'] = readarray(nparams)
+
+    # rows after iteration are from a crash before the state file was replaced so I ignore them
+    drawsfile = getdrawsfile(filename)
+    rowsize = 8 * (nparams + 1)
+    if iteration > 0:
+        if not os.path.isfile(drawsfile) or os.path.getsize(drawsfile) < rowsize * iteration:
+            raise ValueError('Checkpoint draws file is missing or too short: ' + drawsfile + '.')
+        with open(drawsfile, 'rb') as f:
+            rowbytes = f.read(rowsize * iteration)
+    else:
+        rowbytes = b''
+    if zlib.crc32(rowbytes) != header['drawscrc']:
+        raise ValueError('Checkpoint draws file is corrupt (CRC mismatch): ' + drawsfile + '.')
+    rows = np.frombuffer(rowbytes, dtype = '<f8').astype(float).reshape([iteration, nparams + 1])
+    state['drawsiteration'] = iteration
+    state['drawscrc'] = header['drawscrc']
+
+    if numiterations is None:
+        numiterations = header['settings']['numiterations']
+    state['draws'] = np.full([numiterations, nparams], np.nan)
+    state['draws'][: iteration] = rows[:, : nparams]
+    state['logposts'] = np.full(numiterations, np.nan)
+    state['logposts'][: iteration] = rows[:, nparams]
+
+    return(state)
+
+
+def memmapcheckpoint(filename):
+    """
+    Return the draws (iterations reached x params) and log posteriors in a checkpoint as read-only memory maps so long chains can be read without loading them into memory.
+    This only reads the header so it does not check the CRCs.
+    """
+    header, position = readheader(filename)
+
+    iteration = header['iteration']
+    nparams = header['nparams']
+    if iteration == 0:
+        return(np.zeros([0, nparams]), np.zeros(0))
+    rows = np.memmap(getdrawsfile(filename), dtype = '<f8', mode = 'r', shape = (iteration, nparams + 1))
+
+    return(rows[:, : nparams], rows[:, nparams])
+
+
+# Sampler:{{{1
+def getrng(rngstate):
+    rng = np.random.default_rng()
+    rng.bit_generator.state = rngstate
+    return(rng)
+
+
+def metropolis_checkpoint(posteriorfunc, lowerboundlist, upperboundlist, scalelist, startvallist, numiterations = 1e5, checkpointfile = None, checkpointevery = 1000, checkpointseconds = None, seed = None, adaptiterations = 0, adaptevery = 100, targetacceptance = targetacceptance_default, raiseerror = False, printdetails = False):
+    """
+    Random walk Metropolis-Hastings on the log posterior posteriorfunc(values) with proposals outside the bounds rejected (like metropolis_bounds_do).
+    The proposal is the current value plus scale * standard normal for each parameter.
+
+    If checkpointfile is specified, the state is saved every checkpointevery iterations (and also every checkpointseconds seconds if specified) and at the end. If checkpointfile already exists and has the same settings, the chain continues from it.
+    If adaptiterations > 0, for the first adaptiterations iterations the scale is multiplied by exp(acceptance rate - targetacceptance) every adaptevery iterations.
+    If raiseerror is False (like metropolis_hastings), a proposal where posteriorfunc raises an error (for example the model can't be solved) is rejected. Otherwise the error is raised. Since a resumed chain repeats the same proposals, raising would stop the chain at the same draw every time it is resumed.
+
+    Returns a dict with draws (numiterations x params), logposts, acceptancerate, the number of proposals where posteriorfunc raised an error (numerrors) and the final scale.
+    """
+    numiterations = int(numiterations)
+    nparams = len(startvallist)
+    lowerbounds = np.array(lowerboundlist, dtype = float)
+    upperbounds = np.array(upperboundlist, dtype = float)
+
+    settings = {'numiterations': numiterations, 'lowerbounds': lowerbounds.tolist(), 'upperbounds': upperbounds.tolist(), 'startvals': [float(val) for val in startvallist], 'startscale': [float(val) for val in scalelist], 'seed': seed, 'adaptiterations': adaptiterations, 'adaptevery': adaptevery, 'targetacceptance': targetacceptance}
+
+    state = None
+    if checkpointfile is not None and os.path.isfile(checkpointfile):
+        state = loadcheckpoint(checkpointfile, numiterations = numiterations)
+        # JSON round trip so the comparison isn't affected by tuples vs lists etc.
+        if state['settings'] != json.loads(json.dumps(settings)):
+            raise ValueError('Checkpoint file ' + str(checkpointfile) + ' is for a chain with different settings. Delete it to start a new chain.')
+        if printdetails is True:
+            print('Resuming from iteration ' + str(state['iteration']) + '.')
+
+    if state is None:
+        currentvalues = np.array(startvallist, dtype = float)
+        state = {'iteration': 0, 'numaccepted': 0, 'windowaccepted': 0, 'numerrors': 0, 'currentvalues': currentvalues, 'currentlogpost': float(posteriorfunc(currentvalues.tolist())), 'scale': np.array(scalelist, dtype = float), 'draws': np.full([numiterations, nparams], np.nan), 'logposts': np.full(numiterations, np.nan), 'settings': settings, 'drawsiteration': 0, 'drawscrc': 0}
+        state['rngstate'] = np.random.default_rng(seed).bit_generator.state
+        if not np.isfinite(state['currentlogpost']):
+            raise ValueError('Log posterior is not finite at the starting values: ' + str(startvallist) + '.')
+
+    rng = getrng(state['rngstate'])
+    currentvalues = state['currentvalues']
+    currentlogpost = state['currentlogpost']
+    scale = state['scale']
+    numaccepted = state['numaccepted']
+    draws = state['draws']
+    logposts = state['logposts']
+    # acceptances in the current adaptation window
+    windowaccepted = state['windowaccepted']
+    numerrors = state['numerrors']
+
+    def checkpoint(iteration):
+        state.update({'iteration': iteration, 'numaccepted': numaccepted, 'windowaccepted': windowaccepted, 'numerrors': numerrors, 'currentvalues': currentvalues, 'currentlogpost': currentlogpost, 'scale': scale, 'rngstate': rng.bit_generator.state})
+        savecheckpoint(checkpointfile, state)
+
+    lastcheckpointtime = time.time()
+    for iteration in range(state['iteration'], numiterations):
+        # always draw the same random numbers each iteration so the stream doesn't depend on the bounds
+        proposal = currentvalues + scale * rng.standard_normal(nparams)
+        logu = np.log(rng.random())
+
+        if np.all(proposal >= lowerbounds) and np.all(proposal <= upperbounds):
+            try:
+                proposallogpost = float(posteriorfunc(proposal.tolist()))
+            except Exception:
+                if raiseerror is True:
+                    raise
+                # reject the proposal
+                proposallogpost = np.nan
+                numerrors = numerrors + 1
+            if np.isfinite(proposallogpost) and logu < proposallogpost - currentlogpost:
+                currentvalues = proposal
+                currentlogpost = proposallogpost
+                numaccepted = numaccepted + 1
+                windowaccepted = windowaccepted + 1
+
+        draws[iteration] = currentvalues
+        logposts[iteration] = currentlogpost
+
+        if iteration + 1 <= adaptiterations and (iteration + 1) % adaptevery == 0:
+            scale = scale * np.exp(windowaccepted / adaptevery - targetacceptance)
+            windowaccepted = 0
+
+        if checkpointfile is not None and iteration + 1 < numiterations:
+            if (iteration + 1) % checkpointevery == 0 or (checkpointseconds is not None and time.time() - lastcheckpointtime > checkpointseconds):
+                checkpoint(iteration + 1)
+                lastcheckpointtime = time.time()
+
+        if printdetails is True and (iteration + 1) % 1000 == 0:
+            print('Iteration ' + str(iteration + 1) + '. Acceptance rate: ' + str(numaccepted / (iteration + 1)) + '.')
+
+    if checkpointfile is not None:
+        checkpoint(numiterations)
+
+    retdict = {}
+    retdict['draws'] = draws
+    retdict['logposts'] = logposts
+    retdict['acceptancerate'] = numaccepted / numiterations if numiterations > 0 else np.nan
+    retdict['numerrors'] = numerrors
+    retdict['scale'] = scale
+    return(retdict)
+
+
+# Test:{{{1
+class TestInterrupt(BaseException):
+    """
+    Stands in for the process being killed (like KeyboardInterrupt, this isn't an Exception so the sampler doesn't catch it).
+    """
+    pass
+
+
+def checkpoint_test():
+    import tempfile
+
+    mean = np.array([0.3, 0.1])
+    sd = np.array([0.05, 0.02])
+
+    def posteriorfunc(values):
+        return(-0.5 * np.sum(((np.array(values) - mean) / sd) ** 2))
+
+    def interruptingposterior(stopafter):
+        calls = {'n': 0}
+        def f(values):
+            calls['n'] = calls['n'] + 1
+            if calls['n'] > stopafter:
+                raise TestInterrupt()
+            return(posteriorfunc(values))
+        return(f, calls)
+
+    args = [[0, 0], [1, 1], [0.02, 0.01], [0.3, 0.1]]
+    kwargs = {'numiterations': 5000, 'seed': 3, 'adaptiterations': 1000, 'adaptevery': 100, 'checkpointevery': 250}
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        # uninterrupted chain
+        full = metropolis_checkpoint(posteriorfunc, *args, checkpointfile = os.path.join(tempdir, 'full.ckpt'), **kwargs)
+
+        # interrupted twice then resumed
+        checkpointfile = os.path.join(tempdir, 'resume.ckpt')
+        for stopafter in [1234, 2100]:
+            f, calls = interruptingposterior(stopafter)
+            try:
+                metropolis_checkpoint(f, *args, checkpointfile = checkpointfile, **kwargs)
+                raise ValueError('Chain should have been interrupted.')
+            except TestInterrupt:
+                pass
+        f, calls = interruptingposterior(np.inf)
+        resumed = metropolis_checkpoint(f, *args, checkpointfile = checkpointfile, **kwargs)
+
+        if not np.array_equal(full['draws'], resumed['draws']) or not np.array_equal(full['logposts'], resumed['logposts']) or not np.array_equal(full['scale'], resumed['scale']) or full['acceptancerate'] != resumed['acceptancerate']:
+            raise ValueError('Resumed chain differs from the uninterrupted chain.')
+        # the posterior isn't recomputed at the resumed point and only the iterations after the last checkpoint are repeated
+        if calls['n'] >= 5000 - 2000:
+            raise ValueError('Resume recomputed too much: ' + str(calls['n']) + ' posterior calls.')
+
+        # the checkpoint holds the whole chain
+        state = loadcheckpoint(checkpointfile)
+        if state['iteration'] != 5000 or not np.array_equal(state['draws'], full['draws']):
+            raise ValueError('Final checkpoint does not contain the chain.')
+        if os.path.getsize(checkpointfile) > 2000 or os.path.getsize(getdrawsfile(checkpointfile)) != 5000 * 3 * 8:
+            raise ValueError('Checkpoint files have unexpected sizes: ' + str(os.path.getsize(checkpointfile)) + ' and ' + str(os.path.getsize(getdrawsfile(checkpointfile))) + ' bytes.')
+        draws, logposts = memmapcheckpoint(checkpointfile)
+        if not np.array_equal(draws, full['draws']) or not np.array_equal(logposts, full['logposts']):
+            raise ValueError('Memory mapped checkpoint does not contain the chain.')
+
+        # rows appended before a crash which replaced the state file are ignored and the chain continues correctly
+        crashfile = os.path.join(tempdir, 'crash.ckpt')
+        f, calls = interruptingposterior(1234)
+        try:
+            metropolis_checkpoint(f, *args, checkpointfile = crashfile, **kwargs)
+        except TestInterrupt:
+            pass
+        with open(getdrawsfile(crashfile), 'ab') as f:
+            f.write(np.ones(3 * 100).tobytes())
+        resumed = metropolis_checkpoint(posteriorfunc, *args, checkpointfile = crashfile, **kwargs)
+        if not np.array_equal(full['draws'], resumed['draws']) or os.path.getsize(getdrawsfile(crashfile)) != 5000 * 3 * 8:
+            raise ValueError('Chain not resumed correctly after rows were appended without a new state file.')
+
+        # a corrupt state file or draws file is detected
+        for corruptfile in [checkpointfile, getdrawsfile(checkpointfile)]:
+            with open(corruptfile, 'r+b') as f:
+                f.seek(100)
+                byte = f.read(1)
+                f.seek(100)
+                f.write(bytes([byte[0] ^ 1]))
+            try:
+                loadcheckpoint(checkpointfile)
+                raise RuntimeError('Corrupt checkpoint not detected: ' + corruptfile + '.')
+            except ValueError:
+                pass
+            with open(corruptfile, 'r+b') as f:
+                f.seek(100)
+                f.write(byte)
+
+        # different settings are not resumed
+        try:
+            metropolis_checkpoint(posteriorfunc, *args, checkpointfile = os.path.join(tempdir, 'full.ckpt'), **dict(kwargs, seed = 4))
+            raise RuntimeError('Checkpoint with different settings was resumed.')
+        except ValueError:
+            pass
+
+    # a posterior which raises errors on part of the support (like the likelihood when the model can't be solved)
+    def failingposterior(values):
+        if values[0] > 0.35:
+            raise ValueError('Model could not be solved.')
+        if values[1] > 0.12:
+            raise np.linalg.LinAlgError('Singular matrix.')
+        return(posteriorfunc(values))
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        failing = metropolis_checkpoint(failingposterior, *args, checkpointfile = os.path.join(tempdir, 'failing.ckpt'), **kwargs)
+        if failing['numerrors'] == 0 or np.any(failing['draws'][:, 0] > 0.35) or np.any(failing['draws'][:, 1] > 0.12):
+            raise ValueError('Proposals where the posterior raised an error were not rejected.')
+        if loadcheckpoint(os.path.join(tempdir, 'failing.ckpt'))['numerrors'] != failing['numerrors']:
+            raise ValueError('Number of errors not saved in the checkpoint.')
+        try:
+            metropolis_checkpoint(failingposterior, *args, raiseerror = True, **kwargs)
+            raise RuntimeError('Error not raised with raiseerror = True.')
+        except ValueError:
+            pass
+
+    if np.max(np.abs(np.mean(full['draws'][1000: ], axis = 0) - mean) / sd) > 0.5:
+        raise ValueError('Chain does not recover the posterior mean: ' + str(np.mean(full['draws'][1000: ], axis = 0)) + '.')
+
+    print('Checkpoint test passed. Acceptance rate: ' + str(full['acceptancerate']) + '.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    checkpoint_test()
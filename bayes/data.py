@@ -189,7 +189,11 @@ def getreplacedict_bayesian_aux(paramnames, paramvalues):
     return(p)
 
 
-def getrealdata():
+def getrealdata(dropna = True):
+    """
+    The sample is 1960Q1 - 1999Q4.
+    If dropna is False, I don't cut the sample at 1999Q4 and keep every period from 1960Q1 where at least one of Ygr and Cgr is observed. GDP ends in 2016Q4 and consumption in 2019Q2 so the end of the sample only has Cgr and Ygr is NaN. This data can only be used with a likelihood which allows for missing values (missingdata = True in dobayes_dsge).
+    """
     import pandas as pd
     import statsmodels.api as sm
 
@@ -229,7 +233,11 @@ def getrealdata():
 
     # limit to 1960Q1 - 1999Q4
     dfq = dfq[dfq['time'] >= 1960 * 4]
-    dfq = dfq[dfq['time'] < 2000 * 4]
+    if dropna is True:
+        dfq = dfq[dfq['time'] < 2000 * 4]
+    else:
+        # keep the ragged edge at the end where only one of the series is observed
+        dfq = dfq[dfq['Ygr'].notna() | dfq['Cgr'].notna()]
 
     # limit to only Ygr, Cgr
     dfq = dfq[['Ygr', 'Cgr']]
@@ -271,10 +279,59 @@ def getsimdata(varnames, numperiods = 100):
     return(data)
 
     
-def dobayes_dsge(usesimdata = False):
+def getpriordetails_bayes():
+    """
+    Priors for the estimated parameters (RHO, BETA, ALPHA) in dobayes_dsge.
+    Return priorlist_parameters and the means, standard deviations, lower bounds and upper bounds of the priors.
+    """
+    # I impose a relatively strict prior on BETA (the second element) since otherwise Metropolis-Hastings picks a very high BETA
+    priorlist_meansd = [['beta', 0.9, 0.05], ['normal', 0.95, 0.005], ['normal', 0.3, 0.05]]
+    # get a priorlist based upon parameters rather than means and standard deviations
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
+    from bayesian_func import getpriorlist_convert
+    priorlist_parameters = getpriorlist_convert(priorlist_meansd)
+    # get details on priors
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
+    from bayesian_func import getpriorlistdetails_parameters
+    prior_means, prior_sds, prior_lbs, prior_ubs = getpriorlistdetails_parameters(priorlist_parameters)
+
+    return(priorlist_parameters, prior_means, prior_sds, prior_lbs, prior_ubs)
+
+
+def getdeterminacymap_bayes(numgrid = 11, numrefine = 4, numsds = 4):
+    """
+    Map the determinacy region over the estimated parameters (RHO, BETA, ALPHA) within the bounds of the priors.
+    Where a prior is unbounded (the normal priors on BETA and ALPHA) I use the prior mean plus or minus numsds prior standard deviations instead.
+    Draws outside the map are never screened out so this only affects how much of the posterior the screening covers.
+    """
+    paramnames = ['RHO', 'BETA', 'ALPHA']
+    priorlist_parameters, prior_means, prior_sds, prior_lbs, prior_ubs = getpriordetails_bayes()
+    lowerbounds = [prior_lbs[i] if prior_lbs[i] is not None and np.isfinite(prior_lbs[i]) else prior_means[i] - numsds * prior_sds[i] for i in range(len(paramnames))]
+    upperbounds = [prior_ubs[i] if prior_ubs[i] is not None and np.isfinite(prior_ubs[i]) else prior_means[i] + numsds * prior_sds[i] for i in range(len(paramnames))]
+
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from determinacy_func import getmatricesfunc_lazy
+    getmatricesfunc = getmatricesfunc_lazy(getinputdict_full, paramnames)
+
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from determinacy_func import getdeterminacymap
+    return(getdeterminacymap(getmatricesfunc, paramnames, lowerbounds, upperbounds, numgrid = numgrid, numrefine = numrefine))
+
+
+def dobayes_dsge(usesimdata = False, profile = False, determinacymap = None, missingdata = False):
+    """
+    If profile is True, print the time spent in the likelihood, the prior and the posterior.
+    If missingdata is True, I use all periods where either Ygr or Cgr is observed and the likelihood from bayes/kalman_func.py which skips missing values.
+    If determinacymap is specified (for example from getdeterminacymap_bayes), draws which are clearly outside the determinate region are rejected without solving the model.
+    """
     # get same every time
     np.random.seed(41)
 
+    if profile is True:
+        sys.path.append(str(__projectdir__ / Path('runtime')))
+        from profiling_func import enable
+        enable()
+
     # get likelihood function:{{{
 
     # get inputdict with fxe_f etc. functions
@@ -290,27 +347,25 @@ def dobayes_dsge(usesimdata = False):
     if usesimdata is True:
         data = getsimdata(varnames, numperiods = 160)
     else:
-        data = getrealdata()
+        data = getrealdata(dropna = not missingdata)
 
     # get log-likelihood function
     # input parameters into this function and return log-likelihood (without priors)
-    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
-    from dsge_bayes_func import getbayes_dsge_logl_aux
-    loglikelihoodfunc = functools.partial(getbayes_dsge_logl_aux, inputdict, getreplacedict_bayesian, data, varnames)
+    if missingdata is True:
+        sys.path.append(str(__projectdir__ / Path('bayes')))
+        from posteriorpredictive_func import getsolvefunc_data
+        sys.path.append(str(__projectdir__ / Path('bayes')))
+        from kalman_func import getloglfunc_solved
+        loglikelihoodfunc = getloglfunc_solved(getsolvefunc_data(paramnames), data)
+    else:
+        sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+        from dsge_bayes_func import getbayes_dsge_logl_aux
+        loglikelihoodfunc = functools.partial(getbayes_dsge_logl_aux, inputdict, getreplacedict_bayesian, data, varnames)
 
     # }}}
 
     # get prior function and info:{{{
-    # I impose a relatively strict prior on BETA (the second element) since otherwise Metropolis-Hastings picks a very high BETA
-    priorlist_meansd = [['beta', 0.9, 0.05], ['normal', 0.95, 0.005], ['normal', 0.3, 0.05]]
-    # get a priorlist based upon parameters rather than means and standard deviations
-    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
-    from bayesian_func import getpriorlist_convert
-    priorlist_parameters = getpriorlist_convert(priorlist_meansd)
-    # get details on priors
-    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
-    from bayesian_func import getpriorlistdetails_parameters
-    prior_means, prior_sds, prior_lbs, prior_ubs = getpriorlistdetails_parameters(priorlist_parameters)
+    priorlist_parameters, prior_means, prior_sds, prior_lbs, prior_ubs = getpriordetails_bayes()
     # get a density function for the priors - this is NOT log
     sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
     from bayesian_func import getpriordensityfunc_aux
@@ -324,6 +379,18 @@ def dobayes_dsge(usesimdata = False):
         Note that we log the prior function
         """
         return(np.log(priorfunc(values)) + loglikelihoodfunc(values))
+
+    # time each part (does nothing unless profiling is enabled)
+    sys.path.append(str(__projectdir__ / Path('runtime')))
+    from profiling_func import timed
+    loglikelihoodfunc = timed('likelihood', loglikelihoodfunc)
+    priorfunc = timed('prior', priorfunc)
+    posteriorfunc = timed('posterior', posteriorfunc)
+
+    if determinacymap is not None:
+        sys.path.append(str(__projectdir__ / Path('bayes')))
+        from determinacy_func import screenposterior
+        posteriorfunc = screenposterior(posteriorfunc, determinacymap)
     # }}}
 
     # implement metropolis-hastings:{{{
@@ -331,6 +398,11 @@ def dobayes_dsge(usesimdata = False):
     from bayesian_func import metropolis_hastings
     results = metropolis_hastings(posteriorfunc, scalelist, prior_means, 1000, lowerboundlist = prior_lbs, upperboundlist = prior_ubs, printdetails = True, logposterior = True, raiseerror = False)
     print(np.mean(np.array(results)[100: , :], axis = 0))
+
+    if profile is True:
+        sys.path.append(str(__projectdir__ / Path('runtime')))
+        from profiling_func import printstats
+        printstats()
     # }}}
 
 
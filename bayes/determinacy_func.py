@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Map the region of the estimated parameters where the model has a unique stable solution so the sampler can skip draws outside it without calling the solver.
+
+For parameters theta the model is fxp E[x'] + fyp E[y'] + fx x + fy y = 0. Writing A = -[fxp fyp] and B = [fx fy], the solution is unique (Blanchard-Kahn) if the number of generalized eigenvalues lambda of B w = lambda A w inside the unit circle equals the number of states nx. Each point is classified as:
+- 1: determinate (nstable == nx)
+- 2: indeterminate (nstable > nx)
+- 0: no stable solution (nstable < nx)
+- -1: the matrices could not be computed (for example the steady state doesn't exist)
+
+Batched eigenvalue counts:
+gxhx does a QZ decomposition for each parameter value but scipy has no batched QZ. I only need the number of stable eigenvalues so I use a shift: with sigma not an eigenvalue, the eigenvalues nu of (B - sigma A)^{-1} A are nu = 1 / (lambda - sigma) (infinite lambda gives nu = 0). Then every point in a batch is one np.linalg.solve and one np.linalg.eigvals on stacked arrays. If B - sigma A is badly conditioned at a point I fall back to scipy.linalg.eigvals(B, A) (QZ) for that point.
+
+Map:
+I classify a coarse grid over the parameter bounds and then refine adaptively: wherever two neighbouring points have different classes I add the midpoint (and the points halfway to the other diagonal neighbours) and repeat with half the spacing. The points are stored in a cKDTree (in coordinates scaled to [0, 1]) so a query is a nearest neighbour lookup.
+Since the map is only accurate to the finest spacing, isclearlyoutside only returns True if the nearest point is outside the determinate region and there is no determinate point within the diagonal of the finest grid cell. Points near the boundary still go to the full solver.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import itertools
+
+import numpy as np
+
+# shift for the eigenvalue counts (chosen to be unlikely to be an eigenvalue)
+sigma_default = 1.7319
+# eigenvalues within this distance of the unit circle are treated as unstable (as a unit root)
+unitcircletol_default = 1e-8
+
+# Eigenvalue Counts:{{{1
+def countstable_batch(fx, fxp, fy, fyp, sigma = sigma_default, tol = unitcircletol_default, maxcond = 1e10):
+    """
+    fx, fxp, fy, fyp are stacked arrays (numpoints x equations x variables).
+    Returns the number of stable eigenvalues at each point.
+    """
+    import scipy.linalg
+
+    A = -np.concatenate((fxp, fyp), axis = 2)
+    B = np.concatenate((fx, fy), axis = 2)
+    numpoints = np.shape(A)[0]
+
+    nstable = np.empty(numpoints, dtype = int)
+
+    C = B - sigma * A
+    cond = np.linalg.cond(C)
+    good = np.isfinite(cond) & (cond < maxcond)
+
+    if np.any(good):
+        nu = np.linalg.eigvals(np.linalg.solve(C[good], A[good]))
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            lambdas = sigma + 1 / nu
+        # nu = 0 is an infinite eigenvalue which is unstable
+        stable = np.isfinite(lambdas) & (np.abs(lambdas) < 1 - tol)
+        nstable[good] = np.sum(stable, axis = 1)
+
+    for i in np.where(~good)[0]:
+        lambdas = scipy.linalg.eigvals(B[i], A[i])
+        nstable[i] = np.sum(np.isfinite(lambdas) & (np.abs(lambdas) < 1 - tol))
+
+    return(nstable)
+
+
+def classify(nstable, nx):
+    return(np.where(nstable == nx, 1, np.where(nstable > nx, 2, 0)))
+
+
+def classifypoints(getmatricesfunc, points, sigma = sigma_default):
+    """
+    getmatricesfunc(values) returns fx, fxp, fy, fyp for the parameter values values.
+    points: numpoints x numparams
+    """
+    matrices = []
+    ok = []
+    for values in points:
+        try:
+            fx, fxp, fy, fyp = getmatricesfunc(list(values))
+            fx, fxp, fy, fyp = [np.asarray(matrix, dtype = float) for matrix in (fx, fxp, fy, fyp)]
+            if not all([np.all(np.isfinite(matrix)) for matrix in (fx, fxp, fy, fyp)]):
+                raise ValueError('Nonfinite derivatives.')
+            matrices.append((fx, fxp, fy, fyp))
+            ok.append(True)
+        except Exception:
+            ok.append(False)
+
+    ok = np.array(ok, dtype = bool)
+    classes = -np.ones(len(points), dtype = int)
+    if np.any(ok):
+        stacked = [np.stack([m[j] for m in matrices]) for j in range(4)]
+        nx = np.shape(stacked[0])[2]
+        classes[ok] = classify(countstable_batch(*stacked, sigma = sigma), nx)
+
+    return(classes)
+
+
+# Map:{{{1
+class DeterminacyMap(object):
+    """
+    Nearest neighbour lookup of the class of parameter values.
+    """
+    def __init__(self, paramnames, lowerbounds, upperbounds, points, classes, finestspacing):
+        from scipy.spatial import cKDTree
+
+        self.paramnames = list(paramnames)
+        self.lowerbounds = np.asarray(lowerbounds, dtype = float)
+        self.upperbounds = np.asarray(upperbounds, dtype = float)
+        self.points = np.asarray(points, dtype = float)
+        self.classes = np.asarray(classes, dtype = int)
+        self.finestspacing = finestspacing
+        self.tree = cKDTree(self.scale(self.points))
+        if np.any(self.classes == 1):
+            self.tree_determinate = cKDTree(self.scale(self.points[self.classes == 1]))
+        else:
+            self.tree_determinate = None
+
+    def scale(self, values):
+        return((np.asarray(values, dtype = float) - self.lowerbounds) / (self.upperbounds - self.lowerbounds))
+
+    def query(self, values):
+        """
+        Class of the nearest mapped point. values can be one point or numpoints x numparams.
+        """
+        distance, index = self.tree.query(self.scale(values))
+        return(self.classes[index])
+
+    def isclearlyoutside(self, values):
+        """
+        True if the nearest mapped point is outside the determinate region and no determinate point is within the diagonal of the finest grid cell.
+        """
+        scaled = self.scale(values)
+        if np.any(scaled < 0) or np.any(scaled > 1):
+            return(False)
+        distance, index = self.tree.query(scaled)
+        if self.classes[index] == 1:
+            return(False)
+        if self.tree_determinate is None:
+            return(True)
+        distance, index = self.tree_determinate.query(scaled)
+        return(bool(distance > 1.01 * self.finestspacing * np.sqrt(len(scaled))))
+
+    def save(self, filename):
+        filename = str(filename)
+        if not filename.endswith('.npz'):
+            filename = filename + '.npz'
+        tempfilename = filename[: -4] + '_temp.npz'
+        np.savez(tempfilename, paramnames = np.array(self.paramnames, dtype = str), lowerbounds = self.lowerbounds, upperbounds = self.upperbounds, points = self.points, classes = self.classes, finestspacing = self.finestspacing)
+        os.replace(tempfilename, filename)
+
+
+def loaddeterminacymap(filename):
+    data = np.load(filename)
+    return(DeterminacyMap([str(name) for name in data['paramnames']], data['lowerbounds'], data['upperbounds'], data['points'], data['classes'], float(data['finestspacing'])))
+
+
+def getdeterminacymap(getmatricesfunc, paramnames, lowerbounds, upperbounds, numgrid = 11, numrefine = 4, printdetails = False):
+    """
+    Classify a grid of numgrid points in each dimension and refine numrefine times along the boundaries.
+    """
+    from scipy.spatial import cKDTree
+
+    lowerbounds = np.asarray(lowerbounds, dtype = float)
+    upperbounds = np.asarray(upperbounds, dtype = float)
+    numparams = len(paramnames)
+
+    # work in coordinates scaled to [0, 1]
+    grid1d = np.linspace(0, 1, numgrid)
+    scaledpoints = np.array(list(itertools.product(*[grid1d] * numparams)))
+    classes = classifypoints(getmatricesfunc, lowerbounds + scaledpoints * (upperbounds - lowerbounds))
+
+    spacing = 1 / (numgrid - 1)
+    # offsets to the neighbours of a point (including diagonals)
+    offsets = np.array([offset for offset in itertools.product([-1, 0, 1], repeat = numparams) if any(offset)])
+
+    for level in range(numrefine):
+        tree = cKDTree(scaledpoints)
+        pairs = tree.query_pairs(spacing * np.sqrt(numparams) * 1.01, output_type = 'ndarray')
+        boundarypairs = pairs[classes[pairs[:, 0]] != classes[pairs[:, 1]]]
+        boundarypoints = np.unique(boundarypairs.flatten())
+        if len(boundarypoints) == 0:
+            break
+
+        # new points at half the spacing around each boundary point
+        newpoints = (scaledpoints[boundarypoints][:, None, :] + offsets[None, :, :] * spacing / 2).reshape([-1, numparams])
+        newpoints = newpoints[np.all((newpoints >= 0) & (newpoints <= 1), axis = 1)]
+        newpoints = np.unique(np.round(newpoints, 12), axis = 0)
+        # drop points already classified
+        distance, index = tree.query(newpoints)
+        newpoints = newpoints[distance > spacing * 1e-6]
+
+        newclasses = classifypoints(getmatricesfunc, lowerbounds + newpoints * (upperbounds - lowerbounds))
+        scaledpoints = np.concatenate((scaledpoints, newpoints), axis = 0)
+        classes = np.concatenate((classes, newclasses))
+        spacing = spacing / 2
+
+        if printdetails is True:
+            print('Level ' + str(level + 1) + ': ' + str(len(boundarypoints)) + ' boundary points, ' + str(len(newpoints)) + ' new points.')
+
+    return(DeterminacyMap(paramnames, lowerbounds, upperbounds, lowerbounds + scaledpoints * (upperbounds - lowerbounds), classes, spacing))
+
+
+def screenposterior(posteriorfunc, determinacymap):
+    """
+    Return a log-posterior which is -inf for values which are clearly outside the determinate region without calling posteriorfunc.
+    """
+    sys.path.append(str(__projectdir__ / Path('runtime')))
+    from profiling_func import count
+
+    def posteriorfunc_screened(values):
+        if determinacymap.isclearlyoutside(values):
+            count('determinacy_screened')
+            return(-np.inf)
+        return(posteriorfunc(values))
+
+    return(posteriorfunc_screened)
+
+
+# Models:{{{1
+def getmatricesfunc_lazy(getinputdictfunc, paramnames):
+    """
+    getmatricesfunc for a model given by getinputdictfunc(p) (like getinputdict_full in bayes/data.py).
+    The equations are only differentiated once (see dsgesetup/lazymodel_func.py).
+    """
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from lazymodel_func import getlazymodel
+
+    model = getlazymodel(getinputdictfunc())
+
+    def getmatricesfunc(values):
+        inputdict = getinputdictfunc({paramnames[i]: values[i] for i in range(len(paramnames))})
+        model.update({'paramssdict': inputdict['paramssdict'], 'varssdict': inputdict['varssdict']})
+        return(model['nfxe'], model['nfxep'], model['nfy'], model['nfyp'])
+
+    return(getmatricesfunc)
+
+
+def getmatricesfunc_model_func(estimatevars):
+    """
+    getmatricesfunc for the model in bayes/model_func.py.
+    """
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getnumderivs_unknownparams
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getparamexogdict
+    r = getnumderivs_unknownparams(getparamexogdict(), estimatevars)
+    return(lambda values: r['fxfy_f'](*values))
+
+
+# Test:{{{1
+def determinacy_test():
+    import scipy.linalg
+
+    # batched counts match QZ
+    rng = np.random.default_rng(1)
+    fx, fxp, fy, fyp = [rng.standard_normal([50, 4, n]) for n in [2, 2, 2, 2]]
+    nstable = countstable_batch(fx, fxp, fy, fyp)
+    for i in range(50):
+        lambdas = scipy.linalg.eigvals(np.concatenate((fx[i], fy[i]), axis = 1), -np.concatenate((fxp[i], fyp[i]), axis = 1))
+        if nstable[i] != np.sum(np.abs(lambdas) < 1 - unitcircletol_default):
+            raise ValueError('Batched stable eigenvalue count differs from QZ.')
+
+    # rbc_simple over RHO and ALPHA: there is no stable solution when RHO > 1
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+    paramnames = ['RHO', 'ALPHA']
+    getmatricesfunc = getmatricesfunc_lazy(lambda p = None: getinputdict(p = p), paramnames)
+    dmap = getdeterminacymap(getmatricesfunc, paramnames, [0.5, 0.1], [1.5, 0.6], numgrid = 6, numrefine = 4)
+
+    testpoints = np.column_stack((rng.uniform(0.5, 1.5, 200), rng.uniform(0.1, 0.6, 200)))
+    truth = np.where(testpoints[:, 0] < 1, 1, 0)
+    accuracy = np.mean(dmap.query(testpoints) == truth)
+    if accuracy < 0.97:
+        raise ValueError('Determinacy map accuracy too low: ' + str(accuracy) + '.')
+    # screening never rejects a determinate point
+    for i in range(len(testpoints)):
+        if truth[i] == 1 and dmap.isclearlyoutside(testpoints[i]):
+            raise ValueError('Screening rejected a determinate point.')
+    if not dmap.isclearlyoutside([1.4, 0.3]) or dmap.isclearlyoutside([0.9, 0.3]):
+        raise ValueError('Screening wrong away from the boundary.')
+
+    print('Mapped points: ' + str(len(dmap.points)) + '. Accuracy: ' + str(accuracy) + '.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    determinacy_test()
@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+"""
+Kalman filter, Durbin-Koopman disturbance smoother and historical shock decompositions for the linear models in bayes/.
+
+The model is in the z = [states; shocks] form of dsge_bkdiscrete/moments_func.py with observables:
+z_t = hx z_{t-1} + eta epsilon_t, epsilon_t ~ N(0, I)
+y_t = G z_t + u_t, u_t ~ N(0, H)
+where H is the (diagonal) variance of the measurement error or None if there is none.
+The filter starts from the stationary distribution of z_0.
+
+kalmanfilter keeps what the smoother needs (the innovations v_t, F_t^{-1} v_t, the gains and the predicted states and variances) so kalmansmoother doesn't redo any of the filter. F_t is only ever used through its Cholesky factor and no matrix is inverted.
+Once the predicted variance has converged (which it does quickly with a complete panel) the gain and variances are fixed so the rest of the filter and smoother are just matrix-vector products and only the variances up to convergence are stored. So long samples (T ~ 10^4) are fast.
+
+Missing observations are NaN in y. The periods are grouped by which observables are missing and the observed rows of G and H are selected once for each pattern. With a regular pattern (for example a quarterly variable in a monthly model) the variance converges separately in each position of the cycle and each converged gain is then reused, so the number of stored variances doesn't grow with T.
+Mixed frequency observables which are sums or averages over several periods are handled by aggregatestatespace, which adds lags of the observables to the state.
+
+The smoother gives the smoothed z_t and epsilon_t, the smoothed z_0 and the smoothed measurement error. These satisfy z_t = hx z_{t-1} + eta epsilon_t and y_t = G z_t + u_t so the observables split into:
+- the contribution of each shock in epsilon (for example epsilon_a, epsilon_cobs, epsilon_yobs)
+- the contribution of each measurement error in H (for example ME_c, ME_y)
+- the contribution of the initial conditions z_0
+which add up to the data (exactly before the filter converges and up to about steadystatetol relative to the data times the number of periods after).
+
+Models are given by a solved dict like those returned by the solve functions in bayes/posteriorpredictive_func.py (getsolvefunc_model_func for the c/y model and getsolvefunc_data for the Ygr/Cgr model). shockdecomp_batch computes the decomposition for many posterior draws across a process pool.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+# change in the predicted variance relative to its largest element below which the filter is treated as converged
+steadystatetol_default = 1e-11
+# per process cache of solve functions built in the pool
+solvecache = {}
+
+# State Space:{{{1
+def getkalmanstatespace(solved, aggregation = None):
+    """
+    hx, eta, G, H and the names of the contributions from a solved dict (see bayes/posteriorpredictive_func.py).
+    aggregation: {observed variable: weights} for observables which are temporal aggregates (see aggregatestatespace). Then hx, eta and G are for the augmented state.
+    """
+    obsrows = [solved['varnames'].index(var) for var in solved['observed']]
+    mesd = np.array(solved.get('mesd', np.zeros(len(obsrows))), dtype = float)
+
+    statespace = {}
+    statespace['hx'] = np.array(solved['hx'], dtype = float)
+    statespace['eta'] = np.array(solved['eta'], dtype = float)
+    statespace['G'] = np.array(solved['M'], dtype = float)[obsrows]
+    statespace['H'] = np.diag(mesd ** 2) if np.any(mesd != 0) else None
+    statespace['shocks'] = list(solved['shocks'])
+    statespace['observed'] = list(solved['observed'])
+    # only measurement errors which are there get a contribution
+    statespace['measurementerrors'] = ['ME_' + solved['observed'][i] for i in range(len(obsrows)) if mesd[i] != 0]
+
+    if aggregation is not None:
+        weightsdict = {statespace['observed'].index(var): aggregation[var] for var in aggregation}
+        statespace['hx'], statespace['eta'], statespace['G'] = aggregatestatespace(statespace['hx'], statespace['eta'], statespace['G'], weightsdict)
+
+    return(statespace)
+
+
+def getstationaryvariance(hx, eta):
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from moments_func import getvarcov_z
+    return(getvarcov_z(hx, eta))
+
+
+# Missing Data:{{{1
+def getpatterns(y):
+    """
+    Group the periods by which observables are observed (not NaN).
+    Returns a list with a dict for each pattern (the rows observed and the periods with that pattern) and the pattern index of each period.
+    """
+    observedmask = ~np.isnan(y)
+    masks, patternindex = np.unique(observedmask, axis = 0, return_inverse = True)
+    patternindex = np.asarray(patternindex).reshape(-1)
+
+    patterns = []
+    for i in range(len(masks)):
+        patterns.append({'mask': masks[i], 'rows': np.flatnonzero(masks[i]), 'periods': np.flatnonzero(patternindex == i)})
+    return(patterns, patternindex)
+
+
+def aggregatestatespace(hx, eta, G, weightsdict):
+    """
+    Temporal aggregation for mixed frequency data.
+    weightsdict: {observable index: weights}. The observable is then observed as sum_k weights[k] (G z)_{t - k} rather than (G z)_t.
+    For example with a monthly model, a quarterly average is {i: [1 / 3, 1 / 3, 1 / 3]} and the data should be NaN except in the last month of each quarter. A quarterly stock variable doesn't need aggregation (just NaN in the other months).
+    I add the lags of the aggregated observables to the state so the augmented model can be used in kalmanfilter and kalmansmoother like any other.
+    Returns the augmented hx, eta and G.
+    """
+    rows = sorted(weightsdict)
+    if len(rows) == 0:
+        return(hx, eta, G)
+    maxlag = max([len(weightsdict[row]) for row in rows]) - 1
+    n = np.shape(hx)[0]
+    nr = len(rows)
+    naug = n + maxlag * nr
+    G_R = G[rows]
+
+    hx_aug = np.zeros([naug, naug])
+    hx_aug[: n, : n] = hx
+    if maxlag > 0:
+        # the first lag block is G_R z_{t-1}
+        hx_aug[n: n + nr, : n] = G_R
+        # each further lag block is the previous block last period
+        for k in range(1, maxlag):
+            hx_aug[n + k * nr: n + (k + 1) * nr, n + (k - 1) * nr: n + k * nr] = np.eye(nr)
+
+    eta_aug = np.concatenate((eta, np.zeros([maxlag * nr, np.shape(eta)[1]])), axis = 0)
+
+    G_aug = np.concatenate((G, np.zeros([np.shape(G)[0], maxlag * nr])), axis = 1)
+    for j in range(nr):
+        weights = weightsdict[rows[j]]
+        G_aug[rows[j], : n] = weights[0] * G_R[j]
+        for k in range(1, len(weights)):
+            G_aug[rows[j], n + (k - 1) * nr + j] = weights[k]
+
+    return(hx_aug, eta_aug, G_aug)
+
+
+# Filter:{{{1
+def kalmanfilter(y, hx, eta, G, H = None, steadystatetol = steadystatetol_default):
+    """
+    y: T x observables. Missing values are NaN.
+    Returns a dict with the log-likelihood (ll), the filtered states (z_t_t) and the stored quantities used by kalmansmoother.
+
+    The observed rows of G and H are selected once for each pattern of missing values rather than every period.
+    Each predicted variance P is stored once with its pattern, gain and the Cholesky factor of F. After computing the next P, I compare it to the last stored variance with the next period's pattern. If they are the same (up to steadystatetol), I reuse that entry and link to it so the same step later on doesn't even need the comparison. So:
+    - with a complete panel the filter stops updating P once it converges
+    - with a regular pattern (for example a quarterly variable in a monthly model) each position in the cycle converges and is then reused
+    - after an irregular gap P is updated until it converges back
+    The stored innovations, F^{-1} v and gains are zero for the observables which are missing in a period.
+    """
+    import scipy.linalg
+
+    y = np.asarray(y, dtype = float)
+    T, N = np.shape(y)
+    n = np.shape(hx)[0]
+    etaeta = eta @ eta.transpose()
+    if H is None:
+        H = np.zeros([N, N])
+
+    patterns, patternindex = getpatterns(y)
+    for pattern in patterns:
+        pattern['G'] = G[pattern['rows']]
+        pattern['H'] = H[np.ix_(pattern['rows'], pattern['rows'])]
+
+    P0 = getstationaryvariance(hx, eta)
+    a = np.zeros(n)
+
+    # stored for the smoother
+    a_pred = np.empty([T, n])
+    v = np.zeros([T, N])
+    Finv_v = np.zeros([T, N])
+    z_t_t = np.empty([T, n])
+    # each stored predicted variance with its pattern
+    # storeindex[t] is the entry used in period t
+    entries = []
+    # pattern -> last entry with that pattern
+    lastentry = {}
+
+    def addentry(P, patternnum):
+        pattern = patterns[patternnum]
+        rows = pattern['rows']
+        entry = {'P': P, 'pattern': patternnum, 'gain': np.zeros([n, N]), 'next': {}}
+        if len(rows) > 0:
+            PGt = P @ pattern['G'].transpose()
+            F = pattern['G'] @ PGt + pattern['H']
+            entry['Fchol'] = scipy.linalg.cho_factor(F, lower = True)
+            entry['logdetF'] = 2 * np.sum(np.log(np.diag(entry['Fchol'][0])))
+            # P G' F^{-1}
+            entry['gain'][:, rows] = scipy.linalg.cho_solve(entry['Fchol'], PGt.transpose()).transpose()
+            P_t_t = P - entry['gain'][:, rows] @ PGt.transpose()
+        else:
+            P_t_t = P
+        P_next = hx @ P_t_t @ hx.transpose() + etaeta
+        entry['P_next'] = (P_next + P_next.transpose()) / 2
+        entries.append(entry)
+        lastentry[patternnum] = len(entries) - 1
+        return(len(entries) - 1)
+
+    storeindex = np.empty(T, dtype = int)
+    e = None
+
+    ll = 0
+    for t in range(T):
+        q = patternindex[t]
+        if e is None:
+            e = addentry(P0, q)
+        elif q in entries[e]['next']:
+            e = entries[e]['next'][q]
+        else:
+            P_next = entries[e]['P_next']
+            f = lastentry.get(q)
+            if f is None or np.max(np.abs(P_next - entries[f]['P'])) > steadystatetol * np.max(np.abs(P_next)):
+                f = addentry(P_next, q)
+            entries[e]['next'][q] = f
+            e = f
+        storeindex[t] = e
+        entry = entries[e]
+
+        rows = patterns[q]['rows']
+        a_pred[t] = a
+        if len(rows) > 0:
+            v[t, rows] = y[t, rows] - patterns[q]['G'] @ a
+            Finv_v[t, rows] = scipy.linalg.cho_solve(entry['Fchol'], v[t, rows])
+            ll = ll - 0.5 * (len(rows) * np.log(2 * np.pi) + entry['logdetF'] + v[t, rows] @ Finv_v[t, rows])
+        z_t_t[t] = a + entry['gain'] @ v[t]
+        a = hx @ z_t_t[t]
+
+    filtered = {}
+    filtered['ll'] = ll
+    filtered['z_t_t'] = z_t_t
+    filtered['a_pred'] = a_pred
+    filtered['v'] = v
+    filtered['Finv_v'] = Finv_v
+    filtered['P_pred'] = np.array([entry['P'] for entry in entries])
+    filtered['gains'] = np.array([entry['gain'] for entry in entries])
+    filtered['storeindex'] = storeindex
+    filtered['P0'] = P0
+    filtered['model'] = {'hx': hx, 'eta': eta, 'G': G, 'H': H}
+
+    return(filtered)
+
+
+def getloglfunc_solved(solvefunc, y, aggregation = None):
+    """
+    Log-likelihood function of the parameter values for a solve function (like those in bayes/posteriorpredictive_func.py).
+    y can have missing values (NaN) and aggregation is as in getkalmanstatespace.
+    """
+    y = np.asarray(y, dtype = float)
+
+    def loglfunc(values):
+        statespace = getkalmanstatespace(solvefunc(list(values)), aggregation = aggregation)
+        return(kalmanfilter(y, statespace['hx'], statespace['eta'], statespace['G'], H = statespace['H'])['ll'])
+
+    return(loglfunc)
+
+
+# Smoother:{{{1
+def kalmansmoother(filtered):
+    """
+    Durbin-Koopman disturbance smoother using the quantities stored by kalmanfilter.
+    Returns a dict with the smoothed z_t (zhat), epsilon_t (epsilonhat), measurement error u_t (uhat) and z_0 (z0hat).
+    The smoothed measurement error is zero for missing observations.
+    """
+    hx = filtered['model']['hx']
+    eta = filtered['model']['eta']
+    G = filtered['model']['G']
+    H = filtered['model']['H']
+    a_pred = filtered['a_pred']
+    Finv_v = filtered['Finv_v']
+    P_pred = filtered['P_pred']
+    gains = filtered['gains']
+    storeindex = filtered['storeindex']
+    T, n = np.shape(a_pred)
+
+    zhat = np.empty([T, n])
+    epsilonhat = np.empty([T, np.shape(eta)[1]])
+    uhat = np.empty([T, np.shape(G)[0]])
+
+    # L = hx (I - gain G) for each stored gain (the gains are zero in the missing columns so the full G can be used)
+    Ls = hx[np.newaxis, :, :] - np.einsum('ij,ejk,kl->eil', hx, gains, G)
+    r = np.zeros(n)
+    for t in range(T - 1, -1, -1):
+        s = storeindex[t]
+        # DK's K_t is hx @ gain so K_t' r = gain' hx' r
+        uhat[t] = H @ (Finv_v[t] - gains[s].transpose() @ (hx.transpose() @ r))
+        # r_{t-1} = G' F^{-1} v_t + L_t' r_t
+        r = G.transpose() @ Finv_v[t] + Ls[s].transpose() @ r
+        zhat[t] = a_pred[t] + P_pred[s] @ r
+        epsilonhat[t] = eta.transpose() @ r
+
+    smoothed = {}
+    smoothed['zhat'] = zhat
+    smoothed['epsilonhat'] = epsilonhat
+    smoothed['uhat'] = uhat
+    smoothed['z0hat'] = filtered['P0'] @ hx.transpose() @ r
+
+    return(smoothed)
+
+
+# Shock Decomposition:{{{1
+def getshockdecomp(statespace, smoothed):
+    """
+    Returns the names of the contributions and a T x observables x contributions array of the contributions to the observables.
+    The contributions are the shocks, then the measurement errors, then the initial conditions.
+    """
+    hx = statespace['hx']
+    eta = statespace['eta']
+    G = statespace['G']
+    epsilonhat = smoothed['epsilonhat']
+    T = np.shape(epsilonhat)[0]
+    nshocks = np.shape(eta)[1]
+    N = np.shape(G)[0]
+
+    names = statespace['shocks'] + statespace['measurementerrors'] + ['initial']
+    decomp = np.zeros([T, N, len(names)])
+
+    # contribution of each shock to z_t (z x shocks) and of z_0
+    zshocks = np.zeros([np.shape(hx)[0], nshocks])
+    zinitial = smoothed['z0hat']
+    for t in range(T):
+        zshocks = hx @ zshocks + eta * epsilonhat[t][np.newaxis, :]
+        zinitial = hx @ zinitial
+        decomp[t, :, : nshocks] = G @ zshocks
+        decomp[t, :, -1] = G @ zinitial
+
+    for i in range(len(statespace['measurementerrors'])):
+        row = statespace['observed'].index(statespace['measurementerrors'][i][len('ME_'): ])
+        decomp[:, row, nshocks + i] = smoothed['uhat'][:, row]
+
+    return(names, decomp)
+
+
+def shockdecomp(solved, y, aggregation = None):
+    """
+    Filter, smooth and decompose the data y (T x observed) for a solved dict.
+    y can have missing values (NaN). For a missing value, the contributions add up to the smoothed value of the observable rather than the data.
+    Returns a dict with the names of the contributions, the decomposition (T x observed x contributions), the smoothed shocks and the log-likelihood.
+    """
+    statespace = getkalmanstatespace(solved, aggregation = aggregation)
+    filtered = kalmanfilter(y, statespace['hx'], statespace['eta'], statespace['G'], H = statespace['H'])
+    smoothed = kalmansmoother(filtered)
+    names, decomp = getshockdecomp(statespace, smoothed)
+
+    retdict = {}
+    retdict['names'] = names
+    retdict['observed'] = statespace['observed']
+    retdict['decomp'] = decomp
+    retdict['shocks'] = statespace['shocks']
+    retdict['epsilonhat'] = smoothed['epsilonhat']
+    retdict['ll'] = filtered['ll']
+    return(retdict)
+
+
+# Batch:{{{1
+def decompchunk(getsolvefunc, solveargs, draws, y, aggregation = None):
+    """
+    Shock decompositions for each draw in a chunk (flattened). Draws which can't be solved are skipped.
+    """
+    key = (getsolvefunc.__module__, getsolvefunc.__name__, repr(solveargs))
+    if key not in solvecache:
+        solvecache[key] = getsolvefunc(*solveargs)
+    solvefunc = solvecache[key]
+
+    rows = []
+    info = None
+    for i in range(np.shape(draws)[0]):
+        try:
+            solved = solvefunc(list(draws[i]))
+            retdict = shockdecomp(solved, y, aggregation = aggregation)
+        except (ValueError, np.linalg.LinAlgError):
+            continue
+        rows.append(np.concatenate((retdict['decomp'].reshape(-1), retdict['epsilonhat'].reshape(-1))))
+        if info is None:
+            info = {'names': retdict['names'], 'observed': retdict['observed'], 'shocks': retdict['shocks'], 'decompshape': np.shape(retdict['decomp']), 'epsilonshape': np.shape(retdict['epsilonhat'])}
+
+    if len(rows) == 0:
+        return(None, None, np.shape(draws)[0])
+    return(info, np.array(rows), np.shape(draws)[0] - len(rows))
+
+
+def decompchunk_star(args):
+    return(decompchunk(*args))
+
+
+def shockdecomp_batch(chains, getsolvefunc, y, solveargs = (), burnin = 0.1, thin = 10, maxdraws = None, probs = None, numprocesses = None, chunksize = 20, aggregation = None):
+    """
+    Shock decompositions for thinned draws from chains (see bayes/posteriorpredictive_func.posterioranalysis for the arguments).
+    Returns the mean decomposition and smoothed shocks across draws and their quantiles (probs x T x observed x contributions) computed with the P^2 sketch so memory doesn't grow with the number of draws.
+    """
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from posteriorpredictive_func import P2Quantiles
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from posteriorpredictive_func import iterthinned
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from posteriorpredictive_func import probs_default
+
+    if probs is None:
+        probs = probs_default
+    y = np.asarray(y, dtype = float)
+
+    tasks = ((getsolvefunc, solveargs, draws, y, aggregation) for draws, indices in iterthinned(chains, burnin = burnin, thin = thin, maxdraws = maxdraws, chunksize = chunksize))
+    if numprocesses == 1:
+        pool = None
+        results = map(decompchunk_star, tasks)
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(numprocesses)
+        results = pool.imap(decompchunk_star, tasks)
+
+    info = None
+    sketch = None
+    numfailed = 0
+    try:
+        for chunkinfo, rows, chunkfailed in results:
+            numfailed = numfailed + chunkfailed
+            if rows is None:
+                continue
+            if sketch is None:
+                info = chunkinfo
+                sketch = P2Quantiles([np.shape(rows)[1]], probs = probs)
+            for row in rows:
+                sketch.update(row)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if sketch is None:
+        raise ValueError('None of the draws could be solved. Number of draws: ' + str(numfailed) + '.')
+
+    size = int(np.prod(info['decompshape']))
+    quantiles = sketch.quantiles()
+    mean = sketch.mean()
+
+    retdict = {'names': info['names'], 'observed': info['observed'], 'shocks': info['shocks'], 'probs': list(probs), 'numdraws': sketch.count, 'numfailed': numfailed}
+    retdict['decompmean'] = mean[: size].reshape(info['decompshape'])
+    retdict['decompbands'] = quantiles[:, : size].reshape((len(probs), ) + tuple(info['decompshape']))
+    retdict['epsilonmean'] = mean[size: ].reshape(info['epsilonshape'])
+    retdict['epsilonbands'] = quantiles[:, size: ].reshape((len(probs), ) + tuple(info['epsilonshape']))
+    return(retdict)
+
+
+# Test:{{{1
+def kalman_test():
+    import time
+
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from posteriorpredictive_func import getsolvefunc_model_func
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from posteriorpredictive_func import getsolvefunc_data
+
+    rng = np.random.default_rng(1)
+
+    def simulate(statespace, T):
+        hx = statespace['hx']
+        eta = statespace['eta']
+        G = statespace['G']
+        P0 = getstationaryvariance(hx, eta)
+        eigvals, eigvecs = np.linalg.eigh(P0)
+        z = eigvecs @ (np.sqrt(np.maximum(eigvals, 0)) * rng.standard_normal(len(P0)))
+        y = np.empty([T, np.shape(G)[0]])
+        for t in range(T):
+            z = hx @ z + eta @ rng.standard_normal(np.shape(eta)[1])
+            y[t] = G @ z
+            if statespace['H'] is not None:
+                y[t] = y[t] + np.sqrt(np.diag(statespace['H'])) * rng.standard_normal(len(y[t]))
+        return(y)
+
+    solved = getsolvefunc_model_func()([0.3, 0.1, 0.01, 0.01])
+    statespace = getkalmanstatespace(solved)
+
+    # compare to conditioning the joint normal distribution of (z_0, ..., z_T, y_1, ..., y_T) directly
+    T = 25
+    y = simulate(statespace, T)
+    hx, eta, G, H = statespace['hx'], statespace['eta'], statespace['G'], statespace['H']
+    n = np.shape(hx)[0]
+    N = np.shape(G)[0]
+    # z_t = hx^t z_0 + sum_s hx^{t-s} eta epsilon_s so write everything in terms of (z_0, epsilon_1..T, u_1..T)
+    nshocks = np.shape(eta)[1]
+    numbase = n + T * nshocks + T * N
+    zmaps = [np.zeros([n, numbase])]
+    zmaps[0][:, : n] = np.eye(n)
+    for t in range(1, T + 1):
+        zmap = hx @ zmaps[-1]
+        zmap[:, n + (t - 1) * nshocks: n + t * nshocks] = zmap[:, n + (t - 1) * nshocks: n + t * nshocks] + eta
+        zmaps.append(zmap)
+    ymap = np.concatenate([G @ zmaps[t] + np.concatenate((np.zeros([N, n + T * nshocks + (t - 1) * N]), np.eye(N), np.zeros([N, (T - t) * N])), axis = 1) for t in range(1, T + 1)], axis = 0)
+    basevar = np.zeros([numbase, numbase])
+    basevar[: n, : n] = getstationaryvariance(hx, eta)
+    basevar[n: n + T * nshocks, n: n + T * nshocks] = np.eye(T * nshocks)
+    basevar[n + T * nshocks: , n + T * nshocks: ] = np.kron(np.eye(T), H)
+    basehat = basevar @ ymap.transpose() @ np.linalg.solve(ymap @ basevar @ ymap.transpose(), y.reshape(-1))
+    Sigma_y = ymap @ basevar @ ymap.transpose()
+    sign, logdet = np.linalg.slogdet(Sigma_y)
+    lldirect = -0.5 * (T * N * np.log(2 * np.pi) + logdet + y.reshape(-1) @ np.linalg.solve(Sigma_y, y.reshape(-1)))
+
+    filtered = kalmanfilter(y, hx, eta, G, H = H)
+    smoothed = kalmansmoother(filtered)
+    if abs(filtered['ll'] - lldirect) > 1e-6 * abs(lldirect):
+        raise ValueError('Kalman log-likelihood differs from the direct calculation.')
+    if not np.allclose(smoothed['z0hat'], basehat[: n], atol = 1e-8):
+        raise ValueError('Smoothed initial state differs from the direct calculation.')
+    if not np.allclose(smoothed['epsilonhat'].reshape(-1), basehat[n: n + T * nshocks], atol = 1e-8):
+        raise ValueError('Smoothed shocks differ from the direct calculation.')
+    if not np.allclose(smoothed['uhat'].reshape(-1), basehat[n + T * nshocks: ], atol = 1e-8):
+        raise ValueError('Smoothed measurement errors differ from the direct calculation.')
+    zhatdirect = np.array([zmaps[t] @ basehat for t in range(1, T + 1)])
+    if not np.allclose(smoothed['zhat'], zhatdirect, atol = 1e-8):
+        raise ValueError('Smoothed states differ from the direct calculation.')
+
+    # missing values and a mixed frequency observable compared to the direct calculation on the observed values
+    # c is observed in most periods and y is a three period average observed every third period
+    ymonthly = simulate(statespace, T)
+    ymixed = np.full([T, N], np.nan)
+    ymixed[:, 0] = ymonthly[:, 0]
+    ymixed[rng.uniform(size = T) < 0.2, 0] = np.nan
+    ymixed[2: : 3, 1] = ((ymonthly[0: T - 2, 1] + ymonthly[1: T - 1, 1] + ymonthly[2: T, 1]) / 3)[: : 3]
+    ymapmixed = ymap.copy()
+    for t in range(3, T + 1, 3):
+        row = (t - 1) * N + 1
+        ymapmixed[row] = (ymap[row - 2 * N] + ymap[row - N] + ymap[row]) / 3
+        # the measurement error is on the average
+        ymapmixed[row, n + T * nshocks: ] = 0
+        ymapmixed[row, n + T * nshocks + row] = 1
+    observedrows = np.flatnonzero(~np.isnan(ymixed.reshape(-1)))
+    ymapobs = ymapmixed[observedrows]
+    yobs = ymixed.reshape(-1)[observedrows]
+    Sigma_y = ymapobs @ basevar @ ymapobs.transpose()
+    sign, logdet = np.linalg.slogdet(Sigma_y)
+    lldirect = -0.5 * (len(observedrows) * np.log(2 * np.pi) + logdet + yobs @ np.linalg.solve(Sigma_y, yobs))
+    basehat = basevar @ ymapobs.transpose() @ np.linalg.solve(Sigma_y, yobs)
+
+    retdict = shockdecomp(solved, ymixed, aggregation = {'y': [1 / 3, 1 / 3, 1 / 3]})
+    if abs(retdict['ll'] - lldirect) > 1e-6 * abs(lldirect):
+        raise ValueError('Kalman log-likelihood with missing and mixed frequency data differs from the direct calculation.')
+    if not np.allclose(retdict['epsilonhat'].reshape(-1), basehat[n: n + T * nshocks], atol = 1e-8):
+        raise ValueError('Smoothed shocks with missing and mixed frequency data differ from the direct calculation.')
+    observedmask = ~np.isnan(ymixed)
+    if not np.allclose(np.sum(retdict['decomp'], axis = 2)[observedmask], ymixed[observedmask], atol = 1e-10):
+        raise ValueError('Shock decomposition with missing and mixed frequency data does not add up to the data.')
+
+    # a long monthly sample with a quarterly average only stores the variances until each position in the cycle converges
+    Tlong = 6000
+    ylong = simulate(statespace, Tlong)
+    ylong[np.arange(Tlong) % 3 != 2, 1] = np.nan
+    hx_aug, eta_aug, G_aug = aggregatestatespace(hx, eta, G, {1: [1 / 3, 1 / 3, 1 / 3]})
+    filtered = kalmanfilter(ylong, hx_aug, eta_aug, G_aug, H = H)
+    # a negative tolerance means P is never treated as converged
+    filtered_full = kalmanfilter(ylong, hx_aug, eta_aug, G_aug, H = H, steadystatetol = -1)
+    if len(filtered['gains']) > 300 or len(filtered_full['gains']) != Tlong:
+        raise ValueError('Number of stored gains with a regular pattern: ' + str(len(filtered['gains'])) + '.')
+    if abs(filtered['ll'] - filtered_full['ll']) > 1e-6 * abs(filtered_full['ll']):
+        raise ValueError('Reusing the converged gains changed the log-likelihood.')
+
+    # the contributions add up to the data for both models
+    for solved, numcontrib in [(solved, 4), (getsolvefunc_data()([0.9, 0.95, 0.3]), 4)]:
+        statespace = getkalmanstatespace(solved)
+        y = simulate(statespace, 200)
+        retdict = shockdecomp(solved, y)
+        if len(retdict['names']) != numcontrib or not np.allclose(np.sum(retdict['decomp'], axis = 2), y, atol = 1e-10):
+            raise ValueError('Shock decomposition does not add up to the data. Contributions: ' + str(retdict['names']) + '.')
+
+    # long sample
+    solved = getsolvefunc_model_func()([0.3, 0.1, 0.01, 0.01])
+    statespace = getkalmanstatespace(solved)
+    y = simulate(statespace, 10000)
+    start = time.perf_counter()
+    retdict = shockdecomp(solved, y)
+    longtime = time.perf_counter() - start
+    if np.max(np.abs(np.sum(retdict['decomp'], axis = 2) - y)) > 1e-6 * np.max(np.abs(y)):
+        raise ValueError('Shock decomposition does not add up to the data for the long sample.')
+    # a ragged edge with the last periods of y missing and c missing every 50 periods
+    yragged = y.copy()
+    yragged[-3: , 1] = np.nan
+    yragged[: : 50, 0] = np.nan
+    start = time.perf_counter()
+    retdict = shockdecomp(solved, yragged)
+    raggedtime = time.perf_counter() - start
+    observedmask = ~np.isnan(yragged)
+    if np.max(np.abs(np.sum(retdict['decomp'], axis = 2)[observedmask] - yragged[observedmask])) > 1e-6 * np.max(np.abs(y)):
+        raise ValueError('Shock decomposition does not add up to the data for the long sample with missing values.')
+
+    # batch across draws
+    draws = np.column_stack((rng.uniform(0.25, 0.35, 40), rng.uniform(0.08, 0.12, 40), np.full(40, 0.01), np.full(40, 0.01)))
+    batch = shockdecomp_batch({'draws': draws}, getsolvefunc_model_func, y[: 100], burnin = 0, thin = 1, numprocesses = 2, chunksize = 10)
+    if batch['numdraws'] != 40 or not np.allclose(np.sum(batch['decompmean'], axis = 2), y[: 100], atol = 1e-10):
+        raise ValueError('Batch shock decomposition is wrong.')
+
+    print('Kalman test passed. Time to filter, smooth and decompose 10000 periods: ' + str(longtime) + 's. With missing values: ' + str(raggedtime) + 's.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    kalman_test()
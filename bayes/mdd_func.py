@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Marginal data density (marginal likelihood) estimates from stored MCMC chains so specifications can be compared.
+
+Two estimators:
+- mdd_mhm: Geweke's modified harmonic mean. The weighting function is a normal with the posterior mean and variance truncated to the region where its chi-squared statistic is below the p quantile. It only needs the draws and the log posterior at each draw.
+- mdd_bridge: bridge sampling (Meng and Wong's iterative estimator). The proposal is a normal fitted to the first half of each chain and the second half are the posterior draws. This needs the log posterior at draws from the proposal so the model is re-evaluated at those points across a process pool.
+
+The chains are read in chunks so they don't have to fit in memory. A chain can be:
+- a checkpoint file from bayes/checkpoint_func.py (read through a memory map)
+- a folder: every .ckpt file in it or, if there are none, the draws from getdistfromfolder (like the dist_real and dist_sim folders). getdistfromfolder doesn't keep the log posterior so it is recomputed across the pool.
+- a dict {'draws': array or .npy file, 'logposts': array or .npy file or None}
+
+The log posterior has to be the log likelihood plus a normalized log prior. If the chains were run on something else (for example getdists only uses the likelihood with a flat prior over the bounds) pass logpriorfunc to add the missing prior to the stored values.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+chunksize_default = 10000
+# per process cache of posterior functions built in the pool
+posteriorcache = {}
+
+# Chains:{{{1
+def getchains(sources):
+    """
+    Convert a chain source or list of chain sources into a list of (draws, logposts) where logposts may be None.
+    The arrays may be memory maps.
+    """
+    if not isinstance(sources, list):
+        sources = [sources]
+
+    chains = []
+    for source in sources:
+        if isinstance(source, dict):
+            draws = np.load(source['draws'], mmap_mode = 'r') if isinstance(source['draws'], (str, Path)) else np.asarray(source['draws'])
+            logposts = source.get('logposts')
+            if isinstance(logposts, (str, Path)):
+                logposts = np.load(logposts, mmap_mode = 'r')
+            elif logposts is not None:
+                logposts = np.asarray(logposts)
+            chains.append((draws, logposts))
+        elif os.path.isdir(source):
+            ckptfiles = sorted([os.path.join(source, filename) for filename in os.listdir(source) if filename.endswith('.ckpt')])
+            if len(ckptfiles) > 0:
+                chains = chains + getchains(ckptfiles)
+            else:
+                sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
+                from bayesian_func import getdistfromfolder
+                chains.append((np.asarray(getdistfromfolder(source), dtype = float), None))
+        else:
+            sys.path.append(str(__projectdir__ / Path('bayes')))
+            from checkpoint_func import memmapcheckpoint
+            chains.append(memmapcheckpoint(source))
+
+    return(chains)
+
+
+def iterchunks(chains, start = 0, stop = 1, chunksize = chunksize_default):
+    """
+    Yield (chain index, draws, logposts) in chunks using the share start to stop of each chain (so start = 0.5 drops the first half).
+    """
+    for c in range(len(chains)):
+        draws, logposts = chains[c]
+        n = np.shape(draws)[0]
+        first = int(np.floor(start * n))
+        last = int(np.floor(stop * n))
+        for i in range(first, last, chunksize):
+            j = min(i + chunksize, last)
+            yield(c, np.array(draws[i: j], dtype = float), None if logposts is None else np.array(logposts[i: j], dtype = float))
+
+
+def getmoments(chains, start = 0, stop = 1, chunksize = chunksize_default):
+    """
+    Mean and variance of the draws computed in one pass over the chunks.
+    """
+    n = 0
+    shift = None
+    sumx = None
+    sumxx = None
+    for c, draws, logposts in iterchunks(chains, start = start, stop = stop, chunksize = chunksize):
+        if shift is None:
+            # shift by the first draw to avoid cancellation
+            shift = draws[0].copy()
+            sumx = np.zeros(len(shift))
+            sumxx = np.zeros([len(shift), len(shift)])
+        x = draws - shift
+        n = n + np.shape(x)[0]
+        sumx = sumx + np.sum(x, axis = 0)
+        sumxx = sumxx + x.transpose() @ x
+    if n < 2:
+        raise ValueError('Need at least two draws. Number of draws: ' + str(n) + '.')
+
+    mean = sumx / n
+    var = (sumxx - n * np.outer(mean, mean)) / (n - 1)
+    return(mean + shift, var, n)
+
+
+# Parallel Evaluation:{{{1
+def evaluatechunk(getposteriorfunc, args, points):
+    """
+    Evaluate the log posterior at each row of points. The posterior function is built once per process.
+    """
+    key = (getposteriorfunc.__module__, getposteriorfunc.__name__, repr(args))
+    if key not in posteriorcache:
+        posteriorcache[key] = getposteriorfunc(*args)
+    posteriorfunc = posteriorcache[key]
+
+    logposts = np.empty(np.shape(points)[0])
+    for i in range(np.shape(points)[0]):
+        try:
+            logposts[i] = posteriorfunc(list(points[i]))
+        except (ValueError, np.linalg.LinAlgError):
+            logposts[i] = -np.inf
+    logposts[np.isnan(logposts)] = -np.inf
+    return(logposts)
+
+
+def evaluatechunk_star(args):
+    return(evaluatechunk(*args))
+
+
+def evaluatelogposts(getposteriorfunc, args, points, pool = None, chunksize = 500):
+    """
+    Evaluate the log posterior at each row of points across pool (a multiprocessing pool).
+    getposteriorfunc(*args) should return the log posterior function of a list of parameter values. It must be defined at the top level of a module so it can be sent to the pool.
+    If pool is None, evaluate in this process.
+    """
+    points = np.asarray(points, dtype = float)
+    tasks = [(getposteriorfunc, args, points[i: i + chunksize]) for i in range(0, np.shape(points)[0], chunksize)]
+    if len(tasks) == 0:
+        return(np.zeros(0))
+
+    if pool is None:
+        results = [evaluatechunk_star(task) for task in tasks]
+    else:
+        results = pool.map(evaluatechunk_star, tasks)
+
+    return(np.concatenate(results))
+
+
+def getpool(numprocesses):
+    """
+    A multiprocessing pool or None if numprocesses == 1.
+    The same pool is used for every chunk so each process only builds the posterior function once.
+    """
+    if numprocesses == 1:
+        return(None)
+    import multiprocessing
+    return(multiprocessing.Pool(numprocesses))
+
+
+def getlogkernels(chains, start, stop, logpriorfunc = None, getposteriorfunc = None, posteriorargs = (), pool = None, chunksize = chunksize_default):
+    """
+    Yield (draws, log posterior) chunks over the chains. The log posterior is recomputed across the pool for chains without stored values.
+    """
+    for c, draws, logposts in iterchunks(chains, start = start, stop = stop, chunksize = chunksize):
+        if logposts is None:
+            if getposteriorfunc is None:
+                raise ValueError('Chain ' + str(c) + ' has no stored log posterior so getposteriorfunc must be specified.')
+            logposts = evaluatelogposts(getposteriorfunc, posteriorargs, draws, pool = pool)
+        elif logpriorfunc is not None:
+            logposts = logposts + np.array([logpriorfunc(list(draw)) for draw in draws])
+        yield(draws, logposts)
+
+
+# Estimators:{{{1
+def logsumexp(values):
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return(-np.inf)
+    maxval = np.max(values)
+    return(maxval + np.log(np.sum(np.exp(values - maxval))))
+
+
+def logsumexp_update(total, values):
+    """
+    Update a running (max, sum of exp(values - max)) with values.
+    """
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return(total)
+    maxval, sumexp = total
+    newmax = max(maxval, np.max(values))
+    return((newmax, sumexp * np.exp(maxval - newmax) + np.sum(np.exp(values - newmax))))
+
+
+def mdd_mhm(chains, pvalues = None, burnin = 0.1, logpriorfunc = None, getposteriorfunc = None, posteriorargs = (), numprocesses = None, chunksize = chunksize_default):
+    """
+    Geweke's modified harmonic mean estimate of the log marginal data density for each truncation probability in pvalues.
+    Takes two passes over the chains (the first for the mean and variance).
+    Returns {p: log mdd}.
+    """
+    import scipy.stats
+
+    if pvalues is None:
+        pvalues = [0.1, 0.3, 0.5, 0.7, 0.9]
+    chains = getchains(chains)
+
+    mean, var, n = getmoments(chains, start = burnin, chunksize = chunksize)
+    d = len(mean)
+    cholvar = np.linalg.cholesky(var)
+    logdetvar = 2 * np.sum(np.log(np.diag(cholvar)))
+    thresholds = {p: scipy.stats.chi2.ppf(p, d) for p in pvalues}
+
+    totals = {p: (-np.inf, 0) for p in pvalues}
+    numdraws = 0
+    # only start processes if some log posteriors need to be recomputed
+    pool = getpool(numprocesses) if any([logposts is None for draws, logposts in chains]) else None
+    try:
+        for draws, logposts in getlogkernels(chains, burnin, 1, logpriorfunc = logpriorfunc, getposteriorfunc = getposteriorfunc, posteriorargs = posteriorargs, pool = pool, chunksize = chunksize):
+            numdraws = numdraws + len(logposts)
+            z = np.linalg.solve(cholvar, (draws - mean).transpose())
+            quad = np.sum(z ** 2, axis = 0)
+            lognormal = -0.5 * d * np.log(2 * np.pi) - 0.5 * logdetvar - 0.5 * quad
+            for p in pvalues:
+                logf = np.where(quad <= thresholds[p], lognormal - np.log(p), -np.inf)
+                totals[p] = logsumexp_update(totals[p], logf - logposts)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # 1 / p(y) = mean of f / (likelihood x prior)
+    retdict = {}
+    for p in pvalues:
+        maxval, sumexp = totals[p]
+        retdict[p] = float(-(maxval + np.log(sumexp) - np.log(numdraws)))
+    return(retdict)
+
+
+def mdd_bridge(chains, burnin = 0.1, numproposal = None, logpriorfunc = None, getposteriorfunc = None, posteriorargs = (), numprocesses = None, seed = 1, tol = 1e-10, maxiterations = 1000, chunksize = chunksize_default):
+    """
+    Bridge sampling estimate of the log marginal data density.
+    getposteriorfunc(*posteriorargs) must return the log posterior (log likelihood + normalized log prior) since it is evaluated at the draws from the proposal in parallel.
+    numproposal: number of draws from the proposal (defaults to the number of posterior draws used).
+    Returns a dict with the log mdd, the number of iterations and the draws used.
+    """
+    if getposteriorfunc is None:
+        raise ValueError('Bridge sampling needs getposteriorfunc to evaluate the posterior at the proposal draws.')
+    chains = getchains(chains)
+
+    # fit the proposal to the first half (after burn in) of each chain
+    middle = burnin + (1 - burnin) / 2
+    mean, var, n = getmoments(chains, start = burnin, stop = middle, chunksize = chunksize)
+    d = len(mean)
+    cholvar = np.linalg.cholesky(var)
+    logdetvar = 2 * np.sum(np.log(np.diag(cholvar)))
+
+    def logproposal(draws):
+        z = np.linalg.solve(cholvar, (draws - mean).transpose())
+        return(-0.5 * d * np.log(2 * np.pi) - 0.5 * logdetvar - 0.5 * np.sum(z ** 2, axis = 0))
+
+    pool = getpool(numprocesses)
+    try:
+        # log posterior - log proposal at the posterior draws in the second half
+        l1 = []
+        for draws, logposts in getlogkernels(chains, middle, 1, logpriorfunc = logpriorfunc, getposteriorfunc = getposteriorfunc, posteriorargs = posteriorargs, pool = pool, chunksize = chunksize):
+            l1.append(logposts - logproposal(draws))
+        l1 = np.concatenate(l1)
+        n1 = len(l1)
+
+        # log posterior - log proposal at draws from the proposal
+        if numproposal is None:
+            numproposal = n1
+        rng = np.random.default_rng(seed)
+        proposaldraws = mean + rng.standard_normal([numproposal, d]) @ cholvar.transpose()
+        l2 = evaluatelogposts(getposteriorfunc, posteriorargs, proposaldraws, pool = pool) - logproposal(proposaldraws)
+        n2 = numproposal
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # iterate in logs relative to lstar to avoid overflow
+    lstar = np.median(l1[np.isfinite(l1)])
+    l1 = l1 - lstar
+    l2 = l2 - lstar
+    logs1 = np.log(n1 / (n1 + n2))
+    logs2 = np.log(n2 / (n1 + n2))
+
+    logr = 0
+    for iteration in range(maxiterations):
+        lognum = logsumexp(-np.logaddexp(logs1, logs2 + logr - l2)) - np.log(n2)
+        logden = logsumexp(-np.logaddexp(logs1 + l1, logs2 + logr)) - np.log(n1)
+        logrnew = lognum - logden
+        if abs(logrnew - logr) < tol:
+            logr = logrnew
+            break
+        logr = logrnew
+    else:
+        raise ValueError('Bridge sampling did not converge after ' + str(maxiterations) + ' iterations.')
+
+    retdict = {}
+    retdict['logmdd'] = float(logr + lstar)
+    retdict['iterations'] = iteration + 1
+    retdict['numposterior'] = n1
+    retdict['numproposal'] = n2
+    return(retdict)
+
+
+# Model Comparison:{{{1
+def comparemodels(logmdddict, priorprobdict = None):
+    """
+    logmdddict: {model name: log mdd}. priorprobdict: prior model probabilities (equal if None).
+    Returns a dict with the posterior model probabilities and the log Bayes factor of each model against the best.
+    """
+    names = list(logmdddict)
+    logmdds = np.array([logmdddict[name] for name in names], dtype = float)
+    if priorprobdict is None:
+        logprior = np.zeros(len(names))
+    else:
+        logprior = np.log(np.array([priorprobdict[name] for name in names], dtype = float))
+
+    logpost = logmdds + logprior
+    logpost = logpost - logsumexp(logpost)
+
+    retdict = {}
+    retdict['posteriorprob'] = {names[i]: float(np.exp(logpost[i])) for i in range(len(names))}
+    retdict['logbayesfactor'] = {names[i]: float(logmdds[i] - np.max(logmdds)) for i in range(len(names))}
+    return(retdict)
+
+
+# Project Model:{{{1
+def getlogprior_uniform(lowerboundlist, upperboundlist):
+    """
+    Normalized log prior for a uniform prior over the bounds.
+    """
+    lowerbounds = np.array(lowerboundlist, dtype = float)
+    upperbounds = np.array(upperboundlist, dtype = float)
+    logdensity = -np.sum(np.log(upperbounds - lowerbounds))
+
+    def logpriorfunc(values):
+        values = np.array(values, dtype = float)
+        if np.all(values >= lowerbounds) and np.all(values <= upperbounds):
+            return(logdensity)
+        return(-np.inf)
+
+    return(logpriorfunc)
+
+
+def getposteriorfunc_model_func(realdata = True):
+    """
+    Log posterior for the model in bayes/model_func.py with a uniform prior over the bounds (the prior implied by getdists).
+    """
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getbounddicts
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getestimatevars
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getloglfunc
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getrealdata
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getsimdata
+
+    estimatevars = getestimatevars()
+    lowerbounddict, upperbounddict = getbounddicts(estimatevars)
+    logpriorfunc = getlogprior_uniform([lowerbounddict[var] for var in estimatevars], [upperbounddict[var] for var in estimatevars])
+
+    if realdata is True:
+        y = getrealdata()
+    else:
+        y = getsimdata()
+    loglfunc = getloglfunc(estimatevars, y)
+
+    def posteriorfunc(values):
+        logprior = logpriorfunc(values)
+        if not np.isfinite(logprior):
+            return(-np.inf)
+        return(logprior + loglfunc(values))
+
+    return(posteriorfunc)
+
+
+def mdd_model_func(realdata = True, numprocesses = None):
+    """
+    Both estimates of the log mdd for the chains saved by getdists_multiprocessing.
+    """
+    if realdata is True:
+        savefolder = __projectdir__ / Path('me/bayes/temp/dist_real/')
+    else:
+        savefolder = __projectdir__ / Path('me/bayes/temp/dist_sim/')
+
+    retdict = {}
+    retdict['mhm'] = mdd_mhm(savefolder, getposteriorfunc = getposteriorfunc_model_func, posteriorargs = (realdata, ), numprocesses = numprocesses)
+    retdict['bridge'] = mdd_bridge(savefolder, getposteriorfunc = getposteriorfunc_model_func, posteriorargs = (realdata, ), numprocesses = numprocesses)['logmdd']
+    return(retdict)
+
+
+# Test:{{{1
+def getposteriorfunc_test(y, tau):
+    """
+    y_t ~ N(theta, I) with prior theta ~ N(0, tau^2 I).
+    """
+    y = np.array(y)
+    T = np.shape(y)[0]
+
+    def posteriorfunc(values):
+        theta = np.array(values)
+        loglik = -0.5 * T * len(theta) * np.log(2 * np.pi) - 0.5 * np.sum((y - theta) ** 2)
+        logprior = -0.5 * len(theta) * np.log(2 * np.pi * tau ** 2) - 0.5 * np.sum(theta ** 2) / tau ** 2
+        return(loglik + logprior)
+
+    return(posteriorfunc)
+
+
+def mdd_test():
+    import tempfile
+
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from checkpoint_func import metropolis_checkpoint
+
+    # true log mdd: each column of y is N(0, I + tau^2 11')
+    rng = np.random.default_rng(2)
+    T = 20
+    tau = 1.0
+    y = 0.5 + rng.standard_normal([T, 2])
+    truemdd = 0
+    for j in range(2):
+        cov = np.eye(T) + tau ** 2 * np.ones([T, T])
+        sign, logdet = np.linalg.slogdet(cov)
+        truemdd = truemdd - 0.5 * T * np.log(2 * np.pi) - 0.5 * logdet - 0.5 * y[:, j] @ np.linalg.solve(cov, y[:, j])
+
+    posteriorfunc = getposteriorfunc_test(y.tolist(), tau)
+    with tempfile.TemporaryDirectory() as tempdir:
+        # two chains saved as checkpoints
+        for seed in [1, 2]:
+            metropolis_checkpoint(posteriorfunc, [-10, -10], [10, 10], [0.4, 0.4], [0, 0], numiterations = 20000, checkpointfile = os.path.join(tempdir, 'chain' + str(seed) + '.ckpt'), seed = seed)
+
+        mhm = mdd_mhm(tempdir, chunksize = 3000)
+        bridge = mdd_bridge(tempdir, getposteriorfunc = getposteriorfunc_test, posteriorargs = (y.tolist(), tau), numprocesses = 2, chunksize = 3000)
+
+        # chains without stored log posteriors are re-evaluated in the pool
+        sys.path.append(str(__projectdir__ / Path('bayes')))
+        from checkpoint_func import loadcheckpoint
+        draws = loadcheckpoint(os.path.join(tempdir, 'chain1.ckpt'))['draws']
+        mhm_nologposts = mdd_mhm({'draws': draws, 'logposts': None}, pvalues = [0.5], getposteriorfunc = getposteriorfunc_test, posteriorargs = (y.tolist(), tau), numprocesses = 2)
+
+    for p in mhm:
+        if abs(mhm[p] - truemdd) > 0.1:
+            raise ValueError('Modified harmonic mean estimate is wrong. p: ' + str(p) + '. Estimate: ' + str(mhm[p]) + '. True: ' + str(truemdd) + '.')
+    if abs(bridge['logmdd'] - truemdd) > 0.05:
+        raise ValueError('Bridge sampling estimate is wrong. Estimate: ' + str(bridge['logmdd']) + '. True: ' + str(truemdd) + '.')
+    if abs(mhm_nologposts[0.5] - truemdd) > 0.1:
+        raise ValueError('Estimate with recomputed log posteriors is wrong: ' + str(mhm_nologposts[0.5]) + '.')
+
+    # comparison
+    comparison = comparemodels({'a': truemdd, 'b': truemdd - np.log(3)})
+    if abs(comparison['posteriorprob']['a'] - 0.75) > 1e-12:
+        raise ValueError('Posterior model probabilities are wrong.')
+
+    print('True log mdd: ' + str(truemdd) + '. Modified harmonic mean: ' + str(mhm) + '. Bridge: ' + str(bridge['logmdd']) + '.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    mdd_test()
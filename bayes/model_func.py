@@ -41,7 +41,10 @@ def getbounddicts(estimatevars):
     return(lowerbounddict, upperbounddict)
 
 # Basic Model:{{{1
-def getbasicmodel(paramssdict):
+def getbasicmodel(paramssdict, numprocesses = None):
+    """
+    If numprocesses is specified, the conversion to logs and differentiation are run across a process pool (see dsgediff/paralleldiff_func.py) and the time taken by each stage is saved in r['parsediff_timing']. The equations are parsed and checked in this process before the steady state is added to paramssdict, as without numprocesses, and the parsed equations are passed to the pool.
+    """
     import numpy as np
 
     # returndict
@@ -76,6 +79,22 @@ def getbasicmodel(paramssdict):
     # get varssdict in terms of parameters
     r['varssdict'] = addparamendogdict(paramssdict)
 
+    if numprocesses is not None:
+        # parse, convert all states and controls into logs and differentiate in parallel
+        sys.path.append(str(__projectdir__ / Path('dsgediff')))
+        from paralleldiff_func import parsediff_parallel
+        # the equations are already parsed above
+        retdict = parsediff_parallel(r['Et_eqs'], r['states'], r['controls'], logvars = r['states'] + r['controls'], varssdict = r['varssdict'], numprocesses = numprocesses, parseequations = False)
+        r['Et_eqs'] = retdict['Et_eqs']
+        r['varssdict'] = retdict['varssdict']
+        r['parsediff_timing'] = retdict['timing']
+
+        sys.path.append(str(__projectdir__ / Path('dsgediff')))
+        from sparsediff_func import sparsetodense_sympy
+        r['fx'], r['fxp'], r['fy'], r['fyp'] = [sparsetodense_sympy(retdict[name]) for name in ['fx', 'fxp', 'fy', 'fyp']]
+
+        return(r)
+
     # convert vars and varssdict
     # convert all states and controls into logs (unusual not to have levels vars)
     sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
@@ -208,47 +227,77 @@ def getnumderivs_unknownparams(paramssdict, estimatevars):
     from dsgediff_func import getfullreplacedict
     r['replacedict'] = getfullreplacedict([r['varssdict2']], variables = r['states'] + r['controls'])
 
-    # replace non-estimatevars
-    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
-    from dsgediff_func import numeval_partial
-    fx, fxp, fy, fyp = numeval_partial(r['fx'], r['fxp'], r['fy'], r['fyp'], r['replacedict'])
-
-    # convert to function
-    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
-    from dsgediff_func import numeval_convertfunc
-    r['fx_f'], r['fxp_f'], r['fy_f'], r['fyp_f'] = numeval_convertfunc(fx, fxp, fy, fyp, estimatevars)
+    # replace non-estimatevars and convert to a single function of estimatevars
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from specialize_func import specialize
+    r['specialized'] = specialize([r['fx'], r['fxp'], r['fy'], r['fyp']], r['replacedict'], estimatevars)
+    r['fxfy_f'] = r['specialized']['f']
 
     return(r)
 
 
-def getloglfunc(estimatevars, y):
+def getloglfunc(estimatevars, y, missingdata = False, aggregation = None):
+    """
+    If missingdata is True, y can have missing values (NaN) and I use the filter in bayes/kalman_func.py which selects the observed rows of C2 and D2 for each pattern of missing values.
+    aggregation: {observed variable: weights} for observables which are temporal aggregates like a quarterly average in a monthly model (only with missingdata = True, see kalman_func.aggregatestatespace).
+    """
     import numpy as np
     import sympy
 
+    if aggregation is not None and missingdata is False:
+        raise ValueError('aggregation requires missingdata = True.')
+
     paramssdict = getparamexogdict()
     r = getnumderivs_unknownparams(paramssdict, estimatevars)
 
+    # import once here rather than on every call of loglfunc
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsge_bkdiscrete_func import gxhx
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/statespace')))
+    from statespace_func import kalmanfilter
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/statespace')))
+    from statespace_func import logl_prop_kalmanfilter
+    # timers for each stage (these do nothing unless profiling is enabled)
+    sys.path.append(str(__projectdir__ / Path('runtime')))
+    from profiling_func import timer
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from kalman_func import aggregatestatespace
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from kalman_func import kalmanfilter as kalmanfilter_missing
+
     def loglfunc(params, r = r):
         
-        sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
-        from dsge_bkdiscrete_func import gxhx
-        r['C'], r['A'] = gxhx(r['fx_f'](*params), r['fxp_f'](*params), r['fy_f'](*params), r['fyp_f'](*params))
+        with timer('loglfunc_jacobian'):
+            nfx, nfxp, nfy, nfyp = r['fxfy_f'](*params)
+        with timer('loglfunc_gxhx'):
+            r['C'], r['A'] = gxhx(nfx, nfxp, nfy, nfyp)
 
         # add to varssdict for addABCD function
         for i in range(0, len(estimatevars)):
             r['varssdict'][estimatevars[i]] = params[i]
         
-        r = addABCD(r)
+        with timer('loglfunc_addABCD'):
+            r = addABCD(r)
+
+        if missingdata is True:
+            # D2 only loads on the measurement errors so they are independent of the shocks in B
+            hx = r['A']
+            eta = r['B']
+            G = r['C2']
+            H = r['D2'] @ r['D2'].transpose()
+            if aggregation is not None:
+                hx, eta, G = aggregatestatespace(hx, eta, G, {r['observedy'].index(var): aggregation[var] for var in aggregation})
+            with timer('loglfunc_kalmanfilter'):
+                ll = kalmanfilter_missing(y, hx, eta, G, H = H)['ll']
+            return(ll)
 
         # get kalman filter
-        sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/statespace')))
-        from statespace_func import kalmanfilter
-        x_t_tm1, P_t_tm1, x_t_t, P_t_t, y_t_tm1, Q_t_tm1, R_t_tm1 = kalmanfilter(y, r['A'], r['B2'], r['C2'], r['D2'])
+        with timer('loglfunc_kalmanfilter'):
+            x_t_tm1, P_t_tm1, x_t_t, P_t_t, y_t_tm1, Q_t_tm1, R_t_tm1 = kalmanfilter(y, r['A'], r['B2'], r['C2'], r['D2'])
 
         # get log likelihood
-        sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/statespace')))
-        from statespace_func import logl_prop_kalmanfilter
-        ll = logl_prop_kalmanfilter(y, y_t_tm1, Q_t_tm1)
+        with timer('loglfunc_logl'):
+            ll = logl_prop_kalmanfilter(y, y_t_tm1, Q_t_tm1)
 
         return(ll)
 
@@ -276,46 +325,86 @@ def getmax(printdetails = False):
 
 
 # Bayesian Analysis:{{{1
-def getdists(printdetails = False, numiterations = 1e5, savefile = None, realdata = True):
-    if realdata is True:
-        y = getrealdata()
+def getdists(printdetails = False, numiterations = 1e5, savefile = None, realdata = True, profilefile = None, checkpointfile = None, seed = None):
+    """
+    If profilefile is specified, the time taken by each stage of the likelihood and by each posterior evaluation (one per Metropolis-Hastings iteration) is recorded and written to profilefile as JSON every minute and at the end.
+    If checkpointfile is specified, the chain is run with bayes/checkpoint_func.py instead of metropolis_bounds_do. The full state of the sampler is saved to checkpointfile as it runs and the chain resumes from checkpointfile if it exists. The draws are returned and kept in the checkpoint (checkpointfile and checkpointfile + '_draws', use loadcheckpoint) rather than written to savefile.
+    """
+    if checkpointfile is not None and savefile is not None:
+        raise ValueError('Specify either savefile or checkpointfile. With checkpointfile the draws are saved in the checkpoint.')
+
+    if profilefile is not None:
+        sys.path.append(str(__projectdir__ / Path('runtime')))
+        from profiling_func import enable
+        enable(dumpfile = profilefile)
+
+    # disable profiling (and write the profile) even if the chain raises an error
+    try:
+        if realdata is True:
+            y = getrealdata()
+        else:
+            y = getsimdata()
+
+        estimatevars = getestimatevars()
+
+        logl_func = getloglfunc(estimatevars, y)
+        sys.path.append(str(__projectdir__ / Path('runtime')))
+        from profiling_func import timed
+        logl_func = timed('posterior', logl_func)
+
+        scaledict = {}
+        startvaldict = {}
+        lowerbounddict, upperbounddict = getbounddicts(estimatevars)
+
+        sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
+        from bayesian_func import metropolis_bounds_getdicts
+        lowerboundlist, upperboundlist, scalelist, startvallist = metropolis_bounds_getdicts(estimatevars, lowerbounddict, upperbounddict, scaledict, startvaldict)
+
+        if checkpointfile is not None:
+            sys.path.append(str(__projectdir__ / Path('bayes')))
+            from checkpoint_func import metropolis_checkpoint
+            retdict = metropolis_checkpoint(logl_func, lowerboundlist, upperboundlist, scalelist, startvallist, numiterations = numiterations, checkpointfile = checkpointfile, seed = seed, printdetails = printdetails)
+        else:
+            sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
+            from bayesian_func import metropolis_bounds_do
+            metropolis_bounds_do(logl_func, lowerboundlist, upperboundlist, scalelist, startvallist, numiterations = numiterations, printdetails = printdetails, logposterior = True, savefile = savefile)
+            retdict = None
+    finally:
+        if profilefile is not None:
+            sys.path.append(str(__projectdir__ / Path('runtime')))
+            from profiling_func import disable
+            disable()
+
+    return(retdict)
+
+
+def getprofilefile(savefile, profile):
+    if profile is True:
+        return(str(savefile) + '_profile.json')
     else:
-        y = getsimdata()
+        return(None)
 
-    estimatevars = getestimatevars()
 
-    logl_func = getloglfunc(estimatevars, y)
+def getdists_poolf_real(savefile, profile = False):
+    getdists(savefile = savefile, numiterations = 500, printdetails = True, profilefile = getprofilefile(savefile, profile))
 
-    scaledict = {}
-    startvaldict = {}
-    lowerbounddict, upperbounddict = getbounddicts(estimatevars)
 
-    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
-    from bayesian_func import metropolis_bounds_getdicts
-    lowerboundlist, upperboundlist, scalelist, startvallist = metropolis_bounds_getdicts(estimatevars, lowerbounddict, upperbounddict, scaledict, startvaldict)
+def getdists_poolf_sim(savefile, profile = False):
+    getdists(savefile = savefile, numiterations = 500, printdetails = True, realdata = False, profilefile = getprofilefile(savefile, profile))
 
-    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
-    from bayesian_func import metropolis_bounds_do
-    metropolis_bounds_do(logl_func, lowerboundlist, upperboundlist, scalelist, startvallist, numiterations = numiterations, printdetails = printdetails, logposterior = True, savefile = savefile)
 
-
-def getdists_poolf_real(savefile):
-    getdists(savefile = savefile, numiterations = 500, printdetails = True)
-
-
-def getdists_poolf_sim(savefile):
-    getdists(savefile = savefile, numiterations = 500, printdetails = True, realdata = False)
-
-
-def getdists_multiprocessing(numprocesses = None, deleteoldresults = True, realdata = True):
+def getdists_multiprocessing(numprocesses = None, deleteoldresults = True, realdata = True, profile = False):
     """
     Run getdists function using multiprocessing.
+    If profile is True, each process writes the time taken by each stage to its savefile + '_profile.json' while it runs.
     """
+    import functools
+
     if realdata is True:
-        poolf = getdists_poolf_real
+        poolf = functools.partial(getdists_poolf_real, profile = profile)
         savefolder = __projectdir__ / Path('me/bayes/temp/dist_real/')
     else:
-        poolf = getdists_poolf_sim
+        poolf = functools.partial(getdists_poolf_sim, profile = profile)
         savefolder = __projectdir__ / Path('me/bayes/temp/dist_sim/')
 
     sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
@@ -324,10 +413,12 @@ def getdists_multiprocessing(numprocesses = None, deleteoldresults = True, reald
 
 
 # Analysis Post Parameter Estimation:{{{1
-def analysebayes(realdata = True):
+def analysebayes(realdata = True, mdd = False, bands = False, numprocesses = None):
     """
     If realdata is True, use mean from real data distributions.
     If realdata is False, use mean from sim data distributions.
+    If mdd is True, also print the modified harmonic mean and bridge sampling estimates of the log marginal data density (see bayes/mdd_func.py). The posterior is re-evaluated across numprocesses processes.
+    If bands is True, also solve thinned draws across numprocesses processes and print the posterior IRF bands and posterior predictive p-values (see bayes/posteriorpredictive_func.py).
     """
     import numpy as np
 
@@ -358,6 +449,26 @@ def analysebayes(realdata = True):
     # print(bigA)
     # print(bigB)
 
+    if mdd is True:
+        sys.path.append(str(__projectdir__ / Path('bayes')))
+        from mdd_func import mdd_model_func
+        mdddict = mdd_model_func(realdata = realdata, numprocesses = numprocesses)
+        print('Log marginal data density (modified harmonic mean):')
+        print(mdddict['mhm'])
+        print('Log marginal data density (bridge sampling):')
+        print(mdddict['bridge'])
+
+    if bands is True:
+        sys.path.append(str(__projectdir__ / Path('bayes')))
+        from posteriorpredictive_func import posterioranalysis_model_func
+        analysis = posterioranalysis_model_func(realdata = realdata, numprocesses = numprocesses)
+        for var in analysis['observed']:
+            print('IRF bands of ' + var + ' to a technology shock (' + ', '.join([str(prob) for prob in analysis['probs']]) + ' quantiles):')
+            print(analysis['irfbands'][:, 0, :, analysis['varnames'].index(var)])
+        print('Posterior predictive p-values of the standard deviation and autocorrelation of ' + ', '.join(analysis['observed']) + ':')
+        print(analysis['pvalue_std'])
+        print(analysis['pvalue_autocorr'])
+
 
 
 
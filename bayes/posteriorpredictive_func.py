@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+"""
+Posterior IRF bands, distributions of unconditional moments and posterior predictive quantiles of simulated observables from the draws of a chain.
+
+Each thinned draw is solved (in chunks across a process pool) and gives:
+- the IRFs of every variable to each shock (shocks x irfperiods x variables)
+- the unconditional standard deviation and first order autocorrelation of every variable
+- a simulated path of the observables (with measurement error) of length simperiods and the standard deviation and first order autocorrelation of that simulated path
+
+The quantiles across draws are computed with the P^2 algorithm (Jain and Chlamtac, 1985) which keeps five markers for each quantile and each number rather than every draw. So memory doesn't depend on the number of draws even with 10^5 draws x 40 horizons x many variables.
+If data is given, the posterior predictive p-value of its standard deviation and autocorrelation (the share of simulated paths with a larger statistic) is also returned.
+
+Models are given by a function getsolvefunc(*solveargs) which returns solvefunc(values) -> a dict with:
+- hx, M, eta: the solution in the form of dsge_bkdiscrete/moments_func.py (z_{t+1} = hx z_t + eta epsilon_{t+1}, variables = M z)
+- varnames, shocks
+- observed: the names of the observed variables (a subset of varnames)
+- mesd: the standard deviation of the measurement error on each observed variable
+getsolvefunc must be defined at the top level of a module so it can be sent to the pool. It's called once per process.
+getsolvefunc_model_func (the c/y model in bayes/model_func.py) and getsolvefunc_data (the Ygr/Cgr model in bayes/data.py) are defined below.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+probs_default = [0.05, 0.16, 0.5, 0.84, 0.95]
+# per process cache of solve functions built in the pool
+solvecache = {}
+
+# Streaming Quantiles:{{{1
+class P2Quantiles(object):
+    """
+    P^2 estimates of the probs quantiles of each element of a stream of arrays of the same shape.
+    """
+
+    def __init__(self, shape, probs = probs_default):
+        self.shape = tuple(shape)
+        self.probs = np.array(probs, dtype = float)
+        self.count = 0
+        self.sum = np.zeros(self.shape)
+
+        numcells = int(np.prod(self.shape))
+        numprobs = len(self.probs)
+        # the first five observations
+        self.initial = np.empty([5, numcells])
+        # marker heights and positions: probs x cells x 5
+        self.q = np.empty([numprobs, numcells, 5])
+        self.n = np.tile(np.arange(5, dtype = float), [numprobs, numcells, 1])
+        # desired positions and their increments: probs x 5
+        p = self.probs[:, np.newaxis]
+        self.ndesired = np.concatenate((np.zeros_like(p), 2 * p, 4 * p, 2 + 2 * p, 4 + np.zeros_like(p)), axis = 1)
+        self.dn = np.concatenate((np.zeros_like(p), p / 2, p, (1 + p) / 2, 1 + np.zeros_like(p)), axis = 1)
+
+    def update(self, x):
+        x = np.asarray(x, dtype = float).reshape(-1)
+        self.sum = self.sum + x.reshape(self.shape)
+
+        if self.count < 5:
+            self.initial[self.count] = x
+            self.count = self.count + 1
+            if self.count == 5:
+                self.q[...] = np.sort(self.initial, axis = 0).transpose()[np.newaxis, :, :]
+            return
+
+        self.count = self.count + 1
+        q = self.q
+        n = self.n
+
+        # update the extreme markers and find the cell k with q_k <= x < q_{k + 1}
+        q[:, :, 0] = np.minimum(q[:, :, 0], x)
+        q[:, :, 4] = np.maximum(q[:, :, 4], x)
+        k = np.sum(x[np.newaxis, :, np.newaxis] >= q[:, :, 1: 4], axis = 2)
+        n += np.arange(5)[np.newaxis, np.newaxis, :] > k[:, :, np.newaxis]
+        self.ndesired = self.ndesired + self.dn
+
+        # adjust the middle markers
+        for i in range(1, 4):
+            d = self.ndesired[:, i][:, np.newaxis] - n[:, :, i]
+            adjust = ((d >= 1) & (n[:, :, i + 1] - n[:, :, i] > 1)) | ((d <= -1) & (n[:, :, i - 1] - n[:, :, i] < -1))
+            if not np.any(adjust):
+                continue
+            d = np.sign(d)
+            qi = q[:, :, i]
+            qp = q[:, :, i + 1]
+            qm = q[:, :, i - 1]
+            ni = n[:, :, i]
+            npl = n[:, :, i + 1]
+            nm = n[:, :, i - 1]
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                parabolic = qi + d / (npl - nm) * ((ni - nm + d) * (qp - qi) / (npl - ni) + (npl - ni - d) * (qi - qm) / (ni - nm))
+                linear = np.where(d > 0, qi + (qp - qi) / (npl - ni), qi - (qm - qi) / (nm - ni))
+            new = np.where((qm < parabolic) & (parabolic < qp), parabolic, linear)
+            q[:, :, i] = np.where(adjust, new, qi)
+            n[:, :, i] = np.where(adjust, ni + d, ni)
+
+    def quantiles(self):
+        """
+        Returns an array of size probs x shape.
+        """
+        if self.count == 0:
+            return(np.full((len(self.probs), ) + self.shape, np.nan))
+        if self.count < 5:
+            return(np.quantile(self.initial[: self.count], self.probs, axis = 0).reshape((len(self.probs), ) + self.shape))
+        return(self.q[:, :, 2].reshape((len(self.probs), ) + self.shape))
+
+    def mean(self):
+        return(self.sum / self.count)
+
+
+# Per Draw Analysis:{{{1
+def getstdautocorr(path):
+    """
+    Standard deviation and first order autocorrelation of each column of path.
+    """
+    path = path - np.mean(path, axis = 0)
+    std = np.std(path, axis = 0)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        autocorr = np.where(std > 0, np.mean(path[1: ] * path[: -1], axis = 0) / std ** 2, 0)
+    return(std, autocorr)
+
+
+def analysedraw(solved, irfperiods, simperiods, rng):
+    """
+    All the outputs for a single solved draw as one flat vector (in the order of getlayout).
+    """
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from moments_func import getirfs
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from moments_func import getvarcov_z
+
+    hx = solved['hx']
+    M = solved['M']
+    eta = solved['eta']
+    obsrows = [solved['varnames'].index(var) for var in solved['observed']]
+
+    irfs = getirfs(hx, M, eta, irfperiods = irfperiods)
+
+    Sigma_z = getvarcov_z(hx, eta)
+    var = np.einsum('ij,jk,ik->i', M, Sigma_z, M)
+    std = np.sqrt(np.maximum(var, 0))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        autocorr = np.where(var > 0, np.einsum('ij,jk,ik->i', M, hx @ Sigma_z, M) / var, 0)
+
+    # simulate from the unconditional distribution so there's no burn in
+    # Sigma_z is often singular (lagged variables, shock rows) so use its eigendecomposition rather than Cholesky
+    eigvals, eigvecs = np.linalg.eigh(Sigma_z)
+    z = eigvecs @ (np.sqrt(np.maximum(eigvals, 0)) * rng.standard_normal(len(Sigma_z)))
+    shocks = rng.standard_normal([simperiods, np.shape(eta)[1]])
+    zpath = np.empty([simperiods, len(z)])
+    for t in range(simperiods):
+        zpath[t] = z
+        z = hx @ z + eta @ shocks[t]
+    simobs = zpath @ M[obsrows].transpose() + rng.standard_normal([simperiods, len(obsrows)]) * np.array(solved['mesd'], dtype = float)
+    simstd, simautocorr = getstdautocorr(simobs)
+
+    return(np.concatenate((irfs.reshape(-1), std, autocorr, simobs.reshape(-1), simstd, simautocorr)))
+
+
+def getlayout(solved, irfperiods, simperiods):
+    """
+    Name and shape of each output in the flat vector returned by analysedraw.
+    """
+    numvars = len(solved['varnames'])
+    numobs = len(solved['observed'])
+    return([('irfs', (len(solved['shocks']), irfperiods, numvars)), ('std', (numvars, )), ('autocorr', (numvars, )), ('simobs', (simperiods, numobs)), ('simstd', (numobs, )), ('simautocorr', (numobs, ))])
+
+
+def analysechunk(getsolvefunc, solveargs, draws, drawindices, irfperiods, simperiods, seed):
+    """
+    Solve and analyse each draw in a chunk. Draws which can't be solved are skipped.
+    Returns the names of the variables, the layout and a draws x outputs array (or None for each if nothing solved).
+    """
+    key = (getsolvefunc.__module__, getsolvefunc.__name__, repr(solveargs))
+    if key not in solvecache:
+        solvecache[key] = getsolvefunc(*solveargs)
+    solvefunc = solvecache[key]
+
+    rows = []
+    info = None
+    for i in range(np.shape(draws)[0]):
+        try:
+            solved = solvefunc(list(draws[i]))
+        except (ValueError, np.linalg.LinAlgError):
+            continue
+        if not np.all(np.isfinite(solved['hx'])) or np.max(np.abs(np.linalg.eigvals(solved['hx']))) >= 1:
+            continue
+        # the random numbers only depend on the draw so the results don't depend on the chunks or the pool
+        rng = np.random.default_rng([seed, int(drawindices[i])])
+        rows.append(analysedraw(solved, irfperiods, simperiods, rng))
+        if info is None:
+            info = {'varnames': list(solved['varnames']), 'shocks': list(solved['shocks']), 'observed': list(solved['observed']), 'layout': getlayout(solved, irfperiods, simperiods)}
+
+    if len(rows) == 0:
+        return(None, None, np.shape(draws)[0])
+    return(info, np.array(rows), np.shape(draws)[0] - len(rows))
+
+
+def analysechunk_star(args):
+    return(analysechunk(*args))
+
+
+# Engine:{{{1
+def iterthinned(chains, burnin = 0.1, thin = 10, maxdraws = None, chunksize = 500):
+    """
+    Yield (draws, indices) chunks of every thin-th draw after burnin from the chains (see bayes/mdd_func.getchains for what chains can be).
+    """
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from mdd_func import getchains
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from mdd_func import iterchunks
+
+    chains = getchains(chains)
+    index = 0
+    numyielded = 0
+    buffer = []
+    for c, draws, logposts in iterchunks(chains, start = burnin, chunksize = chunksize * thin):
+        for i in range(np.shape(draws)[0]):
+            if index % thin == 0:
+                buffer.append(draws[i])
+                numyielded = numyielded + 1
+                if len(buffer) == chunksize or numyielded == maxdraws:
+                    yield(np.array(buffer), np.arange(numyielded - len(buffer), numyielded))
+                    buffer = []
+                if numyielded == maxdraws:
+                    return
+            index = index + 1
+    if len(buffer) > 0:
+        yield(np.array(buffer), np.arange(numyielded - len(buffer), numyielded))
+
+
+def posterioranalysis(chains, getsolvefunc, solveargs = (), burnin = 0.1, thin = 10, maxdraws = None, irfperiods = 40, simperiods = 100, probs = probs_default, data = None, numprocesses = None, seed = 1, chunksize = 200):
+    """
+    Solve every thin-th draw of chains after burnin (at most maxdraws draws) and return the quantiles across draws.
+    data: simperiods x observed array. If given, simperiods is set to its length and the posterior predictive p-values of its statistics are returned.
+
+    Returns a dict with:
+    - varnames, shocks, observed, probs, numdraws, numfailed
+    - irfbands (probs x shocks x irfperiods x variables) and irfmean
+    - stdbands, autocorrbands (probs x variables)
+    - simobsbands (probs x simperiods x observed): quantiles of the simulated observables in each period
+    - simstdbands, simautocorrbands (probs x observed)
+    - if data is given: datastd, dataautocorr, pvalue_std, pvalue_autocorr
+    """
+    if data is not None:
+        data = np.asarray(data, dtype = float)
+        simperiods = np.shape(data)[0]
+        datastd, dataautocorr = getstdautocorr(data)
+        exceedcount = None
+
+    tasks = ((getsolvefunc, solveargs, draws, indices, irfperiods, simperiods, seed) for draws, indices in iterthinned(chains, burnin = burnin, thin = thin, maxdraws = maxdraws, chunksize = chunksize))
+
+    if numprocesses == 1:
+        pool = None
+        results = map(analysechunk_star, tasks)
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(numprocesses)
+        # imap so only a few chunks are held in memory at a time
+        results = pool.imap(analysechunk_star, tasks)
+
+    info = None
+    sketch = None
+    numfailed = 0
+    try:
+        for chunkinfo, rows, chunkfailed in results:
+            numfailed = numfailed + chunkfailed
+            if rows is None:
+                continue
+            if sketch is None:
+                info = chunkinfo
+                sketch = P2Quantiles([np.shape(rows)[1]], probs = probs)
+                if data is not None:
+                    exceedcount = np.zeros(2 * len(info['observed']))
+            for row in rows:
+                sketch.update(row)
+            if data is not None:
+                numobs = len(info['observed'])
+                exceedcount = exceedcount + np.sum(rows[:, -2 * numobs: ] >= np.concatenate((datastd, dataautocorr)), axis = 0)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if sketch is None:
+        raise ValueError('None of the draws could be solved. Number of draws: ' + str(numfailed) + '.')
+
+    # split the flat vectors back into the outputs
+    quantiles = sketch.quantiles()
+    mean = sketch.mean()
+    retdict = {'varnames': info['varnames'], 'shocks': info['shocks'], 'observed': info['observed'], 'probs': list(probs), 'numdraws': sketch.count, 'numfailed': numfailed}
+    position = 0
+    for name, shape in info['layout']:
+        size = int(np.prod(shape))
+        retdict[name + 'bands'] = quantiles[:, position: position + size].reshape((len(probs), ) + shape)
+        if name == 'irfs':
+            retdict['irfmean'] = mean[position: position + size].reshape(shape)
+        position = position + size
+    retdict['irfbands'] = retdict.pop('irfsbands')
+
+    if data is not None:
+        numobs = len(info['observed'])
+        retdict['datastd'] = datastd
+        retdict['dataautocorr'] = dataautocorr
+        retdict['pvalue_std'] = exceedcount[: numobs] / sketch.count
+        retdict['pvalue_autocorr'] = exceedcount[numobs: ] / sketch.count
+
+    return(retdict)
+
+
+# Project Models:{{{1
+def getsolvefunc_model_func(estimatevars = None):
+    """
+    The c/y model in bayes/model_func.py. The values are for estimatevars (getestimatevars() by default).
+    """
+    import copy
+
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import addABCD
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getestimatevars
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getnumderivs_unknownparams
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getparamexogdict
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsge_bkdiscrete_func import gxhx
+
+    if estimatevars is None:
+        estimatevars = getestimatevars()
+    r0 = getnumderivs_unknownparams(getparamexogdict(), estimatevars)
+
+    def solvefunc(values):
+        r = {key: r0[key] for key in ['stateposdict', 'controlposdict', 'states', 'controls']}
+        r['varssdict'] = copy.copy(r0['varssdict'])
+        for i in range(len(estimatevars)):
+            r['varssdict'][estimatevars[i]] = values[i]
+        nfx, nfxp, nfy, nfyp = r0['fxfy_f'](*values)
+        r['C'], r['A'] = gxhx(nfx, nfxp, nfy, nfyp)
+        r = addABCD(r)
+
+        solved = {}
+        solved['hx'] = np.array(r['A'], dtype = float)
+        solved['eta'] = np.array(r['B'], dtype = float)
+        solved['M'] = np.concatenate((np.eye(len(r['states'])), np.array(r['C'], dtype = float)), axis = 0)
+        solved['varnames'] = r['states'] + r['controls']
+        solved['shocks'] = ['epsilon_a']
+        solved['observed'] = r['observedy']
+        solved['mesd'] = [float(r['varssdict']['ME_' + var]) for var in r['observedy']]
+        return(solved)
+
+    return(solvefunc)
+
+
+def getsolvefunc_data(paramnames = None):
+    """
+    The Ygr/Cgr model in bayes/data.py (the measurement error is in the equations). The values are for paramnames (RHO, BETA, ALPHA like dobayes_dsge by default).
+    """
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from data import getinputdict_full
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from lazymodel_func import getlazymodel
+
+    if paramnames is None:
+        paramnames = ['RHO', 'BETA', 'ALPHA']
+    model = getlazymodel(getinputdict_full())
+
+    def solvefunc(values):
+        inputdict = getinputdict_full({paramnames[i]: values[i] for i in range(len(paramnames))})
+        model.update({'paramssdict': inputdict['paramssdict'], 'varssdict': inputdict['varssdict']})
+
+        states = model['states']
+        shocks = model['shocks']
+        nz = len(states) + len(shocks)
+        solved = {}
+        solved['hx'] = np.array(model['hx'], dtype = float)
+        solved['eta'] = np.concatenate((np.zeros([len(states), len(shocks)]), np.eye(len(shocks))), axis = 0)
+        solved['M'] = np.concatenate((np.eye(nz), np.array(model['gx'], dtype = float)), axis = 0)
+        solved['varnames'] = states + shocks + model['controls']
+        solved['shocks'] = list(shocks)
+        solved['observed'] = ['Ygr', 'Cgr']
+        solved['mesd'] = [0, 0]
+        return(solved)
+
+    return(solvefunc)
+
+
+def posterioranalysis_model_func(realdata = True, numprocesses = None, thin = 10, maxdraws = None):
+    """
+    Bands for the chains saved by getdists_multiprocessing with posterior predictive p-values for the data they were estimated on.
+    """
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getrealdata
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getsimdata
+
+    if realdata is True:
+        savefolder = __projectdir__ / Path('me/bayes/temp/dist_real/')
+        data = getrealdata()
+    else:
+        savefolder = __projectdir__ / Path('me/bayes/temp/dist_sim/')
+        data = getsimdata()
+
+    return(posterioranalysis(savefolder, getsolvefunc_model_func, thin = thin, maxdraws = maxdraws, data = data, numprocesses = numprocesses))
+
+
+# Test:{{{1
+def getsolvefunc_test():
+    """
+    x_{t+1} = RHO x_t + SIGMA epsilon_{t+1}, y_t = 2 x_t observed with measurement error 0.1.
+    """
+    def solvefunc(values):
+        rho, sigma = values
+        if abs(rho) >= 1:
+            raise ValueError('Not stationary.')
+        solved = {}
+        solved['hx'] = np.array([[rho]])
+        solved['eta'] = np.array([[sigma]])
+        solved['M'] = np.array([[1], [2]])
+        solved['varnames'] = ['x', 'y']
+        solved['shocks'] = ['epsilon']
+        solved['observed'] = ['y']
+        solved['mesd'] = [0.1]
+        return(solved)
+
+    return(solvefunc)
+
+
+def posteriorpredictive_test():
+    import time
+
+    # the sketch is close to the exact quantiles
+    rng = np.random.default_rng(1)
+    values = rng.lognormal(size = [20000, 3, 4])
+    sketch = P2Quantiles([3, 4])
+    for value in values:
+        sketch.update(value)
+    exact = np.quantile(values, probs_default, axis = 0)
+    relerror = np.max(np.abs(sketch.quantiles() - exact) / exact)
+    if relerror > 0.02:
+        raise ValueError('P2 quantiles differ from the exact quantiles by ' + str(relerror) + '.')
+    if not np.allclose(sketch.mean(), np.mean(values, axis = 0)):
+        raise ValueError('Running mean is wrong.')
+
+    # IRF bands from draws of rho match the analytical quantiles
+    numdraws = 4000
+    rhos = rng.uniform(0.2, 0.9, numdraws)
+    # include some draws that can't be solved
+    rhos[: 10] = 1.5
+    draws = np.column_stack((rhos, np.full(numdraws, 0.5)))
+    start = time.perf_counter()
+    result = posterioranalysis({'draws': draws, 'logposts': None}, getsolvefunc_test, burnin = 0, thin = 1, irfperiods = 10, simperiods = 50, numprocesses = 2, chunksize = 250)
+    runtime = time.perf_counter() - start
+    if result['numdraws'] != numdraws - 10 or result['numfailed'] != 10:
+        raise ValueError('Wrong number of draws solved: ' + str(result['numdraws']) + '.')
+    # the IRF of y at horizon h is 2 * 0.5 * rho^h which is monotonic in rho
+    for h in [1, 5]:
+        exactband = np.quantile(np.sort(rhos[10: ]) ** h, probs_default)
+        if np.max(np.abs(result['irfbands'][:, 0, h, 1] - exactband)) > 0.02:
+            raise ValueError('IRF bands are wrong at horizon ' + str(h) + '.')
+    # the median of the std of x: 0.5 / sqrt(1 - rho^2)
+    if abs(result['stdbands'][2, 0] - np.median(0.5 / np.sqrt(1 - rhos[10: ] ** 2))) > 0.01:
+        raise ValueError('Moment bands are wrong.')
+    if np.shape(result['simobsbands']) != (5, 50, 1):
+        raise ValueError('Simulated observables bands have the wrong shape.')
+
+    # results don't depend on the pool
+    result1 = posterioranalysis({'draws': draws[: 500]}, getsolvefunc_test, burnin = 0, thin = 1, irfperiods = 10, simperiods = 50, numprocesses = 1, chunksize = 100)
+    result2 = posterioranalysis({'draws': draws[: 500]}, getsolvefunc_test, burnin = 0, thin = 1, irfperiods = 10, simperiods = 50, numprocesses = 2, chunksize = 60)
+    if not np.array_equal(result1['simobsbands'], result2['simobsbands']):
+        raise ValueError('Results depend on the pool.')
+
+    # posterior predictive p-value: data from the model is not extreme but data with a much larger variance is
+    datapath = np.empty(200)
+    x = 0
+    for t in range(200):
+        x = 0.6 * x + 0.5 * rng.standard_normal()
+        datapath[t] = 2 * x + 0.1 * rng.standard_normal()
+    result = posterioranalysis({'draws': draws[10: 1010]}, getsolvefunc_test, burnin = 0, thin = 1, data = datapath[:, np.newaxis], numprocesses = 1)
+    if not 0.02 < result['pvalue_std'][0] < 0.98:
+        raise ValueError('Data from the model has an extreme p-value: ' + str(result['pvalue_std']) + '.')
+    result = posterioranalysis({'draws': draws[10: 1010]}, getsolvefunc_test, burnin = 0, thin = 1, data = 10 * datapath[:, np.newaxis], numprocesses = 1)
+    if result['pvalue_std'][0] > 0.01:
+        raise ValueError('Data with a much larger variance does not have an extreme p-value.')
+
+    print('Posterior predictive test passed. Time for ' + str(numdraws) + ' draws: ' + str(runtime) + 's.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    posteriorpredictive_test()
@@ -176,10 +176,18 @@ def getsimdata(numperiods = 100):
     return(varnames, data)
 
     
-def dobayes_dsge():
+def dobayes_dsge(profile = False):
+    """
+    If profile is True, print the time spent in the likelihood, the prior and the posterior.
+    """
     # get same every time
     np.random.seed(41)
 
+    if profile is True:
+        sys.path.append(str(__projectdir__ / Path('runtime')))
+        from profiling_func import enable
+        enable()
+
     # get likelihood function:{{{
 
     # get inputdict with fxe_f etc. functions
@@ -234,6 +242,13 @@ def dobayes_dsge():
         Note that we log the prior function
         """
         return(np.log(priorfunc(values)) + loglikelihoodfunc(values))
+
+    # time each part (does nothing unless profiling is enabled)
+    sys.path.append(str(__projectdir__ / Path('runtime')))
+    from profiling_func import timed
+    loglikelihoodfunc = timed('likelihood', loglikelihoodfunc)
+    priorfunc = timed('prior', priorfunc)
+    posteriorfunc = timed('posterior', posteriorfunc)
     # }}}
 
     # implement metropolis-hastings:{{{
@@ -241,5 +256,14 @@ def dobayes_dsge():
     from bayesian_func import metropolis_hastings
     results = metropolis_hastings(posteriorfunc, scalelist, prior_means, 10000, lowerboundlist = prior_lbs, upperboundlist = prior_ubs, printdetails = True, logposterior = True)
     print(np.mean(np.array(results)[1000: , :], axis = 0))
+
+    if profile is True:
+        sys.path.append(str(__projectdir__ / Path('runtime')))
+        from profiling_func import printstats
+        printstats()
     # }}}
-dobayes_dsge()
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    dobayes_dsge()
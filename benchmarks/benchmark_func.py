@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Small benchmark harness.
+
+A benchmark is a function setup(seed) which does any work that shouldn't be timed and returns a function with no arguments which is timed.
+Each benchmark is timed numrepeats times (after one warm-up call) and I record the minimum, median, mean and max.
+If a benchmark raises an error (for example because an optional dependency is missing) I record the error and move on so the rest of the suite still runs.
+
+Results are saved as JSON with details of the machine and the git commit so runs from different versions can be compared with comparebenchmarks.
+"""
+import os
+from pathlib import Path
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import json
+import time
+
+import numpy as np
+
+seed_default = 1
+
+# Timing:{{{1
+def timefunction(f, numrepeats = 5, numwarmup = 1):
+    """
+    Time f() numrepeats times after numwarmup calls.
+    """
+    for i in range(numwarmup):
+        f()
+
+    times = []
+    for i in range(numrepeats):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+
+    times = np.array(times)
+    stats = {}
+    stats['min'] = float(np.min(times))
+    stats['median'] = float(np.median(times))
+    stats['mean'] = float(np.mean(times))
+    stats['max'] = float(np.max(times))
+    stats['numrepeats'] = numrepeats
+
+    return(stats)
+
+
+def runbenchmark(setup, numrepeats = 5, numwarmup = 1, seed = seed_default):
+    """
+    Run setup(seed) with the random seed fixed and time the function it returns.
+    """
+    import random
+    import traceback
+
+    random.seed(seed)
+    np.random.seed(seed)
+    try:
+        start = time.perf_counter()
+        f = setup(seed)
+        setuptime = time.perf_counter() - start
+
+        stats = timefunction(f, numrepeats = numrepeats, numwarmup = numwarmup)
+        stats['setup'] = setuptime
+    except Exception as e:
+        stats = {'error': repr(e), 'traceback': traceback.format_exc()}
+
+    return(stats)
+
+
+def runbenchmarks(benchmarks, names = None, numrepeats = 5, numwarmup = 1, seed = seed_default, printdetails = True):
+    """
+    benchmarks: dict of name -> setup function (or name -> (setup function, numrepeats) to override numrepeats)
+    names: only run these benchmarks
+    """
+    results = {}
+    for name in benchmarks:
+        if names is not None and name not in names:
+            continue
+
+        if isinstance(benchmarks[name], tuple):
+            setup, numrepeats_benchmark = benchmarks[name]
+        else:
+            setup = benchmarks[name]
+            numrepeats_benchmark = numrepeats
+
+        results[name] = runbenchmark(setup, numrepeats = numrepeats_benchmark, numwarmup = numwarmup, seed = seed)
+
+        if printdetails is True:
+            if 'error' in results[name]:
+                print(name + ': error ' + results[name]['error'])
+            else:
+                print(name + ': median ' + str(round(results[name]['median'], 6)) + 's, min ' + str(round(results[name]['min'], 6)) + 's')
+
+    return(results)
+
+
+# Saving:{{{1
+def getmetadata():
+    """
+    Details of the machine and version to save with the results.
+    """
+    import datetime
+    import platform
+    import subprocess
+
+    metadata = {}
+    metadata['time'] = datetime.datetime.now().isoformat()
+    metadata['python'] = platform.python_version()
+    metadata['platform'] = platform.platform()
+    metadata['numpy'] = np.__version__
+    metadata['cpucount'] = os.cpu_count()
+    try:
+        metadata['gitcommit'] = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = str(__projectdir__), stderr = subprocess.DEVNULL).decode('utf-8').strip()
+    except Exception:
+        metadata['gitcommit'] = None
+
+    return(metadata)
+
+
+def savebenchmarks(results, filename):
+    """
+    Save results and metadata as JSON.
+    """
+    output = {'metadata': getmetadata(), 'results': results}
+
+    filename = str(filename)
+    if os.path.dirname(filename) != '' and not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename + '_temp', 'w') as f:
+        json.dump(output, f, indent = 1, sort_keys = True)
+    os.replace(filename + '_temp', filename)
+
+
+def loadbenchmarks(filename):
+    with open(filename) as f:
+        output = json.load(f)
+    return(output)
+
+
+def comparebenchmarks(oldfilename, newfilename, tolerance = 0.1, printdetails = True):
+    """
+    Compare the median times of two saved runs.
+    Returns a dict of name -> ratio of new to old median and the list of benchmarks which got slower by more than tolerance.
+    """
+    old = loadbenchmarks(oldfilename)['results']
+    new = loadbenchmarks(newfilename)['results']
+
+    ratios = {}
+    slower = []
+    for name in new:
+        if name not in old or 'median' not in old[name] or 'median' not in new[name]:
+            continue
+        ratios[name] = new[name]['median'] / old[name]['median']
+        if ratios[name] > 1 + tolerance:
+            slower.append(name)
+        if printdetails is True:
+            print(name + ': ' + str(round(ratios[name], 3)) + ('  SLOWER' if name in slower else ''))
+
+    return(ratios, slower)
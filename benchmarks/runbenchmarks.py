@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the main steps in setting up, solving, simulating and estimating models.
+
+Models:
+- rbc_simple: dsgesetup/rbc_simple.py
+- nk_simple: dsgesetup/nk_simple.py
+- rbc_growth: the RBC model with growth observables in bayes/data.py
+- scaled: a synthetic N-sector RBC model with input-output links (dsgesetup/synthetic_func.py)
+
+Run this file to run every benchmark and save the results to benchmarks/results/ as JSON named by the git commit. Compare two runs with comparebenchmarks in benchmark_func.py.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import copy
+import functools
+
+modelnames_default = ['rbc_simple', 'nk_simple', 'rbc_growth', 'scaled']
+kalmanperiods_default = [160, 1000, 10000]
+scaledsectors_default = 20
+
+# Models:{{{1
+def getinputdict_model(modelname):
+    if modelname == 'rbc_simple':
+        sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+        from rbc_simple import getinputdict
+        inputdict = getinputdict()
+    elif modelname == 'nk_simple':
+        sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+        from nk_simple import getinputdict
+        inputdict = getinputdict()
+    elif modelname == 'rbc_growth':
+        sys.path.append(str(__projectdir__ / Path('bayes')))
+        from data import getinputdict_full
+        inputdict = getinputdict_full()
+    elif modelname == 'scaled':
+        sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+        from synthetic_func import getinputdict
+        inputdict = getinputdict(numsectors = scaledsectors_default)
+    else:
+        raise ValueError('Unknown model: ' + modelname + '.')
+
+    # nk_simple has no shocks
+    if 'shocks' not in inputdict:
+        inputdict['shocks'] = []
+
+    return(inputdict)
+
+
+def getlazymodel_model(modelname):
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from lazymodel_func import getlazymodel
+    return(getlazymodel(getinputdict_model(modelname)))
+
+
+# Model Construction:{{{1
+def setup_getbasicmodel(seed):
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getbasicmodel
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getparamexogdict
+
+    return(lambda: getbasicmodel(getparamexogdict()))
+
+
+def setup_getinputdict_bayesian(module, seed):
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    if module == 'simple':
+        from simple import getinputdict_bayesian
+    else:
+        from data import getinputdict_bayesian
+
+    return(getinputdict_bayesian)
+
+
+# Jacobians and Solving:{{{1
+def setup_jacobian(modelname, seed):
+    model = getlazymodel_model(modelname)
+    jac_f = model['jac_f']
+    args = [model['numdict'][name] for name in model['jac_argnames']]
+
+    return(lambda: jac_f(*args, dense = True))
+
+
+def setup_gxhx(modelname, seed):
+    model = getlazymodel_model(modelname)
+    nfxe, nfxep, nfy, nfyp = [model[name] for name in ['nfxe', 'nfxep', 'nfy', 'nfyp']]
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsge_bkdiscrete_func import gxhx
+
+    return(lambda: gxhx(nfxe, nfxep, nfy, nfyp))
+
+
+def setup_linearsim(modelname, seed, simperiods = 1000):
+    model = getlazymodel_model(modelname)
+    model['pathsimperiods'] = simperiods
+    model['seed'] = seed
+    # solve before timing
+    model['gx']
+    model['shockpath']
+
+    def f():
+        model.invalidate('sim')
+        return(model['varpath'])
+
+    return(f)
+
+
+# Kalman Filter:{{{1
+def setup_kalman(numperiods, seed):
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import allparams_solve
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import addABCD
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from model_func import getparamexogdict
+    r = addABCD(allparams_solve(getparamexogdict()))
+
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/statespace')))
+    from statespace_func import statespace_simdata
+    X, y, v = statespace_simdata(r['A'], r['B2'], r['C2'], r['D2'], numperiods)
+
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/statespace')))
+    from statespace_func import kalmanfilter
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/statespace')))
+    from statespace_func import logl_prop_kalmanfilter
+
+    def f():
+        x_t_tm1, P_t_tm1, x_t_t, P_t_t, y_t_tm1, Q_t_tm1, R_t_tm1 = kalmanfilter(y, r['A'], r['B2'], r['C2'], r['D2'])
+        return(logl_prop_kalmanfilter(y, y_t_tm1, Q_t_tm1))
+
+    return(f)
+
+
+# Occbin:{{{1
+def setup_myoccbin(seed):
+    import tempfile
+
+    sys.path.append(str(__projectdir__ / Path('regimes')))
+    import zlbsolve_func
+
+    p_nozlb = zlbsolve_func.getp_default()
+    p_nozlb['monetary'] = 'taylor'
+    inputdict_nozlb = zlbsolve_func.getinputdict(p_nozlb)
+
+    p_zlb = zlbsolve_func.getp_default()
+    p_zlb['monetary'] = 'zlb'
+    inputdict_zlb = zlbsolve_func.getinputdict(p_zlb)
+
+    savefolder = tempfile.mkdtemp()
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from myoccbin_func import myoccbin
+
+    return(lambda: myoccbin(copy.deepcopy(inputdict_nozlb), copy.deepcopy(inputdict_zlb), 'Ihat > -log(I_ss)', zlbsolve_func.shockpath_default, savefolder = savefolder, printdetails = False, irf = True, regimeupdatefunc = 'occbin'))
+
+
+# MCMC:{{{1
+def setup_mcmcstep(seed):
+    """
+    One iteration of metropolis_hastings on the posterior of the model in bayes/model_func.py with simulated data.
+    """
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    import model_func
+
+    y = model_func.getsimdata()
+    estimatevars = model_func.getestimatevars()
+    logl_func = model_func.getloglfunc(estimatevars, y)
+
+    lowerbounddict, upperbounddict = model_func.getbounddicts(estimatevars)
+    paramssdict = model_func.getparamexogdict()
+    startvals = [paramssdict[var] for var in estimatevars]
+    scalelist = [0.01 * (upperbounddict[var] - lowerbounddict[var]) for var in estimatevars]
+
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
+    from bayesian_func import metropolis_hastings
+
+    return(lambda: metropolis_hastings(logl_func, scalelist, startvals, 1, lowerboundlist = [lowerbounddict[var] for var in estimatevars], upperboundlist = [upperbounddict[var] for var in estimatevars], printdetails = False, logposterior = True))
+
+
+# All Benchmarks:{{{1
+def getbenchmarks(modelnames = None, kalmanperiods = None):
+    """
+    Return a dict of name -> setup function for benchmark_func.runbenchmarks.
+    """
+    if modelnames is None:
+        modelnames = modelnames_default
+    if kalmanperiods is None:
+        kalmanperiods = kalmanperiods_default
+
+    benchmarks = {}
+    benchmarks['construct_getbasicmodel'] = (setup_getbasicmodel, 3)
+    benchmarks['construct_getinputdict_bayesian_simple'] = (functools.partial(setup_getinputdict_bayesian, 'simple'), 3)
+    benchmarks['construct_getinputdict_bayesian_data'] = (functools.partial(setup_getinputdict_bayesian, 'data'), 3)
+    for modelname in modelnames:
+        benchmarks['jacobian_' + modelname] = functools.partial(setup_jacobian, modelname)
+    for modelname in modelnames:
+        benchmarks['gxhx_' + modelname] = functools.partial(setup_gxhx, modelname)
+    for numperiods in kalmanperiods:
+        benchmarks['kalman_T' + str(numperiods)] = functools.partial(setup_kalman, numperiods)
+    for modelname in modelnames:
+        if modelname != 'nk_simple':
+            benchmarks['linearsim_' + modelname] = functools.partial(setup_linearsim, modelname)
+    benchmarks['myoccbin'] = (setup_myoccbin, 3)
+    benchmarks['mcmcstep'] = setup_mcmcstep
+
+    return(benchmarks)
+
+
+def runall(names = None, savefolder = None, numrepeats = 5):
+    """
+    Run the benchmarks and save the results as JSON.
+    """
+    sys.path.append(str(__projectdir__ / Path('benchmarks')))
+    from benchmark_func import runbenchmarks
+    results = runbenchmarks(getbenchmarks(), names = names, numrepeats = numrepeats)
+
+    if savefolder is None:
+        savefolder = __projectdir__ / Path('benchmarks/results/')
+    sys.path.append(str(__projectdir__ / Path('benchmarks')))
+    from benchmark_func import getmetadata
+    gitcommit = getmetadata()['gitcommit']
+    if gitcommit is None:
+        gitcommit = 'nogit'
+
+    sys.path.append(str(__projectdir__ / Path('benchmarks')))
+    from benchmark_func import savebenchmarks
+    savebenchmarks(results, os.path.join(savefolder, 'benchmarks_' + gitcommit[: 10] + '.json'))
+
+    return(results)
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    runall()
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Continuous-time linear DSGE solver which caches the solution so that IRFs and simulations on any time grid are cheap.
+
+The inputdict is the same as for continuouslineardsgefull (see continuous/simple.py and continuous/loglin.py): the equations are written in terms of the states, the controls and their time derivatives var_dot. Controls which appear with a _dot are jump variables and controls without a _dot are static.
+
+Writing w = [states; controls] (as log deviations if logvars/loglineareqs is specified and deviations from the steady state otherwise), the linearized system is:
+Gamma0 w_dot = Gamma1 w
+I solve it once with an ordered QZ decomposition which puts the finite eigenvalues with negative real part (the stable subspace) first. The solution is:
+states_dot = hx states
+controls = gx states
+The eigendecomposition of hx (from np.linalg.eig on hx) is cached so exp(hx t) for any t is just exp(lambda t) times two cached matrices. If hx is not diagonalizable (or the eigenvectors are badly conditioned), I fall back to one matrix exponential per step size which is cached.
+
+Shocks:
+- irfshocks: the IRF to a shock to a state is the path starting from a unit deviation of that state
+- shocksddict (optional): {state: sd} where sd can be the name of a parameter. The states are hit by Brownian shocks: d states = hx states dt + S dW. The default is sd 1 for each irfshock.
+The exact discretization over a step dt is:
+states_{t + dt} = Phi(dt) states_t + e, e ~ N(0, Q(dt))
+Phi(dt) = exp(hx dt) and Q(dt) = int_0^dt exp(hx s) S S' exp(hx' s) ds. Phi and Q are cached by dt.
+
+Batching:
+- irfs takes a list of shocks and either one time grid or a list of grids
+- getirfs_params evaluates the IRFs for a list of parameter values. The equations are only parsed and differentiated once.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+# the eigenvectors are only used if their condition number is below this
+maxcond_default = 1e8
+
+# Linear System:{{{1
+def getlinearsystem(inputdict):
+    """
+    Parse and differentiate the equations.
+    Returns a dict with a function f(*argvalues) that returns the numerical Gamma0, Gamma1 and the names of the arguments (parameters and steady states var_ss).
+    """
+    import sympy
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgediff_func import convertstringlisttosympy
+    eqs = convertstringlisttosympy(inputdict['equations'])
+
+    variables = inputdict['states'] + inputdict['controls']
+    varsymbols = [sympy.Symbol(var) for var in variables]
+    dotsymbols = [sympy.Symbol(var + '_dot') for var in variables]
+    sssymbols = [sympy.Symbol(var + '_ss') for var in variables]
+
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from secondorder_func import getlogvarslist
+    logvars = getlogvarslist(inputdict)
+
+    # write log variables as var = var_ss exp(var) so var_dot = var_ss exp(var) var_dot
+    if len(logvars) > 0:
+        replacedict = {}
+        for i in range(len(variables)):
+            if variables[i] in logvars:
+                replacedict[varsymbols[i]] = sssymbols[i] * sympy.exp(varsymbols[i])
+                replacedict[dotsymbols[i]] = sssymbols[i] * sympy.exp(varsymbols[i]) * dotsymbols[i]
+        eqs = [eq.xreplace(replacedict) for eq in eqs]
+
+    # point at which to take the derivatives
+    pointdict = {}
+    for i in range(len(variables)):
+        if variables[i] in logvars or inputdict.get('loglineareqs') is True:
+            pointdict[varsymbols[i]] = 0
+        else:
+            pointdict[varsymbols[i]] = sssymbols[i]
+        pointdict[dotsymbols[i]] = 0
+
+    F = sympy.Matrix(eqs)
+    # Gamma0 w_dot = Gamma1 w
+    Gamma0 = F.jacobian(dotsymbols).xreplace(pointdict)
+    Gamma1 = -F.jacobian(varsymbols).xreplace(pointdict)
+
+    argsymbols = sorted(Gamma0.free_symbols.union(Gamma1.free_symbols), key = str)
+    f = sympy.lambdify(argsymbols, [Gamma0, Gamma1], modules = 'numpy', cse = True)
+
+    system = {}
+    system['f'] = f
+    system['argnames'] = [str(symbol) for symbol in argsymbols]
+    system['states'] = list(inputdict['states'])
+    system['controls'] = list(inputdict['controls'])
+
+    return(system)
+
+
+def getargvalues(system, inputdict, p = None):
+    """
+    Values of the arguments of system['f'].
+    p: dict of parameters (or steady states) to use instead of those in inputdict
+    """
+    paramssdict = dict(inputdict['paramssdict'])
+    if p is not None:
+        paramssdict.update(p)
+    inputdict = dict(inputdict)
+    inputdict['paramssdict'] = paramssdict
+
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from secondorder_func import getssdict_inputdict
+    ssdict = getssdict_inputdict(inputdict)
+
+    argvalues = []
+    for name in system['argnames']:
+        if name.endswith('_ss') and name[: -3] in ssdict:
+            argvalues.append(ssdict[name[: -3]])
+        elif name in paramssdict:
+            argvalues.append(paramssdict[name])
+        else:
+            raise ValueError('No value given for ' + name + '.')
+
+    return(argvalues)
+
+
+def getGamma(system, argvalues):
+    Gamma0, Gamma1 = system['f'](*argvalues)
+    return(np.array(Gamma0, dtype = float), np.array(Gamma1, dtype = float))
+
+
+# Solve:{{{1
+def solvecontinuous(Gamma0, Gamma1, nx, tol = 1e-10, maxcond = maxcond_default):
+    """
+    Solve Gamma0 w_dot = Gamma1 w where the first nx elements of w are the states.
+    Returns a dict with hx, gx and the cached decomposition.
+    """
+    import scipy.linalg
+
+    def isstable(alpha, beta):
+        stable = np.abs(beta) > tol
+        stable[stable] = np.real(alpha[stable] / beta[stable]) < 0
+        return(stable)
+
+    # the pencil Gamma1 - lambda Gamma0 with the stable eigenvalues first
+    AA, BB, alpha, beta, Q, Z = scipy.linalg.ordqz(Gamma1, Gamma0, sort = isstable, output = 'complex')
+    ns = int(np.sum(isstable(alpha, beta)))
+
+    if ns != nx:
+        raise ValueError('Blanchard-Kahn conditions fail: ' + str(ns) + ' stable eigenvalues and ' + str(nx) + ' states.')
+
+    Z11 = Z[: nx, : ns]
+    Z21 = Z[nx: , : ns]
+    if np.linalg.cond(Z11) > 1 / tol:
+        raise ValueError('The states do not pin down the stable subspace.')
+    Z11inv = np.linalg.inv(Z11)
+
+    # on the stable subspace w = Z1 s and s_dot = T11 s where T11 is upper triangular
+    T11 = np.linalg.solve(BB[: ns, : ns], AA[: ns, : ns])
+
+    solution = {}
+    solution['hx'] = np.real(Z11 @ T11 @ Z11inv)
+    solution['gx'] = np.real(Z21 @ Z11inv)
+    solution['T11'] = T11
+    solution['Z11'] = Z11
+    solution['Z11inv'] = Z11inv
+
+    # eigendecomposition of hx
+    eigenvalues, V = np.linalg.eig(solution['hx'])
+    if nx > 0 and np.linalg.cond(V) < maxcond:
+        solution['diagonalizable'] = True
+        solution['eigenvalues'] = eigenvalues
+        solution['V'] = V
+        solution['Vinv'] = np.linalg.inv(V)
+    else:
+        solution['diagonalizable'] = False
+
+    return(solution)
+
+
+# Cache:{{{1
+def getdtkey(dt):
+    """
+    Round dt so that step sizes which differ only by floating point error share a cache entry.
+    """
+    return(float('%.12g' % dt))
+
+
+class ContinuousCache(object):
+    """
+    A solved continuous-time model with cached matrix exponentials and discretizations.
+    """
+    def __init__(self, hx, gx, states, controls, shocksddict = None, solution = None, maxcond = maxcond_default):
+        self.states = list(states)
+        self.controls = list(controls)
+        self.hx = np.asarray(hx, dtype = float)
+        self.gx = np.asarray(gx, dtype = float)
+        nx = len(self.states)
+        self.M = np.concatenate((np.eye(nx), self.gx), axis = 0)
+
+        if solution is None:
+            eigenvalues, V = np.linalg.eig(self.hx)
+            solution = {'hx': self.hx, 'gx': self.gx, 'diagonalizable': False}
+            if nx > 0 and np.linalg.cond(V) < maxcond:
+                solution.update({'diagonalizable': True, 'eigenvalues': eigenvalues, 'V': V, 'Vinv': np.linalg.inv(V)})
+        self.solution = solution
+
+        if shocksddict is None:
+            shocksddict = {}
+        self.S = np.diag([shocksddict.get(state, 0) for state in self.states])
+        self.SS = self.S @ self.S.transpose()
+
+        self.expmcache = {}
+        self.discretecache = {}
+
+    def expm(self, dt):
+        """
+        exp(hx dt), cached by dt.
+        """
+        key = getdtkey(dt)
+        if key not in self.expmcache:
+            if self.solution['diagonalizable'] is True:
+                V = self.solution['V']
+                Phi = (V * np.exp(self.solution['eigenvalues'] * dt)) @ self.solution['Vinv']
+                self.expmcache[key] = np.real(Phi)
+            else:
+                import scipy.linalg
+                self.expmcache[key] = scipy.linalg.expm(self.hx * dt)
+        return(self.expmcache[key])
+
+    def discretize(self, dt):
+        """
+        Phi(dt), Q(dt) for the exact discretization over a step of dt, cached by dt.
+        """
+        key = getdtkey(dt)
+        if key not in self.discretecache:
+            if self.solution['diagonalizable'] is True:
+                Q = getQ_eig(self.solution['eigenvalues'], self.solution['V'], self.solution['Vinv'], self.SS, dt)
+            else:
+                Q = getQ_vanloan(self.hx, self.SS, dt)
+            # make sure Q is exactly symmetric
+            self.discretecache[key] = (self.expm(dt), (Q + Q.transpose()) / 2)
+        return(self.discretecache[key])
+
+    def statepath_irf(self, times, X0):
+        """
+        Paths of the states at times starting from each column of X0 at time 0.
+        Returns times x states x columns.
+        """
+        times = np.asarray(times, dtype = float)
+        if self.solution['diagonalizable'] is True:
+            # all the times at once: V diag(exp(lambda t)) Vinv X0
+            coeffs = self.solution['Vinv'] @ X0
+            E = np.exp(np.outer(times, self.solution['eigenvalues']))
+            return(np.real(np.einsum('ij,tj,jk->tik', self.solution['V'], E, coeffs)))
+
+        # otherwise step along the grid with one matrix exponential per step size
+        path = np.empty([len(times), len(self.states), np.shape(X0)[1]])
+        X = self.expm(times[0]) @ X0
+        path[0] = X
+        for t in range(1, len(times)):
+            X = self.expm(times[t] - times[t - 1]) @ X
+            path[t] = X
+        return(path)
+
+    def irfs(self, times, shocks = None, shocksizes = None):
+        """
+        IRFs of every variable (states then controls) to a shock to each state in shocks.
+        times: one grid (returns shocks x times x variables) or a list of grids (returns a list of these)
+        shocksizes: dict of the size of each shock (default 1)
+        """
+        if shocks is None:
+            shocks = self.states
+        if shocksizes is None:
+            shocksizes = {}
+
+        X0 = np.zeros([len(self.states), len(shocks)])
+        for j in range(len(shocks)):
+            X0[self.states.index(shocks[j]), j] = shocksizes.get(shocks[j], 1)
+
+        if len(times) > 0 and np.ndim(times[0]) > 0:
+            # list of grids: do them together on the union of the grids
+            grids = [np.asarray(grid, dtype = float) for grid in times]
+            alltimes, inverse = np.unique(np.concatenate(grids), return_inverse = True)
+            allirfs = self.irfs(alltimes, shocks = shocks, shocksizes = shocksizes)
+            irfs = []
+            start = 0
+            for grid in grids:
+                irfs.append(allirfs[:, inverse[start: start + len(grid)], :])
+                start = start + len(grid)
+            return(irfs)
+
+        path = self.statepath_irf(times, X0)
+        # times x variables x shocks -> shocks x times x variables
+        return(np.transpose(np.einsum('ij,tjk->tik', self.M, path), (2, 0, 1)))
+
+    def simulate(self, times, numpaths = 1, seed = None, x0 = None):
+        """
+        Simulate the states with the Brownian shocks at the times in times (starting from x0 at the first time).
+        Returns numpaths x times x variables.
+        """
+        rng = np.random.default_rng(seed)
+        times = np.asarray(times, dtype = float)
+        nx = len(self.states)
+
+        X = np.zeros([numpaths, nx])
+        if x0 is not None:
+            X[:, :] = x0
+        path = np.empty([numpaths, len(times), nx])
+        path[:, 0, :] = X
+        for t in range(1, len(times)):
+            Phi, Q = self.discretize(times[t] - times[t - 1])
+            key = ('chol', getdtkey(times[t] - times[t - 1]))
+            if key not in self.discretecache:
+                self.discretecache[key] = getcholesky(Q)
+            X = X @ Phi.transpose() + rng.standard_normal([numpaths, nx]) @ self.discretecache[key].transpose()
+            path[:, t, :] = X
+
+        return(path @ self.M.transpose())
+
+
+def getQ_eig(eigenvalues, V, Vinv, SS, dt):
+    """
+    int_0^dt exp(hx s) SS exp(hx' s) ds using hx = V diag(lambda) Vinv.
+    In the eigenbasis element (i, j) is W_ij (exp((lambda_i + conj(lambda_j)) dt) - 1) / (lambda_i + conj(lambda_j)) where W = Vinv SS Vinv^H.
+    """
+    W = Vinv @ SS @ Vinv.conj().transpose()
+    L = eigenvalues[:, None] + eigenvalues.conj()[None, :]
+    smallL = np.abs(L * dt) < 1e-10
+    L_nozero = np.where(smallL, 1, L)
+    integral = np.where(smallL, dt, np.expm1(L * dt) / L_nozero)
+    return(np.real(V @ (W * integral) @ V.conj().transpose()))
+
+
+def getQ_vanloan(hx, SS, dt):
+    """
+    int_0^dt exp(hx s) SS exp(hx' s) ds with the Van Loan (1978) method.
+    """
+    import scipy.linalg
+
+    nx = np.shape(hx)[0]
+    C = np.zeros([2 * nx, 2 * nx])
+    C[: nx, : nx] = -hx
+    C[: nx, nx: ] = SS
+    C[nx: , nx: ] = hx.transpose()
+    G = scipy.linalg.expm(C * dt)
+    Phi = G[nx: , nx: ].transpose()
+    return(Phi @ G[: nx, nx: ])
+
+
+def getcholesky(Q):
+    """
+    Cholesky factor allowing for Q being only positive semidefinite (when some states have no shock).
+    """
+    eigenvalues, vectors = np.linalg.eigh(Q)
+    return(vectors * np.sqrt(np.maximum(eigenvalues, 0)))
+
+
+# Inputdict:{{{1
+def getshocksddict(inputdict, p = None):
+    """
+    The standard deviations of the Brownian shocks.
+    Values in shocksddict which are strings are the names of parameters (so the standard deviations can be estimated).
+    """
+    if 'shocksddict' not in inputdict:
+        return({shock: 1 for shock in inputdict.get('irfshocks', [])})
+
+    paramssdict = dict(inputdict['paramssdict'])
+    if p is not None:
+        paramssdict.update(p)
+    shocksddict = {}
+    for state in inputdict['shocksddict']:
+        if isinstance(inputdict['shocksddict'][state], str):
+            shocksddict[state] = paramssdict[inputdict['shocksddict'][state]]
+        else:
+            shocksddict[state] = inputdict['shocksddict'][state]
+    return(shocksddict)
+
+
+def getcontinuouscache(inputdict, p = None, system = None):
+    """
+    Solve the model and return a ContinuousCache.
+    p: parameters to use instead of those in inputdict['paramssdict']
+    system: output of getlinearsystem(inputdict) if already computed
+    """
+    if system is None:
+        system = getlinearsystem(inputdict)
+    Gamma0, Gamma1 = getGamma(system, getargvalues(system, inputdict, p = p))
+    solution = solvecontinuous(Gamma0, Gamma1, len(inputdict['states']))
+
+    return(ContinuousCache(solution['hx'], solution['gx'], inputdict['states'], inputdict['controls'], shocksddict = getshocksddict(inputdict, p = p), solution = solution))
+
+
+def getirfs_params(inputdict, plist, times, shocks = None):
+    """
+    IRFs for each dict of parameters in plist.
+    Returns params x shocks x times x variables (or a list of these by parameters if times is a list of grids).
+    """
+    if shocks is None:
+        shocks = inputdict.get('irfshocks', inputdict['states'])
+
+    system = getlinearsystem(inputdict)
+    irfs = [getcontinuouscache(inputdict, p = p, system = system).irfs(times, shocks = shocks) for p in plist]
+
+    if len(times) > 0 and np.ndim(times[0]) > 0:
+        return(irfs)
+    return(np.array(irfs))
+
+
+# Test:{{{1
+def continuouscache_test():
+    import scipy.linalg
+
+    # simple.py: x_dot = (1 + a) x, y = a x and z, random are zero
+    sys.path.append(str(__projectdir__ / Path('continuous')))
+    from simple import getinputdict
+    inputdict = getinputdict()
+    cache = getcontinuouscache(inputdict)
+    a = inputdict['paramssdict']['a']
+    if not np.allclose(cache.hx, [[1 + a]]) or not np.allclose(cache.gx, [[0], [a], [0]]):
+        raise ValueError('Wrong solution for simple.py.')
+
+    # irregular grid
+    times = np.array([0, 0.1, 0.35, 1, 2.5])
+    irfs = cache.irfs(times)
+    if not np.allclose(irfs[0, :, 0], np.exp((1 + a) * times)) or not np.allclose(irfs[0, :, 2], a * np.exp((1 + a) * times)):
+        raise ValueError('Wrong IRF for simple.py.')
+
+    # list of grids
+    irfs_grids = cache.irfs([times, times[: 3] + 0.05])
+    if not np.allclose(irfs_grids[0], irfs) or not np.allclose(irfs_grids[1][0, :, 0], np.exp((1 + a) * (times[: 3] + 0.05))):
+        raise ValueError('Wrong IRF for list of grids.')
+
+    # batch over parameters
+    irfs_params = getirfs_params(inputdict, [{'a': -1.5}, {'a': -2}], times)
+    if not np.allclose(irfs_params[1, 0, :, 0], np.exp(-1 * times)):
+        raise ValueError('Wrong IRF for parameter batch.')
+
+    # loglin.py: log and log-linearized versions match
+    sys.path.append(str(__projectdir__ / Path('continuous')))
+    import loglin
+    cache_loglin = getcontinuouscache(loglin.getinputdict(loglineareqs = True))
+    cache_log = getcontinuouscache(loglin.getinputdict(loglineareqs = False))
+    if not np.allclose(cache_loglin.hx, cache_log.hx) or not np.allclose(cache_loglin.gx, cache_log.gx):
+        raise ValueError('Log and log-linearized continuous models differ.')
+
+    # expm and discretization match scipy and Van Loan for a random stable system
+    rng = np.random.default_rng(1)
+    hx = rng.standard_normal([4, 4]) - 3 * np.eye(4)
+    cache_eig = ContinuousCache(hx, np.zeros([0, 4]), ['x1', 'x2', 'x3', 'x4'], [], shocksddict = {'x1': 1, 'x3': 0.5})
+    cache_noeig = ContinuousCache(hx, np.zeros([0, 4]), ['x1', 'x2', 'x3', 'x4'], [], shocksddict = {'x1': 1, 'x3': 0.5}, solution = {'diagonalizable': False})
+    for dt in [0.01, 0.3, 2]:
+        Phi, Q = cache_eig.discretize(dt)
+        Phi2, Q2 = cache_noeig.discretize(dt)
+        if not np.allclose(Phi, scipy.linalg.expm(hx * dt)) or not np.allclose(Phi, Phi2) or not np.allclose(Q, Q2):
+            raise ValueError('Discretization differs between methods.')
+    if not np.allclose(cache_eig.irfs(times), cache_noeig.irfs(times)):
+        raise ValueError('IRFs differ between methods.')
+
+    # simulated variance converges to the stationary variance (the limit of Q as dt gets large)
+    simpath = cache_eig.simulate(np.arange(0, 20, 0.5), numpaths = 20000, seed = 1)
+    if not np.allclose(np.cov(simpath[:, -1, :].transpose()), cache_eig.discretize(100)[1], atol = 0.02):
+        raise ValueError('Simulated variance does not match the stationary variance.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    continuouscache_test()
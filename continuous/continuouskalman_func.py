@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Kalman filter and likelihood for continuous-time linear DSGE models observed at irregular times.
+
+The model is solved with continuous/continuouscache_func.py:
+d states = hx states dt + S dW
+controls = gx states
+The observations at times t_1 < t_2 < ... are:
+y_{t_k} = H [states; controls]_{t_k} + v_k, v_k ~ N(0, R)
+where R is diagonal (measurement error). Between observations I use the exact discretization over the gap t_k - t_{k - 1}:
+states_{t_k} = Phi(gap) states_{t_{k - 1}} + e, e ~ N(0, Q(gap))
+Phi and Q are cached by gap length in the ContinuousCache so gaps which repeat (which is most of them with data at a few frequencies) are only computed once per parameter value.
+
+Missing values in the data are NaN. At each time only the variables which are observed are used so data at mixed frequencies can be put in one array on the union of the observation times.
+
+The filter starts from the stationary distribution of the states at the first observation time so hx needs to be stable (which it is if the model solves).
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+# Kalman Filter:{{{1
+def getstationaryvariance(hx, SS):
+    """
+    Solve hx P + P hx' + SS = 0.
+    """
+    import scipy.linalg
+    P = scipy.linalg.solve_continuous_lyapunov(hx, -SS)
+    return((P + P.transpose()) / 2)
+
+
+def kalmanfilter_continuous(cache, times, data, H, R):
+    """
+    cache: ContinuousCache for the model
+    times: observation times (increasing)
+    data: len(times) x observables with NaN for missing values
+    H: observables x (states + controls)
+    R: observables x observables measurement error variance (diagonal)
+
+    Returns the log-likelihood and the filtered states (len(times) x states).
+    """
+    times = np.asarray(times, dtype = float)
+    data = np.asarray(data, dtype = float)
+    # observables in terms of the states
+    HM = H @ cache.M
+
+    x = np.zeros(len(cache.states))
+    P = getstationaryvariance(cache.hx, cache.SS)
+
+    ll = 0
+    x_t_t = np.empty([len(times), len(cache.states)])
+    for t in range(len(times)):
+        if t > 0:
+            Phi, Q = cache.discretize(times[t] - times[t - 1])
+            x = Phi @ x
+            P = Phi @ P @ Phi.transpose() + Q
+
+        observed = ~np.isnan(data[t])
+        if np.any(observed):
+            HM_t = HM[observed]
+            v = data[t, observed] - HM_t @ x
+            F = HM_t @ P @ HM_t.transpose() + R[np.ix_(observed, observed)]
+            Fchol = np.linalg.cholesky(F)
+            # F^{-1} v and F^{-1} HM_t P using the Cholesky factor
+            Finv_v = np.linalg.solve(Fchol.transpose(), np.linalg.solve(Fchol, v))
+            PHt = P @ HM_t.transpose()
+            K = np.linalg.solve(Fchol.transpose(), np.linalg.solve(Fchol, PHt.transpose())).transpose()
+
+            ll = ll - 0.5 * (np.sum(observed) * np.log(2 * np.pi) + 2 * np.sum(np.log(np.diag(Fchol))) + v @ Finv_v)
+            x = x + PHt @ Finv_v
+            P = P - K @ PHt.transpose()
+            P = (P + P.transpose()) / 2
+
+        x_t_t[t] = x
+
+    return(ll, x_t_t)
+
+
+# Likelihood:{{{1
+def getH(cache, observed):
+    """
+    Selection matrix for the observed variables out of [states; controls].
+    """
+    variables = cache.states + cache.controls
+    H = np.zeros([len(observed), len(variables)])
+    for i in range(len(observed)):
+        H[i, variables.index(observed[i])] = 1
+    return(H)
+
+
+def getloglfunc_continuous(inputdict, paramnames, times, data, observed, measurementerrordict = None):
+    """
+    Return a function logl(values) giving the log-likelihood where values are the values of paramnames.
+    This can be used with the priors and metropolis_hastings in the same way as the log-likelihood in bayes/simple.py.
+
+    measurementerrordict: {observed variable: sd} where sd can be the name of a parameter. The default is no measurement error.
+    If the model does not solve for some parameter values, the log-likelihood is -inf.
+
+    The equations are only parsed and differentiated once.
+    """
+    sys.path.append(str(__projectdir__ / Path('continuous')))
+    from continuouscache_func import getlinearsystem
+    sys.path.append(str(__projectdir__ / Path('continuous')))
+    from continuouscache_func import getcontinuouscache
+    # timers for each stage (these do nothing unless profiling is enabled)
+    sys.path.append(str(__projectdir__ / Path('runtime')))
+    from profiling_func import timer
+
+    if measurementerrordict is None:
+        measurementerrordict = {}
+
+    system = getlinearsystem(inputdict)
+    times = np.asarray(times, dtype = float)
+    data = np.asarray(data, dtype = float)
+
+    def loglfunc(values):
+        p = {paramnames[i]: values[i] for i in range(len(paramnames))}
+        paramssdict = dict(inputdict['paramssdict'])
+        paramssdict.update(p)
+
+        with timer('loglfunc_continuous_solve'):
+            try:
+                cache = getcontinuouscache(inputdict, p = p, system = system)
+            except ValueError:
+                return(-np.inf)
+
+        sds = []
+        for var in observed:
+            sd = measurementerrordict.get(var, 0)
+            if isinstance(sd, str):
+                sd = paramssdict[sd]
+            sds.append(sd)
+        R = np.diag(np.array(sds, dtype = float) ** 2)
+
+        with timer('loglfunc_continuous_kalmanfilter'):
+            try:
+                ll, x_t_t = kalmanfilter_continuous(cache, times, data, getH(cache, observed), R)
+            except np.linalg.LinAlgError:
+                return(-np.inf)
+
+        return(ll)
+
+    return(loglfunc)
+
+
+# Test:{{{1
+def continuouskalman_test():
+    """
+    Compare the log-likelihood with the likelihood of the stacked observations computed directly from the covariance function of the process.
+    """
+    sys.path.append(str(__projectdir__ / Path('continuous')))
+    from continuouscache_func import ContinuousCache
+
+    hx = np.array([[-0.5, 0], [1, -0.2]])
+    gx = np.array([[1, 0.3]])
+    cache = ContinuousCache(hx, gx, ['a', 'k'], ['y'], shocksddict = {'a': 0.2})
+
+    rng = np.random.default_rng(1)
+    times = np.cumsum(rng.exponential(0.5, size = 30))
+    data = cache.simulate(times, seed = 2, x0 = rng.multivariate_normal(np.zeros(2), getstationaryvariance(hx, cache.SS)))[0][:, [0, 2]]
+    # the first variable is only observed at every third time
+    data[np.arange(len(times)) % 3 != 0, 0] = np.nan
+
+    H = getH(cache, ['a', 'y'])
+    R = np.diag([0.01 ** 2, 0.02 ** 2])
+    ll, x_t_t = kalmanfilter_continuous(cache, times, data, H, R)
+
+    # direct: Cov(states_s, states_t) = exp(hx (t - s)) P for t >= s
+    P = getstationaryvariance(hx, cache.SS)
+    HM = H @ cache.M
+    rows = []
+    for t in range(len(times)):
+        for i in range(2):
+            if not np.isnan(data[t, i]):
+                rows.append((t, i))
+    Sigma = np.empty([len(rows), len(rows)])
+    for m in range(len(rows)):
+        for n in range(len(rows)):
+            s, i = rows[m]
+            t, j = rows[n]
+            if t >= s:
+                cov = cache.expm(times[t] - times[s]) @ P
+                Sigma[m, n] = HM[j] @ cov @ HM[i]
+            else:
+                cov = cache.expm(times[s] - times[t]) @ P
+                Sigma[m, n] = HM[i] @ cov @ HM[j]
+            if m == n:
+                Sigma[m, n] = Sigma[m, n] + R[i, i]
+    y = np.array([data[t, i] for t, i in rows])
+    sign, logdet = np.linalg.slogdet(Sigma)
+    ll_direct = -0.5 * (len(y) * np.log(2 * np.pi) + logdet + y @ np.linalg.solve(Sigma, y))
+
+    if not np.isclose(ll, ll_direct):
+        raise ValueError('Kalman filter log-likelihood ' + str(ll) + ' does not match the direct log-likelihood ' + str(ll_direct) + '.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    continuouskalman_test()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Bayesian estimation of a continuous-time model with irregularly spaced, mixed frequency data.
+
+Productivity a follows an Ornstein-Uhlenbeck process and capital k accumulates it:
+da = -KAPPA a dt + SIGMA dW
+k_dot = a - 0.2 k
+y = a + 0.3 k
+y is observed at irregular times and a is only observed at every third observation time.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import functools
+import numpy as np
+
+# Model:{{{1
+def getinputdict():
+    inputdict = {}
+
+    inputdict['paramssdict'] = {'KAPPA': 0.5, 'SIGMA': 0.1, 'ME_y': 0.01, 'ME_a': 0.01}
+
+    inputdict['states'] = ['a', 'k']
+    inputdict['controls'] = ['y']
+    inputdict['irfshocks'] = ['a']
+    inputdict['shocksddict'] = {'a': 'SIGMA'}
+
+    inputdict['equations'] = [
+    'a_dot = -KAPPA * a'
+    ,
+    'k_dot = a - 0.2 * k'
+    ,
+    'y = a + 0.3 * k'
+    ]
+
+    inputdict['loglineareqs'] = True
+
+    return(inputdict)
+
+
+def getsimdata(numobs = 400, seed = 1):
+    """
+    Observation times are irregular with a mean gap of 0.25.
+    Returns the times and a numobs x 2 array of y and a with NaN when a is not observed.
+    """
+    inputdict = getinputdict()
+
+    sys.path.append(str(__projectdir__ / Path('continuous')))
+    from continuouscache_func import getcontinuouscache
+    cache = getcontinuouscache(inputdict)
+
+    rng = np.random.default_rng(seed)
+    times = np.cumsum(rng.exponential(0.25, size = numobs))
+    varpath = cache.simulate(times, seed = seed)[0]
+
+    variables = inputdict['states'] + inputdict['controls']
+    data = varpath[:, [variables.index('y'), variables.index('a')]]
+    data = data + rng.standard_normal(np.shape(data)) * np.array([inputdict['paramssdict']['ME_y'], inputdict['paramssdict']['ME_a']])
+    data[np.arange(numobs) % 3 != 0, 1] = np.nan
+
+    return(times, data)
+
+
+# Bayesian Estimation:{{{1
+def dobayes_continuous(profile = False):
+    """
+    If profile is True, print the time spent in the likelihood, the prior and the posterior.
+    """
+    # get same every time
+    np.random.seed(41)
+
+    if profile is True:
+        sys.path.append(str(__projectdir__ / Path('runtime')))
+        from profiling_func import enable
+        enable()
+
+    # get likelihood function
+    inputdict = getinputdict()
+    paramnames = ['KAPPA', 'SIGMA']
+    times, data = getsimdata()
+    sys.path.append(str(__projectdir__ / Path('continuous')))
+    from continuouskalman_func import getloglfunc_continuous
+    loglikelihoodfunc = getloglfunc_continuous(inputdict, paramnames, times, data, ['y', 'a'], measurementerrordict = {'y': 'ME_y', 'a': 'ME_a'})
+
+    # get prior function and info:{{{
+    priorlist_meansd = [['invgamma', 0.5, 0.25], ['invgamma', 0.1, 0.05]]
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
+    from bayesian_func import getpriorlist_convert
+    priorlist_parameters = getpriorlist_convert(priorlist_meansd)
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
+    from bayesian_func import getpriorlistdetails_parameters
+    prior_means, prior_sds, prior_lbs, prior_ubs = getpriorlistdetails_parameters(priorlist_parameters)
+    # density function for the priors - this is NOT log
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
+    from bayesian_func import getpriordensityfunc_aux
+    priorfunc = functools.partial(getpriordensityfunc_aux, priorlist_parameters)
+    scalelist = [0.5 * sd for sd in prior_sds]
+
+    def posteriorfunc(values):
+        return(np.log(priorfunc(values)) + loglikelihoodfunc(values))
+
+    # time each part (does nothing unless profiling is enabled)
+    sys.path.append(str(__projectdir__ / Path('runtime')))
+    from profiling_func import timed
+    loglikelihoodfunc = timed('likelihood', loglikelihoodfunc)
+    priorfunc = timed('prior', priorfunc)
+    posteriorfunc = timed('posterior', posteriorfunc)
+    # }}}
+
+    # implement metropolis-hastings:{{{
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/')))
+    from bayesian_func import metropolis_hastings
+    results = metropolis_hastings(posteriorfunc, scalelist, prior_means, 5000, lowerboundlist = prior_lbs, upperboundlist = prior_ubs, printdetails = True, logposterior = True)
+    print(np.mean(np.array(results)[1000: , :], axis = 0))
+
+    if profile is True:
+        sys.path.append(str(__projectdir__ / Path('runtime')))
+        from profiling_func import printstats
+        printstats()
+    # }}}
+
+
+def loglfunc_test():
+    """
+    Check the log-likelihood is higher at the true parameters than away from them.
+    """
+    inputdict = getinputdict()
+    times, data = getsimdata()
+    sys.path.append(str(__projectdir__ / Path('continuous')))
+    from continuouskalman_func import getloglfunc_continuous
+    loglfunc = getloglfunc_continuous(inputdict, ['KAPPA', 'SIGMA'], times, data, ['y', 'a'], measurementerrordict = {'y': 'ME_y', 'a': 'ME_a'})
+
+    ll_true = loglfunc([0.5, 0.1])
+    for values in [[0.2, 0.1], [1.5, 0.1], [0.5, 0.05], [0.5, 0.2]]:
+        if loglfunc(values) >= ll_true:
+            raise ValueError('Log-likelihood is higher away from the true parameters: ' + str(values) + '.')
+    # the model doesn't solve for negative KAPPA
+    if loglfunc([-0.5, 0.1]) != -np.inf:
+        raise ValueError('Log-likelihood should be -inf when the model does not solve.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    dobayes_continuous()
@@ -56,6 +56,7 @@ def dsgefull():
 
 
 # Run:{{{1
-check()
-dsgefull()
+if __name__ == '__main__':
+    check()
+    dsgefull()
 
@@ -38,4 +38,5 @@ def full():
 
 
 # Run:{{{1
-full()
+if __name__ == '__main__':
+    full()
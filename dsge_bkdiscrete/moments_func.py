@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Compute the output of Dynare's stoch_simul(order=1) directly from the policy functions.
+
+I write the first order solution in terms of z = [states; shocks] which is how hx and gx are returned by polfunc_inputdict:
+z_{t+1} = hx z_t + eta epsilon_{t+1}
+controls_t = gx z_t
+where the shock rows of hx are zero and eta has the standard deviations of the shocks in the shock rows.
+All outputs are given for the variables in the order states + shocks + controls (the same as stateshockcontrolposdict).
+
+The outputs are:
+- var: the unconditional variance matrix (solved as a discrete Lyapunov equation)
+- autocorr: autocorr[k - 1] is the matrix of correlations between w_t and w_{t-k}
+- vardecomp: the share of the unconditional variance of each variable due to each shock (in percent like Dynare)
+- fevd: the share of the forecast error variance at each horizon due to each shock (in percent)
+- irfs: the impulse responses to a one standard deviation shock, stored as var_shock like Dynare
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+# Defaults:{{{1
+# same as the Dynare defaults
+irfperiods_default = 40
+nar_default = 5
+
+# State Space:{{{1
+def getstatespace_inputdict(inputdict):
+    """
+    Get hx, gx and eta from an inputdict that has been through polfunc_inputdict and getshocksddict_inputdict.
+    """
+    states = inputdict['states']
+    shocks = inputdict['shocks']
+    controls = inputdict['controls']
+    nz = len(states) + len(shocks)
+
+    hx = np.array(inputdict['hx'], dtype = float)
+    gx = np.array(inputdict['gx'], dtype = float)
+    if np.shape(hx) != (nz, nz) or np.shape(gx) != (len(controls), nz):
+        raise ValueError('hx should be (states + shocks) x (states + shocks) and gx should be controls x (states + shocks). hx shape: ' + str(np.shape(hx)) + '. gx shape: ' + str(np.shape(gx)) + '.')
+
+    eta = np.zeros([nz, len(shocks)])
+    for j in range(len(shocks)):
+        eta[len(states) + j, j] = inputdict['shocksddict'][shocks[j]]
+
+    statespace = {}
+    statespace['hx'] = hx
+    statespace['gx'] = gx
+    statespace['eta'] = eta
+    statespace['varnames'] = states + shocks + controls
+    statespace['states'] = list(states)
+    statespace['shocks'] = list(shocks)
+    # maps z into all the variables
+    statespace['M'] = np.concatenate((np.eye(nz), gx), axis = 0)
+
+    return(statespace)
+
+
+# Moments:{{{1
+def getvarcov_z(hx, eta):
+    """
+    Unconditional variance of z solving Sigma_z = hx Sigma_z hx' + eta eta'.
+    """
+    import scipy.linalg
+
+    Sigma_z = scipy.linalg.solve_discrete_lyapunov(hx, eta @ eta.transpose())
+    # remove numerical asymmetry
+    Sigma_z = 0.5 * (Sigma_z + Sigma_z.transpose())
+
+    return(Sigma_z)
+
+
+def getautocorr(hx, M, Sigma_z, nar = nar_default):
+    """
+    Returns a list where element k - 1 is the matrix with entry (i, j) the correlation of variable i at t and variable j at t - k.
+    Variables with zero variance are given zero correlation.
+    """
+    Sigma_w = M @ Sigma_z @ M.transpose()
+    sd = np.sqrt(np.maximum(np.diag(Sigma_w), 0))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        scale = np.where(sd > 0, 1 / sd, 0)
+
+    autocorr = []
+    # Cov(z_t, z_{t-k}) = hx^k Sigma_z
+    cov_z = Sigma_z
+    for k in range(1, nar + 1):
+        cov_z = hx @ cov_z
+        cov_w = M @ cov_z @ M.transpose()
+        autocorr.append(scale[:, np.newaxis] * cov_w * scale[np.newaxis, :])
+
+    return(autocorr)
+
+
+def getvardecomp(hx, M, eta):
+    """
+    Share of the unconditional variance of each variable due to each shock in percent.
+    Returns a variables x shocks matrix. Variables with zero variance have zero in each column.
+    """
+    vars_shock = np.empty([np.shape(M)[0], np.shape(eta)[1]])
+    for j in range(np.shape(eta)[1]):
+        Sigma_z_j = getvarcov_z(hx, eta[:, [j]])
+        vars_shock[:, j] = np.einsum('ij,jk,ik->i', M, Sigma_z_j, M)
+
+    total = np.sum(vars_shock, axis = 1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        vardecomp = np.where(total[:, np.newaxis] > 0, 100 * vars_shock / total[:, np.newaxis], 0)
+
+    return(vardecomp)
+
+
+def getfevd(hx, M, eta, horizons):
+    """
+    Share of the h-step ahead forecast error variance of each variable due to each shock in percent.
+    Returns an array of size len(horizons) x variables x shocks.
+
+    The h-step forecast error of z is sum_{k = 0}^{h - 1} hx^k eta epsilon_{t + h - k} so I accumulate (M hx^k eta)^2 over k.
+    """
+    horizons = sorted(horizons)
+    fevd = np.empty([len(horizons), np.shape(M)[0], np.shape(eta)[1]])
+
+    cumulative = np.zeros([np.shape(M)[0], np.shape(eta)[1]])
+    hxk_eta = eta.copy()
+    hi = 0
+    for k in range(horizons[-1]):
+        cumulative = cumulative + (M @ hxk_eta) ** 2
+        hxk_eta = hx @ hxk_eta
+        while hi < len(horizons) and horizons[hi] == k + 1:
+            total = np.sum(cumulative, axis = 1)
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                fevd[hi] = np.where(total[:, np.newaxis] > 0, 100 * cumulative / total[:, np.newaxis], 0)
+            hi = hi + 1
+
+    return(fevd)
+
+
+def getirfs(hx, M, eta, irfperiods = irfperiods_default):
+    """
+    Response of every variable to a one standard deviation shock in each shock.
+    Returns an array of size shocks x irfperiods x variables.
+    The shock hits in the first period (like Dynare).
+    """
+    irfs = np.empty([np.shape(eta)[1], irfperiods, np.shape(M)[0]])
+    z = eta.copy()
+    for t in range(irfperiods):
+        irfs[:, t, :] = (M @ z).transpose()
+        z = hx @ z
+
+    return(irfs)
+
+
+# Stoch Simul:{{{1
+def stochsimul(statespace, irfperiods = irfperiods_default, nar = nar_default, fevdhorizons = None):
+    """
+    Compute all the stoch_simul outputs from a statespace dict returned by getstatespace_inputdict.
+    """
+    hx = statespace['hx']
+    M = statespace['M']
+    eta = statespace['eta']
+    varnames = statespace['varnames']
+    shocks = statespace['shocks']
+
+    if fevdhorizons is None:
+        fevdhorizons = [1, 4, 8, 40]
+
+    retdict = {}
+    retdict['varnames'] = varnames
+    retdict['shocks'] = shocks
+
+    Sigma_z = getvarcov_z(hx, eta)
+    retdict['var'] = M @ Sigma_z @ M.transpose()
+    retdict['std'] = np.sqrt(np.maximum(np.diag(retdict['var']), 0))
+    retdict['autocorr'] = getautocorr(hx, M, Sigma_z, nar = nar)
+    retdict['vardecomp'] = getvardecomp(hx, M, eta)
+    retdict['fevdhorizons'] = fevdhorizons
+    retdict['fevd'] = getfevd(hx, M, eta, fevdhorizons)
+
+    # Dynare's timing for the states is one period ahead of mine (python2dynare converts K_p into K) so a state responds on impact in Dynare
+    # so for the states I report the response from the second period
+    states = statespace.get('states', [])
+    irfs = getirfs(hx, M, eta, irfperiods = irfperiods + 1)
+    retdict['irfs'] = {}
+    for j in range(len(shocks)):
+        for i in range(len(varnames)):
+            if varnames[i] in states:
+                retdict['irfs'][varnames[i] + '_' + shocks[j]] = irfs[j, 1: , i]
+            else:
+                retdict['irfs'][varnames[i] + '_' + shocks[j]] = irfs[j, : irfperiods, i]
+
+    return(retdict)
+
+
+def stochsimul_inputdict(inputdict, irfperiods = irfperiods_default, nar = nar_default, fevdhorizons = None):
+    """
+    Adds inputdict['stochsimul'] which contains the same information as stoch_simul(order=1) in Dynare.
+    Need to run polfunc_inputdict and getshocksddict_inputdict first.
+    """
+    statespace = getstatespace_inputdict(inputdict)
+    inputdict['stochsimul'] = stochsimul(statespace, irfperiods = irfperiods, nar = nar, fevdhorizons = fevdhorizons)
+
+    return(inputdict)
+
+
+# Batch:{{{1
+def stochsimul_params_aux(getinputdict, shocksddict, irfperiods, nar, fevdhorizons, p):
+    """
+    Solve the model for a single parameter dict and return the stoch_simul outputs.
+    """
+    import copy
+
+    inputdict = getinputdict(p = copy.deepcopy(p))
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgesetup_func import getmodel_inputdict
+    inputdict = getmodel_inputdict(inputdict)
+
+    if shocksddict is not None:
+        inputdict['shocksddict'] = copy.deepcopy(shocksddict)
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from getshocks_func import getshocksddict_inputdict
+    inputdict = getshocksddict_inputdict(inputdict)
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsge_bkdiscrete_func import polfunc_inputdict
+    inputdict = polfunc_inputdict(inputdict)
+
+    inputdict = stochsimul_inputdict(inputdict, irfperiods = irfperiods, nar = nar, fevdhorizons = fevdhorizons)
+
+    return(inputdict['stochsimul'])
+
+
+def stochsimul_batch(getinputdict, plist, shocksddict = None, irfperiods = irfperiods_default, nar = nar_default, fevdhorizons = None, numprocesses = 1):
+    """
+    Compute stoch_simul outputs for every parameter dict in plist.
+    getinputdict should be a function of p like rbc_simple.getinputdict.
+    If numprocesses > 1, the parameter sets are split across a multiprocessing pool (getinputdict must then be defined at the top level of a module so it can be pickled).
+    """
+    import functools
+
+    f = functools.partial(stochsimul_params_aux, getinputdict, shocksddict, irfperiods, nar, fevdhorizons)
+
+    if numprocesses == 1:
+        retlist = [f(p) for p in plist]
+    else:
+        import multiprocessing
+        with multiprocessing.Pool(numprocesses) as pool:
+            retlist = pool.map(f, plist)
+
+    return(retlist)
+
+
+# Compare to Dynare:{{{1
+def comparedynare(stochsimuldict, dynareresults, tolerance = 1e-6, printdetails = True):
+    """
+    Compare the native stoch_simul output with results read from a Dynare run by batchdynare_func.readdynareresults_mat.
+    Only variables which appear in both are compared.
+    Returns a dict of the maximum absolute differences in the variance matrix, the irfs and the variance decomposition.
+    Raises an error if any difference exceeds tolerance.
+    """
+    varnames = stochsimuldict['varnames']
+    shocks = stochsimuldict['shocks']
+    endo_names = dynareresults['endo_names']
+
+    commonvars = [var for var in endo_names if var in varnames]
+    dynarepos = [endo_names.index(var) for var in commonvars]
+    nativepos = [varnames.index(var) for var in commonvars]
+
+    maxdiffs = {}
+
+    if 'var' in dynareresults:
+        dynarevar = np.atleast_2d(dynareresults['var'])
+        maxdiffs['var'] = np.max(np.abs(stochsimuldict['var'][np.ix_(nativepos, nativepos)] - dynarevar[np.ix_(dynarepos, dynarepos)]))
+
+    # Dynare drops irfs which are essentially zero so only compare the irfs which Dynare returns
+    irfdiffs = [0]
+    for name in dynareresults['irfs']:
+        if name not in stochsimuldict['irfs']:
+            continue
+        dynareirf = np.atleast_1d(dynareresults['irfs'][name])
+        irfdiffs.append(np.max(np.abs(stochsimuldict['irfs'][name][: len(dynareirf)] - dynareirf)))
+    maxdiffs['irfs'] = max(irfdiffs)
+
+    if 'variance_decomposition' in dynareresults:
+        dynarevardecomp = np.reshape(dynareresults['variance_decomposition'], [len(endo_names), -1])
+        exopos = [dynareresults['exo_names'].index(shock) for shock in shocks]
+        maxdiffs['vardecomp'] = np.max(np.abs(stochsimuldict['vardecomp'][nativepos, :] - dynarevardecomp[dynarepos, :][:, exopos]))
+
+    if printdetails is True:
+        print('Maximum absolute differences between native and Dynare stoch_simul:')
+        print(maxdiffs)
+
+    for name in maxdiffs:
+        if maxdiffs[name] > tolerance:
+            raise ValueError('Native stoch_simul differs from Dynare in ' + name + ' by ' + str(maxdiffs[name]) + '.')
+
+    return(maxdiffs)
+
+
+# Test:{{{1
+def stochsimul_test():
+    """
+    Check the moments for the RBC model against a long simulation of the same policy functions.
+    """
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+    inputdict = getinputdict()
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgesetup_func import getmodel_inputdict
+    inputdict = getmodel_inputdict(inputdict)
+
+    inputdict['shocksddict'] = {'epsilon_a': 0.01}
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from getshocks_func import getshocksddict_inputdict
+    inputdict = getshocksddict_inputdict(inputdict)
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsge_bkdiscrete_func import polfunc_inputdict
+    inputdict = polfunc_inputdict(inputdict)
+
+    inputdict = stochsimul_inputdict(inputdict)
+    s = inputdict['stochsimul']
+
+    # simulate
+    statespace = getstatespace_inputdict(inputdict)
+    np.random.seed(1)
+    T = 200000
+    epsilon = np.random.normal(size = [T, len(statespace['shocks'])])
+    z = np.zeros(len(statespace['varnames']) - len(inputdict['controls']))
+    w = np.empty([T, len(statespace['varnames'])])
+    for t in range(T):
+        w[t, :] = statespace['M'] @ z
+        z = statespace['hx'] @ z + statespace['eta'] @ epsilon[t, :]
+
+    simstd = np.std(w, axis = 0)
+    print('Theoretical standard deviations: ' + str(s['std']))
+    print('Simulated standard deviations: ' + str(simstd))
+    if np.max(np.abs(simstd - s['std'])) > 0.05 * np.max(s['std']):
+        raise ValueError('Theoretical and simulated standard deviations differ.')
+
+    # variance decomposition with one shock should be 100 for any variable with nonzero variance
+    if not np.allclose(s['vardecomp'][s['std'] > 0], 100):
+        raise ValueError('Variance decomposition should be 100 percent with one shock.')
+
+    # with Dynare's timing the states respond on impact: Am1 in Dynare is productivity this period so its irf is the same as A = Am1_p
+    if not np.isclose(s['irfs']['Am1_epsilon_a'][0], 0.01) or not np.allclose(s['irfs']['Am1_epsilon_a'], s['irfs']['A_epsilon_a']) or s['irfs']['K_epsilon_a'][0] == 0:
+        raise ValueError('State irfs do not use the Dynare timing.')
+
+
+def stochsimul_dynarereference_test(referencefile = None):
+    """
+    Compare the native stoch_simul output for rbc_simple against a saved Dynare results file.
+    The reference file is created by python2dynare/stochsimul.py savereference() (which needs Dynare). If it doesn't exist, I raise an error rather than skip so the comparison can't pass without running.
+    """
+    if referencefile is None:
+        referencefile = __projectdir__ / Path('python2dynare/reference/stochsimul_rbc_results.mat')
+    if not os.path.isfile(referencefile):
+        raise ValueError('Dynare reference file ' + str(referencefile) + ' does not exist. Create it by running savereference() in python2dynare/stochsimul.py.')
+
+    sys.path.append(str(__projectdir__ / Path('python2dynare')))
+    from batchdynare_func import readdynareresults_mat
+    dynareresults = readdynareresults_mat(referencefile)
+
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+    # the reference is generated with the default shocksddict so use the same here
+    stochsimuldict = stochsimul_params_aux(getinputdict, None, irfperiods_default, nar_default, None, {})
+
+    comparedynare(stochsimuldict, dynareresults)
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    stochsimul_test()
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Second order perturbation solution and pruned simulation.
+
+I use the Schmitt-Grohe Uribe (2004) notation with the shocks included in the states (like polfunc_inputdict):
+z = [states; shocks]
+z_{t+1} = h(z_t, sigma) + sigma * eta * epsilon_{t+1}
+controls_t = g(z_t, sigma)
+The equations for the shocks are just shock_p = 0 so the shock rows of h are zero and eta gives the standard deviations of the shocks.
+
+The second order solution is:
+z_{t+1} = hx z_t + 1/2 hxx (z_t kron z_t) + 1/2 hss sigma^2 + sigma * eta * epsilon_{t+1}
+controls_t = gx z_t + 1/2 gxx (z_t kron z_t) + 1/2 gss sigma^2
+hxx and gxx are stored as 3D arrays so hxx[i, j, k] is the second derivative of h_i with respect to z_j and z_k.
+
+The second order terms for gxx and hxx solve a generalized Sylvester equation of the form:
+X + M X (hx kron hx) = R
+I never build the Kronecker product. Instead, I take complex Schur decompositions of M and hx which makes the problem triangular and then solve it column by column. This costs O(n^3 + n^2 nz^2 + n nz^3) rather than O(n^3 nz^6) for the dense system.
+
+The pruned simulation follows Kim, Kim, Schaumburg and Sims (2008) and Andreasen, Fernandez-Villaverde and Rubio-Ramirez (2018). The first and second order parts of the states are simulated separately and the second order terms only use the first order part so the simulation cannot explode.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+# Equations:{{{1
+def addshockequations(Et_eqs, shocks):
+    """
+    Add shock_p = 0 for each shock so the shocks can be treated as states.
+    """
+    import sympy
+
+    Et_eqs = list(Et_eqs) + [sympy.Symbol(shock + '_p') for shock in shocks]
+    return(Et_eqs)
+
+
+def getlogvarslist(inputdict):
+    """
+    Get the list of variables which are written in logs from inputdict['logvars'].
+    """
+    if 'logvars' not in inputdict:
+        return([])
+    if inputdict['logvars'] is True:
+        return(inputdict['states'] + inputdict['controls'])
+    return(list(inputdict['logvars']))
+
+
+def getssdict_inputdict(inputdict):
+    """
+    Get the steady state of the states and controls.
+    Some models (like nk_simple) put the steady state in paramssdict rather than varssdict so look in both.
+    """
+    ssdict = {}
+    for var in inputdict['states'] + inputdict['controls']:
+        if 'varssdict' in inputdict and var in inputdict['varssdict']:
+            ssdict[var] = inputdict['varssdict'][var]
+        elif var in inputdict['paramssdict']:
+            ssdict[var] = inputdict['paramssdict'][var]
+        elif inputdict.get('loglineareqs') is True:
+            # with loglineareqs the steady state is only needed if var_ss appears in the equations
+            continue
+        else:
+            raise ValueError('Steady state not specified for ' + var + '.')
+    return(ssdict)
+
+
+def getequations_inputdict(inputdict):
+    """
+    Get the sympy equations (including the shock equations) and a dict of the numerical value of every symbol at the steady state.
+    If logvars is specified, variables in logvars are converted into logs before differentiating.
+    """
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgediff_func import convertstringlisttosympy
+    Et_eqs = convertstringlisttosympy(inputdict['equations'])
+
+    ssdict = getssdict_inputdict(inputdict)
+
+    logvars = getlogvarslist(inputdict)
+    if len(logvars) > 0:
+        sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+        from dsgediff_func import convertlogvariables
+        Et_eqs, _ = convertlogvariables(Et_eqs, samenamelist = logvars, varssdict = dict(ssdict))
+
+    Et_eqs = addshockequations(Et_eqs, inputdict['shocks'])
+
+    numdict = getnumdict_inputdict(inputdict)
+
+    return(Et_eqs, numdict)
+
+
+def getnumdict_inputdict(inputdict):
+    """
+    Get a dict of the numerical value of every symbol at the steady state.
+    """
+    import math
+
+    states = inputdict['states']
+    controls = inputdict['controls']
+    shocks = inputdict['shocks']
+
+    ssdict = getssdict_inputdict(inputdict)
+    logvars = getlogvarslist(inputdict)
+
+    numdict = {}
+    for param in inputdict['paramssdict']:
+        if isinstance(inputdict['paramssdict'][param], (int, float, np.floating, np.integer)):
+            numdict[param] = inputdict['paramssdict'][param]
+    for var in states + controls:
+        if inputdict.get('loglineareqs') is True:
+            value = 0
+        elif var in logvars:
+            value = math.log(ssdict[var])
+        else:
+            value = ssdict[var]
+        if var in ssdict:
+            numdict[var + '_ss'] = ssdict[var]
+        numdict[var] = value
+        numdict[var + '_p'] = value
+    for shock in shocks:
+        numdict[shock] = 0
+        numdict[shock + '_p'] = 0
+
+    return(numdict)
+
+
+# Derivatives:{{{1
+def getvarnames_v(states, shocks, controls):
+    """
+    Order of the variables I differentiate with respect to: [z_p, y_p, z, y].
+    """
+    z = states + shocks
+    varnames = [var + '_p' for var in z] + [var + '_p' for var in controls] + z + controls
+    return(varnames)
+
+
+def dsgeanalysisdiff2(Et_eqs, states, shocks, controls):
+    """
+    Compute the first and second derivatives of each equation with respect to v = [z_p, y_p, z, y].
+    Only differentiate with respect to variables that appear in each equation.
+
+    Returns two lists:
+    - firstderivs: list of (equation, variable index, sympy expression)
+    - secondderivs: list of (equation, variable index 1, variable index 2, sympy expression) with index 1 <= index 2
+    """
+    import sympy
+
+    varnames = getvarnames_v(states, shocks, controls)
+    varpos = {sympy.Symbol(varnames[i]): i for i in range(len(varnames))}
+
+    firstderivs = []
+    secondderivs = []
+    for eqi in range(len(Et_eqs)):
+        eq = sympy.sympify(Et_eqs[eqi])
+        eqvars = sorted([symbol for symbol in eq.free_symbols if symbol in varpos], key = lambda symbol: varpos[symbol])
+        for a in range(len(eqvars)):
+            d1 = sympy.diff(eq, eqvars[a])
+            if d1 == 0:
+                continue
+            firstderivs.append((eqi, varpos[eqvars[a]], d1))
+            d1vars = d1.free_symbols
+            for b in range(a, len(eqvars)):
+                if eqvars[b] not in d1vars:
+                    continue
+                d2 = sympy.diff(d1, eqvars[b])
+                if d2 != 0:
+                    secondderivs.append((eqi, varpos[eqvars[a]], varpos[eqvars[b]], d2))
+
+    return(firstderivs, secondderivs)
+
+
+def numevalderivs2(firstderivs, secondderivs, numeq, numv, numdict):
+    """
+    Evaluate the derivatives at the steady state.
+    Returns f_v (numeq x numv) and f_vv (numeq x numv x numv).
+    """
+    import sympy
+
+    replacedict = {sympy.Symbol(name): numdict[name] for name in numdict}
+
+    def numeval(expr):
+        value = expr.xreplace(replacedict)
+        try:
+            return(float(value))
+        except TypeError:
+            raise ValueError('Could not evaluate derivative numerically. Remaining symbols: ' + str(value.free_symbols) + '.')
+
+    f_v = np.zeros([numeq, numv])
+    for eqi, a, expr in firstderivs:
+        f_v[eqi, a] = numeval(expr)
+
+    f_vv = np.zeros([numeq, numv, numv])
+    for eqi, a, b, expr in secondderivs:
+        value = numeval(expr)
+        f_vv[eqi, a, b] = value
+        f_vv[eqi, b, a] = value
+
+    return(f_v, f_vv)
+
+
+# Second Order Solution:{{{1
+def solvesylvester_kron(M, hx, R):
+    """
+    Solve X + M X (hx kron hx) = R for X where R and X are n x nz x nz arrays.
+    (X (hx kron hx))[:, c, d] = sum_{a, b} X[:, a, b] hx[a, c] hx[b, d].
+
+    I use hx = U T U^H and M = V S V^H with T and S upper triangular.
+    Then W = V^H X (U kron U) solves W + S W (T kron T) = V^H R (U kron U) and since T kron T is upper triangular I can solve for W one column (c, d) at a time.
+    """
+    import scipy.linalg
+
+    n, nz, _ = np.shape(R)
+
+    T, U = scipy.linalg.schur(hx.astype(complex), output = 'complex')
+    S, V = scipy.linalg.schur(M.astype(complex), output = 'complex')
+
+    Rhat = np.einsum('ij,jab,ac,bd->icd', V.conj().transpose(), R, U, U, optimize = True)
+
+    W = np.zeros([n, nz, nz], dtype = complex)
+    # WT[:, a, :] = W[:, a, :] @ T once row a of W is complete
+    WT = np.zeros([n, nz, nz], dtype = complex)
+    identity = np.eye(n)
+    for c in range(nz):
+        for d in range(nz):
+            # sum over (a, b) != (c, d) with a <= c and b <= d of W[:, a, b] T[a, c] T[b, d]
+            known = WT[:, : c, d] @ T[: c, c] + T[c, c] * (W[:, c, : d] @ T[: d, d])
+            rhs = Rhat[:, c, d] - S @ known
+            W[:, c, d] = scipy.linalg.solve_triangular(identity + T[c, c] * T[d, d] * S, rhs)
+        WT[:, c, :] = W[:, c, :] @ T
+
+    X = np.einsum('ij,jcd,ac,bd->iab', V, W, U.conj(), U.conj(), optimize = True)
+
+    return(np.real(X))
+
+
+def gxxhxx(f_v, f_vv, gx, hx, nz, ny):
+    """
+    Solve for gxx and hxx given the first and second derivatives of the equations (in the order from getvarnames_v).
+
+    The equations are:
+    fy gxx + fyp gxx (hx kron hx) + (fyp gx + fxp) hxx + Q = 0
+    where Q_i = V' f_vv_i V and V = [hx; gx hx; I; gx] is the derivative of v with respect to z.
+    """
+    import scipy.linalg
+
+    fxp = f_v[:, : nz]
+    fyp = f_v[:, nz: nz + ny]
+    fy = f_v[:, 2 * nz + ny: ]
+
+    Vz = np.concatenate((hx, gx @ hx, np.eye(nz), gx), axis = 0)
+    Q = np.einsum('va,ivw,wb->iab', Vz, f_vv, Vz, optimize = True)
+
+    A1 = np.concatenate((fy, fyp @ gx + fxp), axis = 1)
+    A2 = np.concatenate((fyp, np.zeros([np.shape(fyp)[0], nz])), axis = 1)
+
+    lu = scipy.linalg.lu_factor(A1)
+    M = scipy.linalg.lu_solve(lu, A2)
+    R = -np.reshape(scipy.linalg.lu_solve(lu, np.reshape(Q, [np.shape(Q)[0], nz * nz])), np.shape(Q))
+
+    X = solvesylvester_kron(M, hx, R)
+
+    gxx = X[: ny]
+    hxx = X[ny: ]
+
+    return(gxx, hxx)
+
+
+def gsshss(f_v, f_vv, gx, hx, gxx, eta, nz, ny):
+    """
+    Solve for gss and hss.
+    (fyp + fy) gss + (fyp gx + fxp) hss + fyp gxx : (eta eta') + trace(Vs' f_vv_i Vs) = 0
+    where Vs = [eta; gx eta; 0; 0] is the derivative of v with respect to sigma * epsilon'.
+    """
+    fxp = f_v[:, : nz]
+    fyp = f_v[:, nz: nz + ny]
+    fy = f_v[:, 2 * nz + ny: ]
+
+    ne = np.shape(eta)[1]
+    Vs = np.concatenate((eta, gx @ eta, np.zeros([nz + ny, ne])), axis = 0)
+
+    etaeta = eta @ eta.transpose()
+    rhs = -(np.einsum('va,ivw,wa->i', Vs, f_vv, Vs) + fyp @ np.einsum('jab,ab->j', gxx, etaeta))
+
+    A = np.concatenate((fyp + fy, fyp @ gx + fxp), axis = 1)
+    sol = np.linalg.solve(A, rhs)
+
+    gss = sol[: ny]
+    hss = sol[ny: ]
+
+    return(gss, hss)
+
+
+def secondorder_inputdict(inputdict):
+    """
+    Add the second order solution to inputdict.
+    Need to specify inputdict['shocksddict'] (or run getshocksddict_inputdict) so eta can be constructed.
+
+    Adds: nfv, nfvv (first and second derivatives), gx, hx, gxx, hxx, gss, hss, eta.
+    gx and hx are computed using gxhx from the first derivatives.
+    """
+    states = inputdict['states']
+    controls = inputdict['controls']
+    shocks = inputdict['shocks']
+    nz = len(states) + len(shocks)
+    ny = len(controls)
+
+    Et_eqs, numdict = getequations_inputdict(inputdict)
+    if len(Et_eqs) != nz + ny:
+        raise ValueError('Number of equations (including one for each shock) should equal number of states, shocks and controls.')
+
+    firstderivs, secondderivs = dsgeanalysisdiff2(Et_eqs, states, shocks, controls)
+    f_v, f_vv = numevalderivs2(firstderivs, secondderivs, len(Et_eqs), 2 * (nz + ny), numdict)
+    inputdict['nfv'] = f_v
+    inputdict['nfvv'] = f_vv
+
+    fxp = f_v[:, : nz]
+    fyp = f_v[:, nz: nz + ny]
+    fx = f_v[:, nz + ny: 2 * nz + ny]
+    fy = f_v[:, 2 * nz + ny: ]
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsge_bkdiscrete_func import gxhx
+    gx, hx = gxhx(fx, fxp, fy, fyp)
+    inputdict['gx'] = gx
+    inputdict['hx'] = hx
+
+    eta = np.zeros([nz, len(shocks)])
+    for j in range(len(shocks)):
+        eta[len(states) + j, j] = inputdict['shocksddict'][shocks[j]]
+    inputdict['eta'] = eta
+
+    inputdict['gxx'], inputdict['hxx'] = gxxhxx(f_v, f_vv, gx, hx, nz, ny)
+    inputdict['gss'], inputdict['hss'] = gsshss(f_v, f_vv, gx, hx, inputdict['gxx'], eta, nz, ny)
+
+    return(inputdict)
+
+
+# Moments:{{{1
+def getsecondordermean(gx, hx, gxx, hxx, gss, hss, eta):
+    """
+    Mean of the pruned second order solution (as a deviation from the steady state).
+    E[z^f kron z^f] = vec(Sigma_f) where Sigma_f is the first order variance.
+    E[z^s] = (I - hx)^{-1} (1/2 hxx : Sigma_f + 1/2 hss)
+    Returns the mean of [z; controls].
+    """
+    import scipy.linalg
+
+    Sigma_f = scipy.linalg.solve_discrete_lyapunov(hx, eta @ eta.transpose())
+    mean_zs = np.linalg.solve(np.eye(np.shape(hx)[0]) - hx, 0.5 * np.einsum('iab,ab->i', hxx, Sigma_f) + 0.5 * hss)
+    mean_y = gx @ mean_zs + 0.5 * np.einsum('iab,ab->i', gxx, Sigma_f) + 0.5 * gss
+
+    return(np.concatenate((mean_zs, mean_y)))
+
+
+# Pruned Simulation:{{{1
+def simpathpruned(gx, hx, gxx, hxx, gss, hss, eta, shockpath = None, pathsimperiods = None, numreplications = 1, sigma = 1, seed = None):
+    """
+    Pruned second order simulation vectorized over replications.
+
+    shockpath: array of standard normal shocks of size numreplications x T x shocks (or T x shocks for a single replication). If not specified, it is drawn.
+    Returns an array of size numreplications x T x (nz + ny) where the variables are ordered states + shocks + controls. The first period is the steady state.
+    """
+    nz = np.shape(hx)[0]
+    ne = np.shape(eta)[1]
+
+    if shockpath is None:
+        rng = np.random.default_rng(seed)
+        shockpath = rng.standard_normal([numreplications, pathsimperiods, ne])
+    shockpath = np.asarray(shockpath, dtype = float)
+    if shockpath.ndim == 2:
+        shockpath = shockpath[np.newaxis, :, :]
+    numreplications, T, _ = np.shape(shockpath)
+
+    # shocks enter z_{t+1} so precompute sigma * eta * epsilon_{t+1} for all periods at once
+    etashocks = sigma * np.einsum('ij,rtj->rti', eta, shockpath)
+    halfhss = 0.5 * sigma ** 2 * hss
+    halfgss = 0.5 * sigma ** 2 * gss
+
+    zf = np.zeros([numreplications, nz])
+    zs = np.zeros([numreplications, nz])
+    varpath = np.empty([numreplications, T, nz + len(gss)])
+    for t in range(T):
+        zfzf = np.einsum('rj,rk->rjk', zf, zf)
+        varpath[:, t, : nz] = zf + zs
+        varpath[:, t, nz: ] = (zf + zs) @ gx.transpose() + 0.5 * np.einsum('ijk,rjk->ri', gxx, zfzf) + halfgss
+        if t + 1 < T:
+            zs = zs @ hx.transpose() + 0.5 * np.einsum('ijk,rjk->ri', hxx, zfzf) + halfhss
+            zf = zf @ hx.transpose() + etashocks[:, t + 1, :]
+
+    return(varpath)
+
+
+def simpathpruned_inputdict(inputdict, numreplications = 1, seed = None):
+    """
+    Run secondorder_inputdict first.
+    Uses inputdict['shockpath'] if specified (in terms of standard normal shocks) and otherwise draws inputdict['pathsimperiods'] periods.
+    Adds inputdict['varpath_pruned'] of size numreplications x T x (states + shocks + controls).
+    """
+    shockpath = None
+    if 'shockpath' in inputdict:
+        shockpath = inputdict['shockpath']
+    inputdict['varpath_pruned'] = simpathpruned(inputdict['gx'], inputdict['hx'], inputdict['gxx'], inputdict['hxx'], inputdict['gss'], inputdict['hss'], inputdict['eta'], shockpath = shockpath, pathsimperiods = inputdict.get('pathsimperiods'), numreplications = numreplications, seed = seed)
+
+    return(inputdict)
+
+
+# Test:{{{1
+def secondorder_test():
+    """
+    With DELTA = 1 and log utility the RBC model has the closed form solution K_p = ALPHA * BETA * A * K ** ALPHA.
+    If K is in levels and Am1 is in logs, the second order terms for K must match the second derivatives of this function and hss, gss must be zero.
+    Also check that the mean of the pruned simulation matches the analytical mean.
+    (with epsilon_a s.d. 0.05 so the second order terms are visible).
+    """
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+    p = {'DELTA': 1}
+    inputdict = getinputdict(p = p, loglineareqs = False)
+    inputdict['logvars'] = ['Am1', 'A', 'C']
+    inputdict['shocksddict'] = {'epsilon_a': 0.05}
+
+    inputdict = secondorder_inputdict(inputdict)
+
+    p = inputdict['paramssdict']
+    K = inputdict['varssdict']['K']
+    # K_p = ALPHA * BETA * exp(RHO * am1 + epsilon_a) * K ** ALPHA where z = [am1, K, epsilon_a]
+    h = lambda z: p['ALPHA'] * p['BETA'] * np.exp(p['RHO'] * z[0] + z[2]) * (K + z[1]) ** p['ALPHA']
+    hxx_K = np.empty([3, 3])
+    step = 1e-4
+    for j in range(3):
+        for k in range(3):
+            ej = np.zeros(3)
+            ej[j] = step
+            ek = np.zeros(3)
+            ek[k] = step
+            hxx_K[j, k] = (h(ej + ek) - h(ej - ek) - h(-ej + ek) + h(-ej - ek)) / (4 * step ** 2)
+
+    Kpos = inputdict['states'].index('K')
+    print('hxx for K:')
+    print(inputdict['hxx'][Kpos])
+    print('Numerical second derivatives:')
+    print(hxx_K)
+    if np.max(np.abs(inputdict['hxx'][Kpos] - hxx_K)) > 1e-4 * max(1, np.max(np.abs(hxx_K))):
+        raise ValueError('hxx does not match the closed form solution.')
+    if np.max(np.abs(inputdict['hss'])) > 1e-10 or np.max(np.abs(inputdict['gss'])) > 1e-10:
+        raise ValueError('hss and gss should be zero.')
+
+    # pruned simulation mean
+    mean = getsecondordermean(inputdict['gx'], inputdict['hx'], inputdict['gxx'], inputdict['hxx'], inputdict['gss'], inputdict['hss'], inputdict['eta'])
+    # use antithetic shocks so the first order parts cancel exactly in the mean
+    shockpath = np.random.default_rng(1).standard_normal([100, 2000, 1])
+    shockpath = np.concatenate((shockpath, -shockpath), axis = 0)
+    varpath = simpathpruned(inputdict['gx'], inputdict['hx'], inputdict['gxx'], inputdict['hxx'], inputdict['gss'], inputdict['hss'], inputdict['eta'], shockpath = shockpath)
+    simmean = np.mean(varpath[:, 500: , :], axis = (0, 1))
+    print('Analytical mean: ' + str(mean))
+    print('Simulated mean: ' + str(simmean))
+    if np.max(np.abs(mean - simmean)) > 0.05 * np.max(np.abs(mean)):
+        raise ValueError('Simulated mean differs from analytical mean.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    secondorder_test()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+def secondorder():
+    
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+    # need the nonlinear equations for a second order approximation
+    inputdict = getinputdict(loglineareqs = False)
+
+    inputdict['shocksddict'] = {'epsilon_a': 0.01}
+
+    # get second order policy functions
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from secondorder_func import secondorder_inputdict
+    inputdict = secondorder_inputdict(inputdict)
+
+    print(inputdict['hxx'])
+    print(inputdict['gss'])
+
+    # pruned simulation
+    inputdict['pathsimperiods'] = 100
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from secondorder_func import simpathpruned_inputdict
+    inputdict = simpathpruned_inputdict(inputdict, numreplications = 1000, seed = 1)
+
+    # mean of the log of consumption relative to its steady state across replications
+    print(np.mean(inputdict['varpath_pruned'][:, :, len(inputdict['states']) + len(inputdict['shocks']) + inputdict['controls'].index('C')]))
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    secondorder()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Incremental numerical evaluation of fxe, fxep, fy, fyp when only a few parameters change.
+
+When estimating, a block MCMC step often only changes one parameter. Rather than re-evaluating every entry of every matrix, I build a dependency index once:
+- for each steady state variable, the parameters it depends on
+- for each nonzero entry of each matrix, the parameters it depends on (directly or through the steady state variables)
+
+An update then only recomputes the steady state variables and matrix entries which depend on a parameter that changed.
+By default the matrices are updated in place. If inplace = False, only the matrices which contain an affected entry are copied and the other matrices are the same objects as in the previous evaluation.
+"""
+import os
+from pathlib import Path
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+# Dependencies:{{{1
+def getssdependencies(getvarssdict, p):
+    """
+    Get a dict mapping each steady state variable to the set of parameters it depends on.
+    I first try to call getvarssdict with sympy symbols for the parameters. If that fails (for example because getvarssdict uses numerical functions), I perturb each parameter in turn and record which steady state variables change.
+    """
+    import copy
+    import sympy
+
+    try:
+        psymbols = {param: sympy.Symbol(param) for param in p}
+        v = getvarssdict(psymbols)
+        ssdeps = {}
+        for var in v:
+            ssdeps[var] = set([str(symbol) for symbol in sympy.sympify(v[var]).free_symbols]) & set(p)
+        return(ssdeps)
+    except (TypeError, AttributeError):
+        pass
+
+    v0 = getvarssdict(copy.deepcopy(p))
+    ssdeps = {var: set() for var in v0}
+    for param in p:
+        p2 = copy.deepcopy(p)
+        p2[param] = p2[param] * (1 + 1e-6) + 1e-6
+        v2 = getvarssdict(p2)
+        for var in v0:
+            if v2[var] != v0[var]:
+                ssdeps[var].add(param)
+    return(ssdeps)
+
+
+def getsymbolkey(symbolname, keys):
+    """
+    Match a symbol in the matrices to the key in the dict of parameters and steady state values.
+    Steady state variables may appear as X or X_ss.
+    """
+    if symbolname in keys:
+        return(symbolname)
+    if symbolname.endswith('_ss') and symbolname[: -3] in keys:
+        return(symbolname[: -3])
+    raise ValueError('Symbol ' + symbolname + ' is not a parameter or steady state variable.')
+
+
+def getdependencyindex(matrices, getvarssdict, p):
+    """
+    Build the dependency index.
+    matrices: dict of sympy matrices e.g. {'nfxe': inputdict['fxe'], ...}
+    getvarssdict: function which returns the steady state variables given a dict of parameters
+    p: dict of parameters (including those which will change)
+
+    Returns a dict with:
+    - ssdeps: steady state variable -> parameters it depends on
+    - entries: list of (matrix name, row, col, lambdified function, argument keys)
+    - paramentries: parameter -> list of indices into entries
+    - shapes: matrix name -> shape
+    - getvarssdict
+    """
+    import sympy
+
+    index = {}
+    index['getvarssdict'] = getvarssdict
+    index['ssdeps'] = getssdependencies(getvarssdict, p)
+    index['shapes'] = {name: tuple(matrices[name].shape) for name in matrices}
+
+    keys = set(p) | set(index['ssdeps'])
+
+    index['entries'] = []
+    index['paramentries'] = {param: [] for param in p}
+    for name in matrices:
+        matrix = matrices[name]
+        for i in range(matrix.shape[0]):
+            for j in range(matrix.shape[1]):
+                expr = sympy.sympify(matrix[i, j])
+                if expr == 0:
+                    continue
+                symbols = sorted(expr.free_symbols, key = lambda symbol: str(symbol))
+                argkeys = [getsymbolkey(str(symbol), keys) for symbol in symbols]
+                f = sympy.lambdify(symbols, expr, modules = 'math')
+
+                entryi = len(index['entries'])
+                index['entries'].append((name, i, j, f, argkeys))
+
+                params = set()
+                for key in argkeys:
+                    if key in p:
+                        params.add(key)
+                    else:
+                        params = params | index['ssdeps'][key]
+                for param in params:
+                    index['paramentries'][param].append(entryi)
+
+    return(index)
+
+
+# Evaluation:{{{1
+def evaluate_full(index, p):
+    """
+    Evaluate every entry. Returns a state dict which is passed to evaluate_incremental.
+    state['matrices'] contains the numerical matrices.
+    """
+    import copy
+
+    values = copy.deepcopy(p)
+    values.update(index['getvarssdict'](copy.deepcopy(p)))
+
+    matrices = {name: np.zeros(index['shapes'][name]) for name in index['shapes']}
+    for name, i, j, f, argkeys in index['entries']:
+        matrices[name][i, j] = f(*[values[key] for key in argkeys])
+
+    state = {}
+    state['p'] = copy.deepcopy(p)
+    state['values'] = values
+    state['matrices'] = matrices
+    state['numentriesevaluated'] = len(index['entries'])
+
+    return(state)
+
+
+def evaluate_incremental(index, state, updatedparamssdict, inplace = True):
+    """
+    Update state for the parameters in updatedparamssdict, only recomputing what depends on parameters whose values changed.
+    Returns the updated state. If inplace is False, the previous state is left unchanged and matrices with no affected entries are shared with it.
+    """
+    import copy
+
+    changed = [param for param in updatedparamssdict if param not in state['p'] or updatedparamssdict[param] != state['p'][param]]
+    for param in changed:
+        if param not in index['paramentries']:
+            raise ValueError('Parameter ' + param + ' was not in p when the dependency index was built.')
+
+    if inplace is True:
+        newstate = state
+    else:
+        newstate = {'p': dict(state['p']), 'values': dict(state['values']), 'matrices': dict(state['matrices'])}
+
+    if len(changed) == 0:
+        newstate['numentriesevaluated'] = 0
+        return(newstate)
+
+    for param in changed:
+        newstate['p'][param] = updatedparamssdict[param]
+        newstate['values'][param] = updatedparamssdict[param]
+
+    # update steady state variables that depend on a changed parameter
+    affectedss = [var for var in index['ssdeps'] if len(index['ssdeps'][var] & set(changed)) > 0]
+    if len(affectedss) > 0:
+        v = index['getvarssdict'](copy.deepcopy(newstate['p']))
+        for var in affectedss:
+            newstate['values'][var] = v[var]
+
+    # entries to update
+    entryis = sorted(set([entryi for param in changed for entryi in index['paramentries'][param]]))
+
+    if inplace is False:
+        # copy only the matrices that are modified
+        for name in set([index['entries'][entryi][0] for entryi in entryis]):
+            newstate['matrices'][name] = newstate['matrices'][name].copy()
+
+    values = newstate['values']
+    matrices = newstate['matrices']
+    for entryi in entryis:
+        name, i, j, f, argkeys = index['entries'][entryi]
+        matrices[name][i, j] = f(*[values[key] for key in argkeys])
+
+    newstate['numentriesevaluated'] = len(entryis)
+
+    return(newstate)
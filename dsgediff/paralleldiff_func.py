@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Run the sympy stages of setting up a model across a process pool.
+
+The stages are:
+- parse: convert the equation strings to sympy (convertstringlisttosympy)
+- convertlog: convert variables into logs (convertlogvariables)
+- diff: differentiate each equation with respect to the variables it contains (as in sparsediff_func)
+
+The equations are split into contiguous chunks and the chunks are processed with an ordered map so the results are always merged in the original equation order (and so are identical to running without a pool).
+The time taken by each stage and by each equation is recorded so it's possible to see which equations are expensive.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import time
+
+# Chunks:{{{1
+def getchunks(numitems, numchunks):
+    """
+    Split range(numitems) into numchunks contiguous (start, end) pairs.
+    """
+    numchunks = max(min(numchunks, numitems), 1)
+    bounds = [round(i * numitems / numchunks) for i in range(numchunks + 1)]
+    return([(bounds[i], bounds[i + 1]) for i in range(numchunks)])
+
+
+def mapchunks(pool, f, chunkargs):
+    """
+    Apply f to each chunk either in the pool or in this process if pool is None.
+    The results are returned in chunk order.
+    """
+    if pool is None:
+        return([f(args) for args in chunkargs])
+    else:
+        return(pool.map(f, chunkargs, chunksize = 1))
+
+
+# Chunk Workers:{{{1
+def parse_chunk(eqstrings):
+    """
+    Parse equations one at a time so I can time each equation.
+    """
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgediff_func import convertstringlisttosympy
+
+    Et_eqs = []
+    times = []
+    for eqstring in eqstrings:
+        start = time.perf_counter()
+        Et_eqs = Et_eqs + convertstringlisttosympy([eqstring])
+        times.append(time.perf_counter() - start)
+
+    return(Et_eqs, times)
+
+
+def convertlog_chunk(args):
+    Et_eqs, samenamelist, varssdict = args
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgediff_func import convertlogvariables
+
+    start = time.perf_counter()
+    Et_eqs, varssdict = convertlogvariables(Et_eqs, samenamelist = samenamelist, varssdict = varssdict)
+    # convertlogvariables works on the whole chunk so split the time equally
+    times = [(time.perf_counter() - start) / max(len(Et_eqs), 1)] * len(Et_eqs)
+
+    return(Et_eqs, varssdict, times)
+
+
+def diff_chunk(args):
+    Et_eqs, states, controls = args
+
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from sparsediff_func import getincidence
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from sparsediff_func import diffequation_sparse
+
+    incidence = getincidence(Et_eqs, states, controls)
+
+    entrylist = []
+    times = []
+    for i in range(len(Et_eqs)):
+        start = time.perf_counter()
+        entrylist.append(diffequation_sparse(Et_eqs[i], incidence[i]))
+        times.append(time.perf_counter() - start)
+
+    return(entrylist, times)
+
+
+# Main Function:{{{1
+def parsediff_parallel(eqstrings, states, controls, logvars = None, varssdict = None, numprocesses = None, numchunks = None, parseequations = True):
+    """
+    Parse, convert to logs and differentiate the equations across a process pool.
+
+    eqstrings: list of equation strings (or sympy expressions if parseequations = False)
+    logvars: list of variables to convert into logs. If None, no conversion is done.
+    varssdict: steady state dict which is converted alongside the equations if logvars is specified
+    numprocesses: number of processes. If 1, everything runs in this process.
+    numchunks: number of chunks the equations are split into. Default is 4 times the number of processes so the load is balanced even if some equations are much more expensive.
+
+    Returns a dict with:
+    - Et_eqs: list of sympy equations
+    - varssdict: the (converted) varssdict
+    - fx, fxp, fy, fyp: sparse Jacobians in the COO format of sparsediff_func
+    - timing: total time of each stage
+    - timing_equations: time of each stage for each equation
+    """
+    if numprocesses is None:
+        numprocesses = os.cpu_count()
+    if numchunks is None:
+        numchunks = 4 * numprocesses
+
+    chunks = getchunks(len(eqstrings), numchunks)
+
+    retdict = {}
+    retdict['timing'] = {}
+    retdict['timing_equations'] = {}
+
+    if numprocesses == 1:
+        pool = None
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(numprocesses)
+
+    try:
+        # parse
+        start = time.perf_counter()
+        if parseequations is True:
+            results = mapchunks(pool, parse_chunk, [eqstrings[chunkstart: chunkend] for chunkstart, chunkend in chunks])
+            Et_eqs = [eq for result in results for eq in result[0]]
+            retdict['timing_equations']['parse'] = [t for result in results for t in result[1]]
+        else:
+            Et_eqs = list(eqstrings)
+        retdict['timing']['parse'] = time.perf_counter() - start
+
+        # convert to logs
+        start = time.perf_counter()
+        if logvars is not None and len(logvars) > 0:
+            # give each chunk its own copy of varssdict so running in this process behaves the same as the pool (where each chunk gets a pickled copy)
+            results = mapchunks(pool, convertlog_chunk, [(Et_eqs[chunkstart: chunkend], logvars, dict(varssdict) if varssdict is not None else None) for chunkstart, chunkend in chunks])
+            Et_eqs = [eq for result in results for eq in result[0]]
+            # every chunk converts the same varssdict so just take the first
+            varssdict = results[0][1]
+            retdict['timing_equations']['convertlog'] = [t for result in results for t in result[2]]
+        retdict['timing']['convertlog'] = time.perf_counter() - start
+
+        # differentiate
+        start = time.perf_counter()
+        results = mapchunks(pool, diff_chunk, [(Et_eqs[chunkstart: chunkend], states, controls) for chunkstart, chunkend in chunks])
+        entrylist = [entries for result in results for entries in result[0]]
+        retdict['timing_equations']['diff'] = [t for result in results for t in result[1]]
+        retdict['timing']['diff'] = time.perf_counter() - start
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # merge
+    start = time.perf_counter()
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from sparsediff_func import mergeentries_sparse
+    jacs = mergeentries_sparse(entrylist, len(Et_eqs), states, controls)
+    retdict['timing']['merge'] = time.perf_counter() - start
+
+    retdict['Et_eqs'] = Et_eqs
+    retdict['varssdict'] = varssdict
+    retdict['fx'] = jacs['fx']
+    retdict['fxp'] = jacs['fxp']
+    retdict['fy'] = jacs['fy']
+    retdict['fyp'] = jacs['fyp']
+
+    return(retdict)
+
+
+def printtiming(retdict, numslowest = 5):
+    """
+    Print the time for each stage and the slowest equations in each stage.
+    """
+    print('Time by stage:')
+    for stage in retdict['timing']:
+        print(stage + ': ' + str(retdict['timing'][stage]))
+
+    for stage in retdict['timing_equations']:
+        times = retdict['timing_equations'][stage]
+        slowest = sorted(range(len(times)), key = lambda i: -times[i])[: numslowest]
+        print('Slowest equations for ' + stage + ':')
+        for i in slowest:
+            print('Equation ' + str(i) + ': ' + str(times[i]))
+
+
+# Inputdict:{{{1
+def getfxefy_parallel_inputdict(inputdict, numprocesses = None, denseexport = False, printdetails = False):
+    """
+    Parallel version of getfxefy_sparse_inputdict. Run getmodel_inputdict first.
+    Adds fxe_sparse, fxep_sparse, fy_sparse, fyp_sparse (and fxe, fxep, fy, fyp if denseexport is True) and fxefy_timing.
+    """
+    retdict = parsediff_parallel(inputdict['equations_noparams'], inputdict['states'] + inputdict['shocks'], inputdict['controls'], numprocesses = numprocesses)
+
+    inputdict['fxe_sparse'] = retdict['fx']
+    inputdict['fxep_sparse'] = retdict['fxp']
+    inputdict['fy_sparse'] = retdict['fy']
+    inputdict['fyp_sparse'] = retdict['fyp']
+    inputdict['fxefy_timing'] = {'timing': retdict['timing'], 'timing_equations': retdict['timing_equations']}
+
+    if denseexport is True:
+        sys.path.append(str(__projectdir__ / Path('dsgediff')))
+        from sparsediff_func import sparsetodense_sympy
+        for name in ['fxe', 'fxep', 'fy', 'fyp']:
+            inputdict[name] = sparsetodense_sympy(inputdict[name + '_sparse'])
+
+    if printdetails is True:
+        printtiming(retdict)
+
+    return(inputdict)
+
+
+# Test:{{{1
+def parsediff_parallel_test(numequations = 200, numprocesses = 4):
+    """
+    Check the pool gives exactly the same Jacobians as running in one process on a simple chain of equations.
+    """
+    states = ['x' + str(i) for i in range(numequations)]
+    controls = ['y' + str(i) for i in range(numequations)]
+    eqstrings = []
+    for i in range(numequations):
+        eqstrings.append('x' + str(i) + '_p = RHO * x' + str(i) + ' + 0.1 * y' + str((i + 1) % numequations))
+    for i in range(numequations):
+        eqstrings.append('y' + str(i) + ' = ALPHA * x' + str(i) + ' ** 2 + BETA * y' + str(i) + '_p')
+
+    retdict_serial = parsediff_parallel(eqstrings, states, controls, numprocesses = 1)
+    retdict_pool = parsediff_parallel(eqstrings, states, controls, numprocesses = numprocesses)
+
+    for name in ['fx', 'fxp', 'fy', 'fyp']:
+        if list(retdict_serial[name]['rows']) != list(retdict_pool[name]['rows']) or list(retdict_serial[name]['cols']) != list(retdict_pool[name]['cols']) or retdict_serial[name]['exprs'] != retdict_pool[name]['exprs']:
+            raise ValueError('Serial and parallel Jacobians differ for ' + name + '.')
+
+    printtiming(retdict_pool)
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    parsediff_parallel_test()
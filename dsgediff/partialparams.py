@@ -224,5 +224,83 @@ def fullfrompartial_test(partialeval = False, partialeval_numeval = False, skipi
         print('After fully evaluated:')
         print(inputdict['nfxe'])
         
+
+# Incremental Evaluation:{{{1
+def getincrementalindex():
+    """
+    Build the dependency index for the matrices from getpartialeval with no parameters specified.
+    """
+    inputdict = getpartialeval(partialeval = False)
+
+    matrices = {'nfxe': inputdict['fxe'], 'nfxep': inputdict['fxep'], 'nfy': inputdict['fy'], 'nfyp': inputdict['fyp']}
+
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from incremental_func import getdependencyindex
+    index = getdependencyindex(matrices, getvarssdict, getparamssdict_fullbasic())
+
+    return(index, inputdict)
+
+
+def fullfrompartial_incremental_test():
+    """
+    Change one parameter at a time and check the incremental update matches a full evaluation.
+    RHO only enters the shock process so only one entry should be recomputed when it changes.
+    """
+    import numpy as np
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from incremental_func import evaluate_full
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from incremental_func import evaluate_incremental
+
+    index, inputdict = getincrementalindex()
+
+    p = getparamssdict_fullbasic()
+    state = evaluate_full(index, p)
+    print('Entries evaluated in full evaluation: ' + str(state['numentriesevaluated']))
+
+    for updatedparamssdict in [{'RHO': 0.8}, {'BETA': 0.97}, {'ALPHA': 0.35, 'DELTA': 0.05}]:
+        previousmatrices = dict(state['matrices'])
+        newstate = evaluate_incremental(index, state, updatedparamssdict, inplace = False)
+        print('Changed ' + str(list(updatedparamssdict)) + '. Entries evaluated: ' + str(newstate['numentriesevaluated']) + '. Matrices unchanged: ' + str([name for name in previousmatrices if newstate['matrices'][name] is previousmatrices[name]]))
+
+        p.update(updatedparamssdict)
+        retlist = fullfrompartial(inputdict, p, skipinputdict = True)
+        for i, name in enumerate(['nfxe', 'nfxep', 'nfy', 'nfyp']):
+            if not np.allclose(np.array(retlist[i], dtype = float), newstate['matrices'][name]):
+                raise ValueError('Incremental evaluation differs from full evaluation for ' + name + '.')
+
+        state = newstate
+
+
+# Specialize:{{{1
+def specialize_test():
+    """
+    Hold ALPHA, DELTA and RHO fixed, estimate BETA.
+    This replaces choosing between the partialeval flags in getpartialeval.
+    """
+    import sympy
+
+    inputdict = getpartialeval(partialeval = False)
+
+    p = getparamssdict_partial()
+    p['BETA'] = sympy.Symbol('BETA')
+    fixeddict = copy.deepcopy(p)
+    del fixeddict['BETA']
+    v = getvarssdict(p)
+    for var in v:
+        fixeddict[var] = v[var]
+        fixeddict[var + '_ss'] = v[var]
+
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from specialize_func import specialize
+    retdict = specialize([inputdict['fxe'], inputdict['fxep'], inputdict['fy'], inputdict['fyp']], fixeddict, ['BETA'], printdetails = True)
+
+    nfxe, nfxep, nfy, nfyp = retdict['f'](0.95)
+    print(nfxe)
+
+
 # Run:{{{1
-fullfrompartial_test()
+if __name__ == '__main__':
+    fullfrompartial_test()
+    fullfrompartial_incremental_test()
+    specialize_test()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Compare the dense and sparse Jacobians for the simple RBC model.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import time
+
+def sparsediff():
+    
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+    inputdict = getinputdict()
+
+    # add model
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgesetup_func import getmodel_inputdict
+    inputdict = getmodel_inputdict(inputdict) 
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgediff_func import convertstringlisttosympy
+    Et_eqs = convertstringlisttosympy(inputdict['equations_noparams'])
+
+    # dense
+    start = time.perf_counter()
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgediff_func import dsgeanalysisdiff
+    fxe, fxep, fy, fyp = dsgeanalysisdiff(Et_eqs, inputdict['states'] + inputdict['shocks'], inputdict['controls'])
+    print('Dense time: ' + str(time.perf_counter() - start))
+
+    # sparse
+    start = time.perf_counter()
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from sparsediff_func import dsgeanalysisdiff_sparse
+    fxe_s, fxep_s, fy_s, fyp_s = dsgeanalysisdiff_sparse(Et_eqs, inputdict['states'] + inputdict['shocks'], inputdict['controls'])
+    print('Sparse time: ' + str(time.perf_counter() - start))
+
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from sparsediff_func import getnumberentries_sparse
+    numnonzero, numdense = getnumberentries_sparse([fxe_s, fxep_s, fy_s, fyp_s])
+    print('Nonzero entries: ' + str(numnonzero) + '. Dense entries: ' + str(numdense) + '.')
+
+    # verify the dense export matches dsgeanalysisdiff
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from sparsediff_func import sparsetodense_sympy
+    for dense, sparse in zip([fxe, fxep, fy, fyp], [fxe_s, fxep_s, fy_s, fyp_s]):
+        if (dense - sparsetodense_sympy(sparse)).applyfunc(lambda x: x.simplify()) != dense * 0:
+            raise ValueError('Sparse and dense Jacobians differ.')
+
+    print('fxe sparse (COO):')
+    print(list(zip(fxe_s['rows'], fxe_s['cols'], fxe_s['exprs'])))
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    sparsediff()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Sparse versions of dsgeanalysisdiff and getfxefy_inputdict for large models.
+
+In large models each equation only contains a few of the variables so most entries of fx, fxp, fy, fyp are zero.
+Rather than differentiating every equation with respect to every variable, I first get the incidence of each equation (which current and _p variables it contains) and only differentiate with respect to those.
+
+Each Jacobian is stored in COO form as a dict:
+- rows: equation index of each nonzero entry
+- cols: variable index of each nonzero entry
+- exprs: list of sympy expressions for each nonzero entry
+- shape: (number of equations, number of variables)
+
+The entries can be exported to a dense sympy Matrix (so they can be used by the standard dsgediff_func functions) or evaluated numerically into a scipy.sparse matrix or a dense numpy array.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+# Incidence:{{{1
+def getvarsymbols(states, controls):
+    """
+    Get a dict mapping each variable symbol to (jacobian name, column).
+    """
+    import sympy
+
+    varsymbols = {}
+    for i in range(len(states)):
+        varsymbols[sympy.Symbol(states[i])] = ('fx', i)
+        varsymbols[sympy.Symbol(states[i] + '_p')] = ('fxp', i)
+    for i in range(len(controls)):
+        varsymbols[sympy.Symbol(controls[i])] = ('fy', i)
+        varsymbols[sympy.Symbol(controls[i] + '_p')] = ('fyp', i)
+
+    return(varsymbols)
+
+
+def getincidence(Et_eqs, states, controls):
+    """
+    For each equation, get the list of (jacobian name, column) that the equation contains.
+    """
+    varsymbols = getvarsymbols(states, controls)
+
+    incidence = []
+    for eq in Et_eqs:
+        eqvars = [symbol for symbol in eq.free_symbols if symbol in varsymbols]
+        # sort so the order of the entries is deterministic
+        eqvars = sorted(eqvars, key = lambda symbol: (varsymbols[symbol][0], varsymbols[symbol][1]))
+        incidence.append([(symbol, varsymbols[symbol][0], varsymbols[symbol][1]) for symbol in eqvars])
+
+    return(incidence)
+
+
+# Differentiation:{{{1
+def diffequation_sparse(eq, eqincidence):
+    """
+    Differentiate one equation with respect to the variables it contains.
+    Returns a list of (jacobian name, column, sympy expression) for the nonzero derivatives.
+    """
+    import sympy
+
+    entries = []
+    for symbol, jacname, col in eqincidence:
+        deriv = sympy.diff(eq, symbol)
+        if deriv != 0:
+            entries.append((jacname, col, deriv))
+
+    return(entries)
+
+
+def mergeentries_sparse(entrylist, numeq, states, controls):
+    """
+    Merge the list of entries for each equation into COO dicts for fx, fxp, fy, fyp.
+    entrylist[i] is the output of diffequation_sparse for equation i.
+    """
+    shapes = {'fx': (numeq, len(states)), 'fxp': (numeq, len(states)), 'fy': (numeq, len(controls)), 'fyp': (numeq, len(controls))}
+
+    jacs = {}
+    for jacname in ['fx', 'fxp', 'fy', 'fyp']:
+        jacs[jacname] = {'rows': [], 'cols': [], 'exprs': [], 'shape': shapes[jacname]}
+
+    for eqi in range(numeq):
+        for jacname, col, deriv in entrylist[eqi]:
+            jacs[jacname]['rows'].append(eqi)
+            jacs[jacname]['cols'].append(col)
+            jacs[jacname]['exprs'].append(deriv)
+
+    for jacname in jacs:
+        jacs[jacname]['rows'] = np.array(jacs[jacname]['rows'], dtype = int)
+        jacs[jacname]['cols'] = np.array(jacs[jacname]['cols'], dtype = int)
+
+    return(jacs)
+
+
+def dsgeanalysisdiff_sparse(Et_eqs, states, controls):
+    """
+    Sparse version of dsgeanalysisdiff.
+    Returns fx, fxp, fy, fyp as COO dicts.
+    """
+    incidence = getincidence(Et_eqs, states, controls)
+    entrylist = [diffequation_sparse(Et_eqs[i], incidence[i]) for i in range(len(Et_eqs))]
+    jacs = mergeentries_sparse(entrylist, len(Et_eqs), states, controls)
+
+    return(jacs['fx'], jacs['fxp'], jacs['fy'], jacs['fyp'])
+
+
+# Dense Export:{{{1
+def sparsetodense_sympy(jac):
+    """
+    Convert a COO dict into a dense sympy Matrix (like the output of dsgeanalysisdiff).
+    """
+    import sympy
+
+    dense = sympy.zeros(jac['shape'][0], jac['shape'][1])
+    for k in range(len(jac['exprs'])):
+        dense[jac['rows'][k], jac['cols'][k]] = jac['exprs'][k]
+
+    return(dense)
+
+
+def numericcoo(jac, values, dense = False):
+    """
+    Put numerical values for the nonzero entries of jac into a scipy.sparse coo_matrix or a dense numpy array.
+    """
+    if dense is True:
+        densearray = np.zeros(jac['shape'])
+        densearray[jac['rows'], jac['cols']] = values
+        return(densearray)
+    else:
+        import scipy.sparse
+        return(scipy.sparse.coo_matrix((values, (jac['rows'], jac['cols'])), shape = jac['shape']))
+
+
+# Numerical Evaluation:{{{1
+def numeval_sparse(jac, replacedict, dense = False):
+    """
+    Evaluate the nonzero entries of a COO dict by substituting replacedict.
+    """
+    import sympy
+
+    replacedict_sympy = {sympy.Symbol(str(name)): replacedict[name] for name in replacedict}
+    values = np.empty(len(jac['exprs']))
+    for k in range(len(jac['exprs'])):
+        value = jac['exprs'][k].xreplace(replacedict_sympy)
+        try:
+            values[k] = float(value)
+        except TypeError:
+            raise ValueError('Entry ' + str((jac['rows'][k], jac['cols'][k])) + ' not fully evaluated. Remaining symbols: ' + str(value.free_symbols) + '.')
+
+    return(numericcoo(jac, values, dense = dense))
+
+
+def numeval_full_sparse(fx, fxp, fy, fyp, replacedict, dense = False):
+    """
+    Sparse version of numeval_full.
+    """
+    return([numeval_sparse(jac, replacedict, dense = dense) for jac in [fx, fxp, fy, fyp]])
+
+
+def funcstoeval_sparse(jaclist, argnames):
+    """
+    Convert a list of COO dicts into a single function of argnames which returns the numerical Jacobians.
+    All the nonzero entries are lambdified together with common subexpression elimination so the work is shared across the Jacobians.
+
+    The returned function takes the argument values (in the order of argnames) and a keyword dense (default False) and returns a list of scipy.sparse matrices (or dense arrays).
+    """
+    import sympy
+
+    argsymbols = [sympy.Symbol(name) for name in argnames]
+
+    allexprs = []
+    splits = [0]
+    for jac in jaclist:
+        allexprs = allexprs + list(jac['exprs'])
+        splits.append(len(allexprs))
+
+    extrasymbols = set()
+    for expr in allexprs:
+        extrasymbols = extrasymbols.union(expr.free_symbols)
+    extrasymbols = extrasymbols - set(argsymbols)
+    if len(extrasymbols) > 0:
+        raise ValueError('Jacobian entries contain symbols not in argnames: ' + str(extrasymbols) + '.')
+
+    f_all = sympy.lambdify(argsymbols, allexprs, modules = 'numpy', cse = True)
+
+    def f(*args, dense = False):
+        values = np.array(f_all(*args), dtype = float)
+        return([numericcoo(jaclist[i], values[splits[i]: splits[i + 1]], dense = dense) for i in range(len(jaclist))])
+
+    return(f)
+
+
+# Inputdict:{{{1
+def getfxefy_sparse_inputdict(inputdict, denseexport = False):
+    """
+    Sparse version of getfxefy_inputdict. Run getmodel_inputdict first.
+    The shocks are treated as states so we get fxe and fxep.
+
+    Adds fxe_sparse, fxep_sparse, fy_sparse, fyp_sparse.
+    If denseexport is True, also adds the dense sympy matrices fxe, fxep, fy, fyp.
+    """
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgediff_func import convertstringlisttosympy
+    Et_eqs = convertstringlisttosympy(inputdict['equations_noparams'])
+
+    inputdict['fxe_sparse'], inputdict['fxep_sparse'], inputdict['fy_sparse'], inputdict['fyp_sparse'] = dsgeanalysisdiff_sparse(Et_eqs, inputdict['states'] + inputdict['shocks'], inputdict['controls'])
+
+    if denseexport is True:
+        for name in ['fxe', 'fxep', 'fy', 'fyp']:
+            inputdict[name] = sparsetodense_sympy(inputdict[name + '_sparse'])
+
+    return(inputdict)
+
+
+def getnumberentries_sparse(jaclist):
+    """
+    Return the number of nonzero entries and the number of entries in the equivalent dense matrices.
+    """
+    numnonzero = sum([len(jac['exprs']) for jac in jaclist])
+    numdense = sum([jac['shape'][0] * jac['shape'][1] for jac in jaclist])
+    return(numnonzero, numdense)
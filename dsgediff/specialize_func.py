@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Specialize symbolic Jacobians for a given set of fixed parameters.
+
+Rather than choosing a combination of partialeval flags, I give the values of the parameters (and steady state variables) that are held fixed and the names of the parameters that will be estimated. specialize then:
+- constant-folds the fixed values into every entry
+- optionally simplifies the entries that still contain free parameters (off by default since sympy.simplify is slow on large models and often doesn't reduce the number of operations - lambdify already does common subexpression elimination)
+- lambdifies the remaining entries in one function with common subexpression elimination
+- reports the number of operations before and after
+
+The returned evaluator takes the values of the free parameters (in the order of freeparams) and returns a list of numpy arrays. Entries which are constant after folding are computed once and only the other entries are evaluated on each call. Only the free parameters which actually appear in the entries are passed to the lambdified function.
+
+Specializations are cached in memory by the matrices, the fixed values, the free parameters and simplify so repeated calls with the same arguments return immediately. The key holds the entries themselves rather than a string form so it only costs hashing the entries (which sympy caches) and comparing them when there is a match.
+"""
+import os
+from pathlib import Path
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+specializecache = {}
+
+# Operation Counts:{{{1
+def countops_matrices(matrices):
+    """
+    Count the number of operations in a list of sympy matrices.
+    """
+    import sympy
+
+    return(sum([sympy.count_ops(entry) for matrix in matrices for entry in matrix]))
+
+
+# Specialize:{{{1
+def getspecializekey(matrices, fixeddict, freeparams, simplify):
+    import sympy
+
+    matriceskey = tuple([(matrix.shape, tuple(matrix)) for matrix in matrices])
+    fixedkey = tuple(sorted([(str(name), sympy.sympify(fixeddict[name])) for name in fixeddict], key = lambda item: item[0]))
+    return((matriceskey, fixedkey, tuple(freeparams), simplify))
+
+
+def specialize(matrices, fixeddict, freeparams, simplify = False, usecache = True, printdetails = False):
+    """
+    matrices: list of sympy matrices e.g. [fx, fxp, fy, fyp]
+    fixeddict: dict of names (strings or sympy symbols) to the values which are held fixed. The values can themselves be expressions in the free parameters (for example steady state variables).
+    freeparams: list of the names of the parameters which are estimated
+
+    Returns a dict with:
+    - matrices: the specialized sympy matrices
+    - f: evaluator taking the values of freeparams and returning a list of numpy arrays
+    - freeparams, usedparams: the free parameters and those that actually appear in the matrices
+    - numops_before, numops_after: number of operations before and after specializing
+    """
+    import sympy
+
+    if usecache is True:
+        key = getspecializekey(matrices, fixeddict, freeparams, simplify)
+        if key in specializecache:
+            return(specializecache[key])
+
+    replacedict = {sympy.Symbol(str(name)): sympy.sympify(fixeddict[name]) for name in fixeddict}
+    freesymbols = [sympy.Symbol(param) for param in freeparams]
+
+    specialized = []
+    for matrix in matrices:
+        newmatrix = matrix.xreplace(replacedict)
+        if simplify is True:
+            newmatrix = newmatrix.applyfunc(lambda entry: sympy.simplify(entry) if len(entry.free_symbols) > 0 else entry)
+        specialized.append(newmatrix)
+
+    # check nothing is left other than the free parameters
+    remaining = set()
+    for matrix in specialized:
+        remaining = remaining.union(matrix.free_symbols)
+    if len(remaining - set(freesymbols)) > 0:
+        raise ValueError('Symbols not fixed or free: ' + str(remaining - set(freesymbols)) + '.')
+    usedsymbols = [symbol for symbol in freesymbols if symbol in remaining]
+    usedpos = [freesymbols.index(symbol) for symbol in usedsymbols]
+
+    # constant entries are evaluated once
+    # the other entries are lambdified together
+    basearrays = []
+    varentries = []
+    varexprs = []
+    for matrixi in range(len(specialized)):
+        matrix = specialized[matrixi]
+        basearray = np.zeros(matrix.shape)
+        for i in range(matrix.shape[0]):
+            for j in range(matrix.shape[1]):
+                if len(matrix[i, j].free_symbols) == 0:
+                    basearray[i, j] = float(matrix[i, j])
+                else:
+                    varentries.append((matrixi, i, j))
+                    varexprs.append(matrix[i, j])
+        basearrays.append(basearray)
+
+    if len(varexprs) > 0:
+        f_var = sympy.lambdify(usedsymbols, varexprs, modules = 'numpy', cse = True)
+    else:
+        f_var = None
+
+    def f(*params):
+        if len(params) != len(freeparams):
+            raise ValueError('Expected ' + str(len(freeparams)) + ' parameters. Received ' + str(len(params)) + '.')
+        arrays = [basearray.copy() for basearray in basearrays]
+        if f_var is not None:
+            values = f_var(*[params[pos] for pos in usedpos])
+            for k in range(len(varentries)):
+                matrixi, i, j = varentries[k]
+                arrays[matrixi][i, j] = values[k]
+        return(arrays)
+
+    retdict = {}
+    retdict['matrices'] = specialized
+    retdict['f'] = f
+    retdict['freeparams'] = list(freeparams)
+    retdict['usedparams'] = [str(symbol) for symbol in usedsymbols]
+    retdict['numops_before'] = countops_matrices(matrices)
+    retdict['numops_after'] = countops_matrices(specialized)
+    retdict['numentries_variable'] = len(varentries)
+
+    if printdetails is True:
+        printspecialize(retdict)
+
+    if usecache is True:
+        specializecache[key] = retdict
+
+    return(retdict)
+
+
+def printspecialize(retdict):
+    print('Operations before specializing: ' + str(retdict['numops_before']))
+    print('Operations after specializing: ' + str(retdict['numops_after']))
+    print('Entries depending on free parameters: ' + str(retdict['numentries_variable']))
+    print('Free parameters used: ' + str(retdict['usedparams']) + ' of ' + str(retdict['freeparams']))
+
+
+# Test:{{{1
+def specialize_test():
+    import sympy
+
+    ALPHA, BETA, DELTA, K = sympy.symbols('ALPHA BETA DELTA K')
+    fx = sympy.Matrix([[BETA * ALPHA * K ** (ALPHA - 1), 1 - DELTA], [sympy.log(BETA) + DELTA, 2]])
+    fy = sympy.Matrix([[BETA ** 2, K * DELTA]])
+
+    # K is a steady state variable depending on ALPHA
+    fixeddict = {'BETA': 0.95, 'DELTA': 0.1, 'K': (ALPHA / (1 / 0.95 - 1 + 0.1)) ** (1 / (1 - ALPHA))}
+    retdict = specialize([fx, fy], fixeddict, ['ALPHA', 'SIGMA'], printdetails = True)
+
+    nfx, nfy = retdict['f'](0.3, 0.01)
+    values = {ALPHA: 0.3, BETA: 0.95, DELTA: 0.1}
+    values[K] = fixeddict['K'].subs({ALPHA: 0.3})
+    if not np.allclose(nfx, np.array(fx.subs(values), dtype = float)) or not np.allclose(nfy, np.array(fy.subs(values), dtype = float)):
+        raise ValueError('Specialized evaluation differs from direct substitution.')
+
+    if specialize([fx, fy], fixeddict, ['ALPHA', 'SIGMA']) is not retdict:
+        raise ValueError('Specialization was not cached.')
+    # equal but different matrix objects use the same cache entry
+    if specialize([fx.copy(), fy.copy()], dict(fixeddict), ['ALPHA', 'SIGMA']) is not retdict:
+        raise ValueError('Specialization was not cached for a copy of the matrices.')
+    if specialize([fx, fy], dict(fixeddict, BETA = 0.96), ['ALPHA', 'SIGMA']) is retdict:
+        raise ValueError('Specialization was cached for different fixed values.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    specialize_test()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Check that the log-linearized and log (nonlinear) versions of a model agree over many parameter values.
+
+The check() functions in the model files compare the two specifications at one parameter point. A typo which only matters at other parameter values (for example ALPHA written as 1 - ALPHA in a model calibrated at ALPHA = 0.5) is not caught. Here I draw numpoints parameter values uniformly from given ranges and compare the Jacobians of the two specifications at each of them.
+
+For each specification I differentiate the equations once with sympy, keeping the parameters and the steady states (var_ss) as symbols, and lambdify the Jacobian entries with NumPy so a whole chunk of parameter points is evaluated in one vectorized call. Chunks are split across a multiprocessing pool.
+
+Variables in logvars are written as var_ss exp(var) before differentiating so both specifications are differentiated with respect to log deviations.
+Equations can be scaled differently in the two specifications (1 / C = ... against -C = ...) so each row is rescaled to match the log version using the entry of the log version which is largest in absolute value. The discrepancy for each entry is |loglin * scale - log| / max(1, |log|).
+
+Discrete models: the columns are [states; shocks], [states; shocks]_p, controls, controls_p.
+Continuous models (continuous=True): the columns are var_dot and var for var in states + controls.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+# Jacobian functions already computed in this process: key -> jacdict
+jaccache = {}
+
+# Jacobians:{{{1
+def getcolumnnames(inputdict, continuous = False):
+    variables = inputdict['states'] + inputdict['controls']
+    if continuous is True:
+        return([var + '_dot' for var in variables] + variables)
+    shocks = inputdict.get('shocks', [])
+    return(inputdict['states'] + shocks + [var + '_p' for var in inputdict['states'] + shocks] + inputdict['controls'] + [var + '_p' for var in inputdict['controls']])
+
+
+def getjacdict(inputdict, continuous = False):
+    """
+    Differentiate the equations once.
+    Returns a dict with a function f(*argvalues) which returns a list of the Jacobian entries (row by row), the names of the arguments, the shape and the names of the columns.
+    """
+    import sympy
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgediff_func import convertstringlisttosympy
+    eqs = convertstringlisttosympy(inputdict['equations'])
+
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from secondorder_func import getlogvarslist
+    logvars = getlogvarslist(inputdict)
+
+    variables = inputdict['states'] + inputdict['controls']
+    columnnames = getcolumnnames(inputdict, continuous = continuous)
+
+    # write log variables as var_ss exp(var)
+    replacedict = {}
+    for var in logvars:
+        ss = sympy.Symbol(var + '_ss')
+        if continuous is True:
+            replacedict[sympy.Symbol(var)] = ss * sympy.exp(sympy.Symbol(var))
+            replacedict[sympy.Symbol(var + '_dot')] = ss * sympy.exp(sympy.Symbol(var)) * sympy.Symbol(var + '_dot')
+        else:
+            replacedict[sympy.Symbol(var)] = ss * sympy.exp(sympy.Symbol(var))
+            replacedict[sympy.Symbol(var + '_p')] = ss * sympy.exp(sympy.Symbol(var + '_p'))
+    if len(replacedict) > 0:
+        eqs = [eq.xreplace(replacedict) for eq in eqs]
+
+    # point at which to evaluate: 0 for log deviations and shocks, var_ss for variables in levels
+    pointdict = {}
+    for name in columnnames:
+        symbol = sympy.Symbol(name)
+        if name.endswith('_dot'):
+            pointdict[symbol] = 0
+            continue
+        var = name[: -2] if name.endswith('_p') and name[: -2] in variables + inputdict.get('shocks', []) else name
+        if var in variables and var not in logvars and inputdict.get('loglineareqs') is not True:
+            pointdict[symbol] = sympy.Symbol(var + '_ss')
+        else:
+            pointdict[symbol] = 0
+
+    jac = sympy.Matrix(eqs).jacobian([sympy.Symbol(name) for name in columnnames]).xreplace(pointdict)
+    exprs = list(jac)
+
+    argsymbols = set()
+    for expr in exprs:
+        argsymbols = argsymbols.union(expr.free_symbols)
+    argsymbols = sorted(argsymbols, key = str)
+
+    jacdict = {}
+    jacdict['f'] = sympy.lambdify(argsymbols, exprs, modules = 'numpy', cse = True)
+    jacdict['argnames'] = [str(symbol) for symbol in argsymbols]
+    jacdict['shape'] = (len(eqs), len(columnnames))
+    jacdict['columnnames'] = columnnames
+
+    return(jacdict)
+
+
+def getargarrays(inputdicts, argnames):
+    """
+    Array of the values of each argument over the inputdicts (one per parameter point).
+    """
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from secondorder_func import getssdict_inputdict
+
+    ssdicts = [getssdict_inputdict(inputdict) for inputdict in inputdicts]
+    argarrays = []
+    for name in argnames:
+        values = []
+        for i in range(len(inputdicts)):
+            if name.endswith('_ss') and name[: -3] in ssdicts[i]:
+                values.append(ssdicts[i][name[: -3]])
+            elif name in inputdicts[i]['paramssdict']:
+                values.append(inputdicts[i]['paramssdict'][name])
+            else:
+                raise ValueError('No value for ' + name + '.')
+        argarrays.append(np.array(values, dtype = float))
+    return(argarrays)
+
+
+def evaluatejacobians(jacdict, inputdicts):
+    """
+    Returns numpoints x equations x columns.
+    """
+    numpoints = len(inputdicts)
+    entries = jacdict['f'](*getargarrays(inputdicts, jacdict['argnames']))
+    # constant entries come back as scalars
+    entries = [np.broadcast_to(np.asarray(entry, dtype = float), (numpoints, )) for entry in entries]
+    return(np.stack(entries, axis = 1).reshape((numpoints, ) + jacdict['shape']))
+
+
+# Compare:{{{1
+def comparejacobians(jac_loglin, jac_log):
+    """
+    Rescale each row of jac_loglin to match jac_log and return the discrepancy of each entry (numpoints x equations x columns).
+    """
+    numpoints, numeqs, numcols = np.shape(jac_log)
+    pivot = np.argmax(np.abs(jac_log), axis = 2)
+    pointindex, eqindex = np.meshgrid(np.arange(numpoints), np.arange(numeqs), indexing = 'ij')
+    pivot_log = jac_log[pointindex, eqindex, pivot]
+    pivot_loglin = jac_loglin[pointindex, eqindex, pivot]
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        scale = pivot_log / pivot_loglin
+    # if the pivot is zero in the loglin version the rows can't match
+    scale = np.where(np.isfinite(scale), scale, np.nan)
+
+    discrepancy = np.abs(jac_loglin * scale[:, :, None] - jac_log) / np.maximum(1, np.abs(jac_log))
+    # rows where the log version is all zero should be all zero in the loglin version too
+    zerorows = pivot_log == 0
+    discrepancy[zerorows] = np.abs(jac_loglin[zerorows])
+    discrepancy[np.isnan(discrepancy)] = np.inf
+
+    return(discrepancy)
+
+
+def checkchunk(getinputdictfunc, plist, continuous = False):
+    """
+    Compare the two specifications at each of the parameter dicts in plist.
+    Returns numpoints x equations x columns discrepancies.
+    """
+    jacdicts = []
+    for loglineareqs in [True, False]:
+        key = (getinputdictfunc.__module__, getinputdictfunc.__name__, loglineareqs, continuous)
+        if key not in jaccache:
+            jaccache[key] = getjacdict(getinputdictfunc(dict(plist[0]), loglineareqs), continuous = continuous)
+        jacdicts.append(jaccache[key])
+
+    jac_loglin = evaluatejacobians(jacdicts[0], [getinputdictfunc(dict(p), True) for p in plist])
+    jac_log = evaluatejacobians(jacdicts[1], [getinputdictfunc(dict(p), False) for p in plist])
+
+    return(comparejacobians(jac_loglin, jac_log))
+
+
+def checkchunk_star(args):
+    return(checkchunk(*args))
+
+
+def drawparams(paramranges, numpoints, seed = 1):
+    rng = np.random.default_rng(seed)
+    draws = {param: rng.uniform(paramranges[param][0], paramranges[param][1], size = numpoints) for param in paramranges}
+    return([{param: float(draws[param][i]) for param in paramranges} for i in range(numpoints)])
+
+
+def checkequivalence(getinputdictfunc, paramranges, numpoints = 1000, seed = 1, continuous = False, numprocesses = None, chunksize = 250, tol = 1e-8, printdetails = True):
+    """
+    getinputdictfunc(p, loglineareqs): returns the inputdict (with the steady state) for parameter dict p. Must be defined at the top level of a module so it can be sent to the pool.
+    paramranges: {param: (low, high)}
+    numprocesses: size of the pool (None means the number of CPUs). With 1, no pool is used.
+
+    Returns a dict with:
+    - maxdiscrepancy: equations x columns max discrepancy over the points
+    - worstparams: for each entry above tol, the parameter point with the largest discrepancy
+    - failures: list of (equation index, column name, max discrepancy) above tol
+    """
+    plist = drawparams(paramranges, numpoints, seed = seed)
+    chunks = [plist[start: start + chunksize] for start in range(0, numpoints, chunksize)]
+    args = [(getinputdictfunc, chunk, continuous) for chunk in chunks]
+
+    if numprocesses == 1 or len(chunks) == 1:
+        results = [checkchunk_star(arg) for arg in args]
+    else:
+        import multiprocessing
+        with multiprocessing.Pool(numprocesses) as pool:
+            results = pool.map(checkchunk_star, args)
+    discrepancy = np.concatenate(results, axis = 0)
+
+    # column names (only needs the symbolic structure so use the first point)
+    inputdict = getinputdictfunc(dict(plist[0]), False)
+    columnnames = getcolumnnames(inputdict, continuous = continuous)
+
+    report = {}
+    report['maxdiscrepancy'] = np.max(discrepancy, axis = 0)
+    report['columnnames'] = columnnames
+    report['numpoints'] = numpoints
+    report['failures'] = []
+    report['worstparams'] = {}
+    worstpoint = np.argmax(discrepancy, axis = 0)
+    for i in range(np.shape(discrepancy)[1]):
+        for j in range(np.shape(discrepancy)[2]):
+            if report['maxdiscrepancy'][i, j] > tol:
+                report['failures'].append((i, columnnames[j], float(report['maxdiscrepancy'][i, j])))
+                report['worstparams'][(i, columnnames[j])] = plist[worstpoint[i, j]]
+
+    if printdetails is True:
+        if len(report['failures']) == 0:
+            print('Equivalent at all ' + str(numpoints) + ' points. Max discrepancy: ' + str(np.max(report['maxdiscrepancy'])) + '.')
+        for i, columnname, maxdiscrepancy in report['failures']:
+            print('Equation ' + str(i) + ': ' + inputdict['equations'][i] + '. Derivative with respect to ' + columnname + ' differs by up to ' + str(maxdiscrepancy) + ' for example at ' + str(report['worstparams'][(i, columnname)]) + '.')
+
+    return(report)
+
+
+# Models:{{{1
+def getinputdict_rbc_simple(p, loglineareqs):
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+    return(getinputdict(p = p, loglineareqs = loglineareqs))
+
+
+def getinputdict_nk_simple(p, loglineareqs):
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from nk_simple import getinputdict
+    return(getinputdict(p = p, loglineareqs = loglineareqs))
+
+
+def getinputdict_bayes_simple(p, loglineareqs):
+    sys.path.append(str(__projectdir__ / Path('bayes')))
+    from simple import getinputdict_full
+    return(getinputdict_full(p = p, loglineareqs = loglineareqs))
+
+
+def getinputdict_partialparams(p, loglineareqs):
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from partialparams import getinputdict_full
+    return(getinputdict_full(p, loglineareqs = loglineareqs))
+
+
+def getinputdict_continuous_loglin(p, loglineareqs):
+    sys.path.append(str(__projectdir__ / Path('continuous')))
+    from loglin import getinputdict
+    inputdict = getinputdict(loglineareqs = loglineareqs)
+    # the steady state doesn't depend on a
+    inputdict['paramssdict'].update(p)
+    return(inputdict)
+
+
+def getinputdict_synthetic(p, loglineareqs):
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from synthetic_func import getinputdict
+    return(getinputdict(numsectors = 5, p = p, loglineareqs = loglineareqs))
+
+
+def getmodels():
+    """
+    The models in the project which have both specifications with the parameter ranges to check.
+    """
+    rbcranges = {'ALPHA': (0.1, 0.6), 'BETA': (0.8, 0.999), 'DELTA': (0.01, 0.3), 'RHO': (0, 0.99)}
+
+    models = {}
+    models['rbc_simple'] = {'getinputdict': getinputdict_rbc_simple, 'paramranges': rbcranges}
+    models['nk_simple'] = {'getinputdict': getinputdict_nk_simple, 'paramranges': {'PHIpi': (1.01, 3), 'Rbar': (1, 1.1)}}
+    models['bayes_simple'] = {'getinputdict': getinputdict_bayes_simple, 'paramranges': {'RHO': (0, 0.99), 'SIGMA_epsilon': (0.01, 0.5)}}
+    models['partialparams'] = {'getinputdict': getinputdict_partialparams, 'paramranges': rbcranges}
+    models['continuous_loglin'] = {'getinputdict': getinputdict_continuous_loglin, 'paramranges': {'a': (-2, -0.01)}, 'continuous': True}
+    models['synthetic'] = {'getinputdict': getinputdict_synthetic, 'paramranges': {'ALPHA': (0.1, 0.4), 'BETA': (0.8, 0.999), 'DELTA': (0.01, 0.3), 'RHO': (0, 0.99), 'GAMMA': (0, 0.5)}}
+
+    return(models)
+
+
+def checkall(numpoints = 1000, numprocesses = None):
+    """
+    Check every model in getmodels. Raises an error if any fail.
+    """
+    models = getmodels()
+    failed = []
+    for name in models:
+        print(name + ':')
+        report = checkequivalence(models[name]['getinputdict'], models[name]['paramranges'], numpoints = numpoints, continuous = models[name].get('continuous', False), numprocesses = numprocesses)
+        if len(report['failures']) > 0:
+            failed.append(name)
+    if len(failed) > 0:
+        raise ValueError('Log-linearized and log specifications differ for: ' + ', '.join(failed) + '.')
+
+
+# Test:{{{1
+def getinputdict_rbc_typo(p, loglineareqs):
+    """
+    rbc_simple with a typo in the log-linearized resource constraint which only matters when DELTA is not 0.1.
+    """
+    inputdict = getinputdict_rbc_simple(p, loglineareqs)
+    if loglineareqs is True:
+        inputdict['equations'][1] = inputdict['equations'][1].replace('(1 - DELTA) * K_ss * K', '0.9 * K_ss * K')
+    return(inputdict)
+
+
+def equivalence_test():
+    models = getmodels()
+    report = checkequivalence(models['rbc_simple']['getinputdict'], models['rbc_simple']['paramranges'], numpoints = 500, numprocesses = 2, chunksize = 100)
+    if len(report['failures']) > 0:
+        raise ValueError('rbc_simple specifications should be equivalent.')
+
+    # the typo passes at the calibrated point but is caught here
+    report = checkequivalence(getinputdict_rbc_typo, models['rbc_simple']['paramranges'], numpoints = 500, numprocesses = 1, printdetails = False)
+    # the row is rescaled so the error can show up in every entry of the equation
+    if len(report['failures']) == 0 or set([failure[0] for failure in report['failures']]) != set([1]):
+        raise ValueError('Typo in the resource constraint not caught: ' + str(report['failures']) + '.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    equivalence_test()
+    checkall()
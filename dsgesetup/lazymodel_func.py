@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+A lazy version of the getmodel_inputdict -> polfunc_inputdict -> getshockpath_inputdict -> simpathlinear_inputdict chain.
+
+The model is accessed like an inputdict (model['gx'], model['varpath']) but each output is only computed when it is first accessed and is then memoized.
+Every input has a version number which goes up each time it is set. Every computed node records the versions of the inputs it depends on. When a node is accessed again, it is only recomputed if one of those versions has changed. So checking a node costs a few integer comparisons rather than hashing the inputs (which can include large arrays like shockpath).
+So:
+- changing the shock path (shocksddict, pathsimperiods, seed) does not re-solve the model
+- changing a parameter does not re-parse or re-differentiate the equations (the Jacobians are kept symbolic in the parameters and only re-evaluated)
+
+The nodes are:
+- Et_eqs: the sympy equations after converting logvars into logs (with the shock equations added)
+- jac: sparse symbolic fxe, fxep, fy, fyp (see dsgediff/sparsediff_func.py) and a function to evaluate them
+- steadystate: the varssdict in use. If the model supplies a getss(paramssdict) function (getlazymodel(inputdict, getss = getss)), this is recomputed whenever paramssdict changes. Otherwise it is the varssdict input as given, so changing a parameter which moves the steady state also requires setting varssdict
+- numdict: the numerical value of every symbol at the steady state
+- nfxe, nfxep, nfy, nfyp: the numerical Jacobians
+- gx, hx: the policy functions
+- shockpath
+- varpath, expssvarpath: the linear simulation
+- equations_noparams etc.: the output of getmodel_inputdict (only computed if accessed)
+
+Inputs are set with model['paramssdict'] = ... or model.update({...}). Setting an input to a value equal to its current value doesn't change its version. Inputs which are dicts are stored as a VersionedDict (a copy of the dict which counts changes) so they can also be changed in place through the model (model['paramssdict']['BETA'] = 0.96). Changes to the original dict that was passed in or to objects nested inside an input aren't seen, so set the input again in that case.
+With getss, model['varssdict'] returns the steady state computed from the current paramssdict and it can't be set directly.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+# Versions:{{{1
+class VersionedDict(dict):
+    """
+    dict which counts the number of times it has been changed in self.version.
+    """
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.version = 0
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.version = self.version + 1
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.version = self.version + 1
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.version = self.version + 1
+
+    def setdefault(self, key, default = None):
+        if key not in self:
+            self[key] = default
+        return(self[key])
+
+    def pop(self, *args):
+        self.version = self.version + 1
+        return(dict.pop(self, *args))
+
+    def popitem(self):
+        self.version = self.version + 1
+        return(dict.popitem(self))
+
+    def clear(self):
+        dict.clear(self)
+        self.version = self.version + 1
+
+
+def isequal(value1, value2):
+    """
+    Check whether an input is being set to the value it already has. Anything which can't be compared directly (like numpy arrays) is treated as different.
+    """
+    if value1 is value2:
+        return(True)
+    try:
+        return(type(value1) == type(value2) and bool(value1 == value2))
+    except (ValueError, TypeError):
+        return(False)
+
+
+# Node Functions:{{{1
+def node_Et_eqs(inputs, upstream):
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgediff_func import convertstringlisttosympy
+    Et_eqs = convertstringlisttosympy(inputs['equations'])
+
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from secondorder_func import getlogvarslist
+    logvars = getlogvarslist(inputs)
+    if len(logvars) > 0:
+        # only the equations are needed here so use a placeholder steady state
+        # that way the equations don't depend on the parameters
+        sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+        from dsgediff_func import convertlogvariables
+        Et_eqs, _ = convertlogvariables(Et_eqs, samenamelist = logvars, varssdict = {var: 1 for var in logvars})
+
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from secondorder_func import addshockequations
+    Et_eqs = addshockequations(Et_eqs, inputs['shocks'])
+
+    return({'Et_eqs': Et_eqs})
+
+
+def node_jac(inputs, upstream):
+    Et_eqs = upstream['Et_eqs']
+
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from sparsediff_func import dsgeanalysisdiff_sparse
+    jaclist = dsgeanalysisdiff_sparse(Et_eqs, inputs['states'] + inputs['shocks'], inputs['controls'])
+
+    argnames = set()
+    for jac in jaclist:
+        for expr in jac['exprs']:
+            argnames = argnames.union([str(symbol) for symbol in expr.free_symbols])
+    argnames = sorted(argnames)
+
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from sparsediff_func import funcstoeval_sparse
+    jac_f = funcstoeval_sparse(jaclist, argnames)
+
+    return({'fxe_sparse': jaclist[0], 'fxep_sparse': jaclist[1], 'fy_sparse': jaclist[2], 'fyp_sparse': jaclist[3], 'jac_f': jac_f, 'jac_argnames': argnames})
+
+
+def node_steadystate(inputs, upstream):
+    if inputs.get('getss') is None:
+        return({'steadystate': inputs['varssdict']})
+    # copy since some getss functions add the steady state to the dict they are given
+    return({'steadystate': inputs['getss'](dict(inputs['paramssdict']))})
+
+
+def getinputs_steadystate(inputs, upstream):
+    """
+    The inputs with varssdict replaced by the steady state from the steadystate node.
+    """
+    inputs = dict(inputs)
+    inputs['varssdict'] = upstream['steadystate']
+    if 'getss' in inputs:
+        del inputs['getss']
+    return(inputs)
+
+
+def node_numdict(inputs, upstream):
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from secondorder_func import getnumdict_inputdict
+    return({'numdict': getnumdict_inputdict(getinputs_steadystate(inputs, upstream))})
+
+
+def node_nfxefy(inputs, upstream):
+    jac_f = upstream['jac_f']
+    jac_argnames = upstream['jac_argnames']
+    numdict = upstream['numdict']
+
+    missing = [name for name in jac_argnames if name not in numdict]
+    if len(missing) > 0:
+        raise ValueError('No value for symbols in the Jacobians: ' + str(missing) + '.')
+    nfxe, nfxep, nfy, nfyp = jac_f(*[numdict[name] for name in jac_argnames], dense = True)
+    return({'nfxe': nfxe, 'nfxep': nfxep, 'nfy': nfy, 'nfyp': nfyp})
+
+
+def node_polfunc(inputs, upstream):
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsge_bkdiscrete_func import gxhx
+    gx, hx = gxhx(upstream['nfxe'], upstream['nfxep'], upstream['nfy'], upstream['nfyp'])
+    return({'gx': gx, 'hx': hx})
+
+
+def node_shockpath(inputs, upstream):
+    if 'shockpath' in inputs:
+        return({'shockpath': inputs['shockpath']})
+
+    # use a local generator so the global numpy random state isn't changed
+    rng = np.random.default_rng(inputs.get('seed'))
+
+    shocksddict = dict(inputs.get('shocksddict', {}))
+    for shock in inputs['shocks']:
+        if shock not in shocksddict:
+            shocksddict[shock] = 1
+
+    shockpath = rng.standard_normal([inputs['pathsimperiods'], len(inputs['shocks'])]) * np.array([shocksddict[shock] for shock in inputs['shocks']])
+
+    return({'shockpath': shockpath})
+
+
+def node_sim(inputs, upstream):
+    states = inputs['states']
+    shocks = inputs['shocks']
+    controls = inputs['controls']
+
+    # simpathlinear_inputdict works on an inputdict so build one from the current values
+    inputdict = getinputs_steadystate(inputs, upstream)
+    inputdict['gx'] = upstream['gx']
+    inputdict['hx'] = upstream['hx']
+    inputdict['shockpath'] = upstream['shockpath']
+    inputdict['pathsimperiods'] = np.shape(upstream['shockpath'])[0]
+    varnames = states + shocks + controls
+    inputdict['stateshockcontrolposdict'] = {varnames[i]: i for i in range(len(varnames))}
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from simlineardsge_func import simpathlinear_inputdict
+    inputdict = simpathlinear_inputdict(inputdict)
+
+    return({'varpath': inputdict['varpath'], 'expssvarpath': inputdict.get('expssvarpath'), 'stateshockcontrolposdict': inputdict['stateshockcontrolposdict']})
+
+
+def node_model(inputs, upstream):
+    """
+    The full output of getmodel_inputdict. Only used if one of its keys is accessed.
+    """
+    import copy
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgesetup_func import getmodel_inputdict
+    inputdict = getmodel_inputdict(copy.deepcopy(getinputs_steadystate(inputs, upstream)))
+
+    return({key: inputdict[key] for key in inputdict if key not in inputs})
+
+
+# Graph:{{{1
+def getnodes():
+    """
+    Return a dict of node name -> (input names, upstream node names, function, output names).
+    The function is called with the dict of inputs and a dict of the outputs of the upstream nodes.
+    """
+    structure = ['equations', 'states', 'controls', 'shocks', 'logvars', 'loglineareqs']
+    steadystate = ['paramssdict', 'states', 'controls', 'shocks', 'logvars', 'loglineareqs']
+    shockinputs = ['shocks', 'shocksddict', 'pathsimperiods', 'seed', 'shockpath']
+
+    nodes = {}
+    nodes['Et_eqs'] = (structure, [], node_Et_eqs, ['Et_eqs'])
+    nodes['jac'] = (['states', 'controls', 'shocks'], ['Et_eqs'], node_jac, ['fxe_sparse', 'fxep_sparse', 'fy_sparse', 'fyp_sparse', 'jac_f', 'jac_argnames'])
+    nodes['steadystate'] = (['paramssdict', 'varssdict', 'getss'], [], node_steadystate, ['steadystate'])
+    nodes['numdict'] = (steadystate, ['steadystate'], node_numdict, ['numdict'])
+    nodes['nfxefy'] = ([], ['jac', 'numdict'], node_nfxefy, ['nfxe', 'nfxep', 'nfy', 'nfyp'])
+    nodes['polfunc'] = ([], ['nfxefy'], node_polfunc, ['gx', 'hx'])
+    nodes['shockpath'] = (shockinputs, [], node_shockpath, ['shockpath'])
+    nodes['sim'] = (['states', 'controls', 'shocks', 'paramssdict', 'logvars', 'loglineareqs'], ['steadystate', 'polfunc', 'shockpath'], node_sim, ['varpath', 'expssvarpath', 'stateshockcontrolposdict'])
+    # the outputs of getmodel_inputdict aren't known in advance so this node is looked up if a key isn't found elsewhere
+    nodes['model'] = (structure + steadystate, ['steadystate'], node_model, None)
+
+    return(nodes)
+
+
+# Lazy Model:{{{1
+class LazyModel(object):
+    """
+    Dict-like lazy model. Pass the usual inputdict (e.g. from dsgesetup/rbc_simple.getinputdict) and optionally pathsimperiods, shocksddict, seed.
+    getss: function of paramssdict returning varssdict (e.g. dsgesetup/rbc_simple.getss). If given, the steady state is recomputed when paramssdict changes.
+    """
+
+    def __init__(self, inputdict, getss = None):
+        self.inputs = {}
+        # input name -> number of times it has been set
+        self.versions = {}
+        for key in inputdict:
+            self.setinput(key, inputdict[key])
+        if getss is not None:
+            self.setinput('getss', getss)
+        self.nodes = getnodes()
+        # node name -> (versions of the inputs it depends on, outputs)
+        self.cache = {}
+        # number of times each node has been computed
+        self.computecounts = {node: 0 for node in self.nodes}
+
+        self.outputnode = {}
+        for node in self.nodes:
+            if self.nodes[node][3] is not None:
+                for output in self.nodes[node][3]:
+                    self.outputnode[output] = node
+
+    def __setitem__(self, key, value):
+        if key in self.outputnode:
+            raise KeyError(key + ' is computed by the model and cannot be set.')
+        if key == 'varssdict' and self.inputs.get('getss') is not None:
+            raise KeyError('varssdict is computed from paramssdict by getss and cannot be set.')
+        self.setinput(key, value)
+
+    def setinput(self, key, value):
+        if key in self.inputs:
+            current = dict(self.inputs[key]) if isinstance(self.inputs[key], VersionedDict) else self.inputs[key]
+            if isequal(current, value):
+                return(None)
+        if isinstance(value, dict):
+            value = VersionedDict(value)
+        self.inputs[key] = value
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def __delitem__(self, key):
+        del self.inputs[key]
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def __contains__(self, key):
+        return(key in self.inputs or key in self.outputnode)
+
+    def update(self, d):
+        for key in d:
+            self[key] = d[key]
+
+    def __getitem__(self, key):
+        if key == 'varssdict' and self.inputs.get('getss') is not None:
+            return(self.getnode('steadystate')['steadystate'])
+        if key in self.inputs:
+            return(self.inputs[key])
+        if key in self.outputnode:
+            return(self.getnode(self.outputnode[key])[key])
+        outputs = self.getnode('model')
+        if key in outputs:
+            return(outputs[key])
+        raise KeyError(key)
+
+    def get(self, key, default = None):
+        try:
+            return(self[key])
+        except KeyError:
+            return(default)
+
+    def nodeversions(self, node):
+        """
+        Versions of the inputs a node depends on (directly or through upstream nodes).
+        This doesn't require computing anything.
+        """
+        inputnames, upstream, f, outputs = self.nodes[node]
+        parts = tuple([(self.versions.get(name, 0), getattr(self.inputs.get(name), 'version', 0)) for name in inputnames])
+        return(parts + tuple([self.nodeversions(upnode) for upnode in upstream]))
+
+    def getnode(self, node):
+        """
+        Return the outputs of node, only computing them if the inputs they depend on have changed.
+        """
+        nodeversions = self.nodeversions(node)
+        if node in self.cache and self.cache[node][0] == nodeversions:
+            return(self.cache[node][1])
+
+        inputnames, upstream, f, outputs = self.nodes[node]
+        upstreamoutputs = {}
+        for upnode in upstream:
+            upstreamoutputs.update(self.getnode(upnode))
+        retdict = f(self.inputs, upstreamoutputs)
+
+        self.cache[node] = (nodeversions, retdict)
+        self.computecounts[node] = self.computecounts[node] + 1
+
+        return(retdict)
+
+    def invalidate(self, node = None):
+        """
+        Drop the cached outputs of node (or of all nodes if node is None).
+        """
+        if node is None:
+            self.cache = {}
+        elif node in self.cache:
+            del self.cache[node]
+
+
+def getlazymodel(inputdict, getss = None):
+    return(LazyModel(inputdict, getss = getss))
+
+
+# Test:{{{1
+def lazymodel_test():
+    """
+    Check the lazy model only recomputes the nodes downstream of a change and gives the same policy functions as polfunc_inputdict.
+    """
+    import copy
+    import time
+
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getss
+    inputdict = getinputdict()
+
+    model = getlazymodel(copy.deepcopy(inputdict), getss = getss)
+    model['pathsimperiods'] = 50
+    model['shocksddict'] = {'epsilon_a': 0.01}
+    model['seed'] = 1
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgesetup_func import getmodel_inputdict
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsge_bkdiscrete_func import polfunc_inputdict
+    inputdict = polfunc_inputdict(getmodel_inputdict(inputdict))
+    if not np.allclose(model['gx'], inputdict['gx']) or not np.allclose(model['hx'], inputdict['hx']):
+        raise ValueError('Lazy model policy functions differ from polfunc_inputdict.')
+
+    model['varpath']
+    if model.computecounts['Et_eqs'] != 1 or model.computecounts['polfunc'] != 1 or model.computecounts['sim'] != 1:
+        raise ValueError('Unexpected compute counts: ' + str(model.computecounts) + '.')
+
+    # changing the shocks should not re-solve
+    model['shocksddict'] = {'epsilon_a': 0.02}
+    model['varpath']
+    if model.computecounts['polfunc'] != 1 or model.computecounts['shockpath'] != 2:
+        raise ValueError('Changing the shocks re-solved the model: ' + str(model.computecounts) + '.')
+
+    # changing a parameter should not re-parse or re-differentiate
+    model['paramssdict']['RHO'] = 0.8
+    model['varpath']
+    if model.computecounts['Et_eqs'] != 1 or model.computecounts['jac'] != 1 or model.computecounts['polfunc'] != 2 or model.computecounts['shockpath'] != 2:
+        raise ValueError('Changing a parameter recomputed the wrong nodes: ' + str(model.computecounts) + '.')
+    if not np.isclose(model['hx'][0, 0], 0.8):
+        raise ValueError('hx not updated for new RHO.')
+
+    # changing a parameter which moves the steady state should give the same solution as solving from scratch
+    model['paramssdict']['BETA'] = 0.99
+    inputdict_fresh = polfunc_inputdict(getmodel_inputdict(getinputdict(p = {'RHO': 0.8, 'BETA': 0.99})))
+    if not np.allclose(model['gx'], inputdict_fresh['gx']) or not np.allclose(model['hx'], inputdict_fresh['hx']):
+        raise ValueError('Lazy model policy functions differ from polfunc_inputdict after changing BETA.')
+    if not np.isclose(model['varssdict']['K'], inputdict_fresh['varssdict']['K']):
+        raise ValueError('Lazy model steady state not updated for new BETA.')
+    if model.computecounts['Et_eqs'] != 1 or model.computecounts['jac'] != 1 or model.computecounts['steadystate'] != 3:
+        raise ValueError('Changing BETA recomputed the wrong nodes: ' + str(model.computecounts) + '.')
+
+    # setting an input to an equal value doesn't recompute anything
+    model['varpath']
+    counts = dict(model.computecounts)
+    model.update({'paramssdict': dict(model['paramssdict']), 'pathsimperiods': 50})
+    model['varpath']
+    if model.computecounts != counts:
+        raise ValueError('Setting equal inputs recomputed nodes: ' + str(model.computecounts) + '.')
+
+    # accessing a computed node only compares versions
+    start = time.perf_counter()
+    for i in range(10000):
+        model['varpath']
+    if time.perf_counter() - start > 0.5:
+        raise ValueError('Accessing a computed node is slow: ' + str(time.perf_counter() - start) + 's for 10000 accesses.')
+
+    # the shock path doesn't touch the global random state
+    state = np.random.get_state()[1].copy()
+    model['seed'] = 2
+    model['shockpath']
+    if not np.array_equal(np.random.get_state()[1], state):
+        raise ValueError('Drawing the shock path changed the global random state.')
+
+    print(model.computecounts)
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    lazymodel_test()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Generate RBC models of any size for testing how the codes scale.
+
+There are N sectors. Each sector i has capital K_i, productivity A_i (with its own shock) and consumption C_i.
+Output in each sector uses capital and the output of the sectors it is linked to (an input-output externality):
+Y_i = A_i K_i^ALPHA prod_j Y_j^(GAMMA w_ij)
+where each sector is linked to numlinks other sectors chosen at random and w_ij = 1 / numlinks for the linked sectors. The household takes the links as given so the Euler equation in each sector only uses the private marginal product of capital:
+1 / C_i = BETA / C_i_p (ALPHA Y_i_p / K_i_p + 1 - DELTA)
+C_i + K_i_p = Y_i + (1 - DELTA) K_i
+
+Since the rows of w sum to one, every sector has the same steady state:
+ALPHA Y / K = 1 / BETA - 1 + DELTA
+log(Y) = ALPHA log(ALPHA / (1 / BETA - 1 + DELTA)) / (1 - ALPHA - GAMMA)
+which requires ALPHA + GAMMA < 1.
+
+numlinks controls the sparsity of the Jacobians (each production equation contains numlinks + 2 variables).
+The first numobserved sectors' output is returned in inputdict['observed'].
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import math
+
+import numpy as np
+
+# Parameters:{{{1
+def getparamssdict(p = None):
+    if p is None:
+        p = {}
+    p_defaults = {'ALPHA': 0.3, 'BETA': 0.95, 'DELTA': 0.1, 'RHO': 0.9, 'GAMMA': 0.2}
+    for param in p_defaults:
+        if param not in p:
+            p[param] = p_defaults[param]
+
+    if p['ALPHA'] + p['GAMMA'] >= 1:
+        raise ValueError('Need ALPHA + GAMMA < 1 for the steady state to exist.')
+
+    return(p)
+
+
+def getlinks(numsectors, numlinks, seed = 1):
+    """
+    Return a list where element i is the list of sectors that sector i is linked to.
+    """
+    numlinks = min(numlinks, numsectors - 1)
+    rng = np.random.default_rng(seed)
+
+    links = []
+    for i in range(numsectors):
+        others = [j for j in range(numsectors) if j != i]
+        links.append(sorted([int(j) for j in rng.choice(others, size = numlinks, replace = False)]))
+
+    return(links)
+
+
+def getss(p, numsectors, links):
+    """
+    Steady state of every variable.
+    """
+    R = 1 / p['BETA'] - 1 + p['DELTA']
+
+    v = {}
+    for i in range(numsectors):
+        # the rows of w sum to 1 unless the sector has no links
+        rowsum = 1 if len(links[i]) > 0 else 0
+        Y = math.exp(p['ALPHA'] * math.log(p['ALPHA'] / R) / (1 - p['ALPHA'] - p['GAMMA'] * rowsum))
+        K = p['ALPHA'] * Y / R
+
+        v['Am1_' + str(i)] = 1
+        v['A_' + str(i)] = 1
+        v['Y_' + str(i)] = Y
+        v['K_' + str(i)] = K
+        v['C_' + str(i)] = Y - p['DELTA'] * K
+
+    return(v)
+
+
+# Inputdict:{{{1
+def getinputdict(numsectors = 10, numlinks = 2, numobserved = None, p = None, loglineareqs = True, seed = 1):
+    """
+    numsectors: N
+    numlinks: number of other sectors each sector's production uses
+    numobserved: number of sectors whose output is observed (default all)
+    seed: seed for which sectors are linked
+    """
+    if numobserved is None:
+        numobserved = numsectors
+
+    links = getlinks(numsectors, numlinks, seed = seed)
+
+    inputdict = {}
+    inputdict['states'] = []
+    inputdict['controls'] = []
+    inputdict['shocks'] = []
+    inputdict['equations'] = []
+
+    for i in range(numsectors):
+        s = '_' + str(i)
+        inputdict['states'] = inputdict['states'] + ['Am1' + s, 'K' + s]
+        inputdict['controls'] = inputdict['controls'] + ['C' + s, 'A' + s, 'Y' + s]
+        inputdict['shocks'].append('epsilon' + s)
+
+        if len(links[i]) > 0:
+            w = 1 / len(links[i])
+
+        # euler condition
+        if loglineareqs is True:
+            inputdict['equations'].append('-C' + s + ' = -C' + s + '_p + BETA * ALPHA * Y' + s + '_ss / K' + s + '_ss * (Y' + s + '_p - K' + s + '_p)')
+        else:
+            inputdict['equations'].append('1 / C' + s + ' = BETA / C' + s + '_p * (ALPHA * Y' + s + '_p / K' + s + '_p + 1 - DELTA)')
+
+        # resource condition
+        if loglineareqs is True:
+            inputdict['equations'].append('C' + s + '_ss * C' + s + ' + K' + s + '_ss * K' + s + '_p = Y' + s + '_ss * Y' + s + ' + (1 - DELTA) * K' + s + '_ss * K' + s)
+        else:
+            inputdict['equations'].append('C' + s + ' + K' + s + '_p = Y' + s + ' + (1 - DELTA) * K' + s)
+
+        # production
+        if loglineareqs is True:
+            equation = 'Y' + s + ' = A' + s + ' + ALPHA * K' + s
+            if len(links[i]) > 0:
+                equation = equation + ' + GAMMA * ' + str(w) + ' * (' + ' + '.join(['Y_' + str(j) for j in links[i]]) + ')'
+        else:
+            equation = 'Y' + s + ' = A' + s + ' * K' + s + ' ** ALPHA'
+            for j in links[i]:
+                equation = equation + ' * Y_' + str(j) + ' ** (GAMMA * ' + str(w) + ')'
+        inputdict['equations'].append(equation)
+
+        # productivity process
+        if loglineareqs is True:
+            inputdict['equations'].append('Am1' + s + '_p = RHO * Am1' + s + ' + epsilon' + s)
+        else:
+            inputdict['equations'].append('log(Am1' + s + '_p) = RHO * log(Am1' + s + ') + epsilon' + s)
+        inputdict['equations'].append('A' + s + ' = Am1' + s + '_p')
+
+    inputdict['paramssdict'] = getparamssdict(p)
+    inputdict['varssdict'] = getss(inputdict['paramssdict'], numsectors, links)
+    inputdict['shocksddict'] = {shock: 0.01 for shock in inputdict['shocks']}
+    inputdict['observed'] = ['Y_' + str(i) for i in range(numobserved)]
+    inputdict['links'] = links
+
+    if loglineareqs is True:
+        inputdict['loglineareqs'] = True
+    else:
+        inputdict['logvars'] = True
+
+    return(inputdict)
+
+
+def getnumberentries(inputdict):
+    """
+    Number of nonzero entries in fxe, fxep, fy, fyp compared to the dense size.
+    """
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from sparsediff_func import dsgeanalysisdiff_sparse
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from sparsediff_func import getnumberentries_sparse
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgediff_func import convertstringlisttosympy
+
+    jaclist = dsgeanalysisdiff_sparse(convertstringlisttosympy(inputdict['equations']), inputdict['states'] + inputdict['shocks'], inputdict['controls'])
+    return(getnumberentries_sparse(jaclist))
+
+
+# State Space:{{{1
+def getABCD(inputdict, measurementerror = 0.001):
+    """
+    State space form for the observed variables given a solved model (with hx, gx in terms of z = [states; shocks]):
+    z_t = A z_{t-1} + B u_t
+    y_t = C z_t + D u_t
+    where u_t = [epsilon_t; measurement error_t].
+    This is the same form as addABCD in bayes/model_func.py.
+    """
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from moments_func import getstatespace_inputdict
+    statespace = getstatespace_inputdict(inputdict)
+
+    hx = statespace['hx']
+    eta = statespace['eta']
+    varpos = {statespace['varnames'][i]: i for i in range(len(statespace['varnames']))}
+    M_obs = statespace['M'][[varpos[var] for var in inputdict['observed']], :]
+
+    numobs = len(inputdict['observed'])
+    numshocks = np.shape(eta)[1]
+
+    A = hx
+    B = np.concatenate((eta, np.zeros([np.shape(hx)[0], numobs])), axis = 1)
+    C = M_obs
+    D = np.concatenate((np.zeros([numobs, numshocks]), measurementerror * np.eye(numobs)), axis = 1)
+
+    return(A, B, C, D)
+
+
+# Checks:{{{1
+def check(numsectors = 5, numlinks = 2):
+    """
+    Check the log-linearized and log models are the same.
+    """
+    inputdict_loglin = getinputdict(numsectors = numsectors, numlinks = numlinks, loglineareqs = True)
+    inputdict_log = getinputdict(numsectors = numsectors, numlinks = numlinks, loglineareqs = False)
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgediff_func import checksame_inputdict
+    checksame_inputdict(inputdict_loglin, inputdict_log)
+
+
+def check_lazy(numsectors = 5, numlinks = 2):
+    """
+    Same check using the lazy model (so it doesn't need checksame_inputdict).
+    Also checks the solution is determinate.
+    """
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from lazymodel_func import getlazymodel
+
+    model_loglin = getlazymodel(getinputdict(numsectors = numsectors, numlinks = numlinks, loglineareqs = True))
+    model_log = getlazymodel(getinputdict(numsectors = numsectors, numlinks = numlinks, loglineareqs = False))
+
+    if not np.allclose(model_loglin['gx'], model_log['gx']) or not np.allclose(model_loglin['hx'], model_log['hx']):
+        raise ValueError('Log-linearized and log models give different policy functions.')
+
+    print('Nonzero entries, dense entries: ' + str(getnumberentries(model_loglin.inputs)))
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    check_lazy()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Time each step for synthetic models of increasing size (see synthetic_func.py) and save the scaling curves as JSON.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import copy
+
+import numpy as np
+
+numsectorslist_default = [2, 5, 10, 20, 40]
+
+def getsteps(inputdict, seed = 1):
+    """
+    Return a dict of step name -> function with no arguments for one model.
+    The work that each step depends on is done here so only the step itself is timed.
+    The Kalman filter step is added last so if the statespace submodule is missing the other steps are still returned.
+    """
+    steps = {}
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgesetup_func import getmodel_inputdict
+    steps['getmodel_inputdict'] = lambda: getmodel_inputdict(copy.deepcopy(inputdict))
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgediff_func import convertstringlisttosympy
+    Et_eqs = convertstringlisttosympy(inputdict['equations'])
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgediff_func import dsgeanalysisdiff
+    steps['dsgeanalysisdiff'] = lambda: dsgeanalysisdiff(Et_eqs, inputdict['states'] + inputdict['shocks'], inputdict['controls'])
+    sys.path.append(str(__projectdir__ / Path('dsgediff')))
+    from sparsediff_func import dsgeanalysisdiff_sparse
+    steps['dsgeanalysisdiff_sparse'] = lambda: dsgeanalysisdiff_sparse(Et_eqs, inputdict['states'] + inputdict['shocks'], inputdict['controls'])
+
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from lazymodel_func import getlazymodel
+    model = getlazymodel(copy.deepcopy(inputdict))
+    jac_f = model['jac_f']
+    args = [model['numdict'][name] for name in model['jac_argnames']]
+    steps['jacobian'] = lambda: jac_f(*args, dense = True)
+
+    nfxe, nfxep, nfy, nfyp = [model[name] for name in ['nfxe', 'nfxep', 'nfy', 'nfyp']]
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsge_bkdiscrete_func import gxhx
+    steps['gxhx'] = lambda: gxhx(nfxe, nfxep, nfy, nfyp)
+
+    model['pathsimperiods'] = 1000
+    model['seed'] = seed
+    model['shockpath']
+    def sim():
+        model.invalidate('sim')
+        return(model['varpath'])
+    steps['simpathlinear'] = sim
+
+    solved = dict(inputdict)
+    solved['gx'] = model['gx']
+    solved['hx'] = model['hx']
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from synthetic_func import getABCD
+    A, B, C, D = getABCD(solved)
+    try:
+        sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/statespace')))
+        from statespace_func import statespace_simdata
+    except ImportError:
+        print('statespace_func not available so not timing the Kalman filter.')
+        return(steps)
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/statespace')))
+    from statespace_func import kalmanfilter
+    sys.path.append(str(__projectdir__ / Path('submodules/python-math-func/statespace')))
+    from statespace_func import logl_prop_kalmanfilter
+    X, y, v = statespace_simdata(A, B, C, D, 160)
+    def kalman():
+        x_t_tm1, P_t_tm1, x_t_t, P_t_t, y_t_tm1, Q_t_tm1, R_t_tm1 = kalmanfilter(y, A, B, C, D)
+        return(logl_prop_kalmanfilter(y, y_t_tm1, Q_t_tm1))
+    steps['kalman_T160'] = kalman
+
+    return(steps)
+
+
+def scaling(numsectorslist = None, numlinks = 2, numrepeats = 3, savefile = None, printdetails = True):
+    """
+    Time every step for each number of sectors. Returns a dict of step -> list of median times (None if the step failed).
+    """
+    import traceback
+
+    if numsectorslist is None:
+        numsectorslist = numsectorslist_default
+
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from synthetic_func import getinputdict
+    sys.path.append(str(__projectdir__ / Path('benchmarks')))
+    from benchmark_func import timefunction
+
+    results = {'numsectors': list(numsectorslist), 'numvariables': [], 'times': {}}
+    for numsectors in numsectorslist:
+        np.random.seed(1)
+        inputdict = getinputdict(numsectors = numsectors, numlinks = numlinks)
+        results['numvariables'].append(len(inputdict['states']) + len(inputdict['controls']) + len(inputdict['shocks']))
+
+        try:
+            steps = getsteps(inputdict)
+        except Exception:
+            if printdetails is True:
+                print(traceback.format_exc())
+            steps = {}
+
+        for step in steps:
+            if step not in results['times']:
+                results['times'][step] = [None] * numsectorslist.index(numsectors)
+            try:
+                results['times'][step].append(timefunction(steps[step], numrepeats = numrepeats)['median'])
+            except Exception as e:
+                results['times'][step].append(None)
+                if printdetails is True:
+                    print('N = ' + str(numsectors) + ', ' + step + ' failed: ' + repr(e))
+
+        if printdetails is True:
+            print('N = ' + str(numsectors) + ': ' + ', '.join([step + ' ' + str(results['times'][step][-1]) for step in results['times']]))
+
+    if savefile is not None:
+        sys.path.append(str(__projectdir__ / Path('benchmarks')))
+        from benchmark_func import savebenchmarks
+        savebenchmarks(results, savefile)
+
+    return(results)
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    scaling(savefile = __projectdir__ / Path('dsgesetup/temp/synthetic_scaling.json'))
@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""
+Read a Dynare .mod file directly into an inputdict in the _p format used by the rest of the project.
+
+Supported:
+- var, varexo, parameters declarations (tex names and long_name options are ignored)
+- parameter assignments (ALPHA = 0.3;) which can use earlier parameters
+- model; ... end; including model(linear), equation tags and # model-local variables (which are inlined)
+- steady_state_model; ... end; (or initval; ... end; if there is no steady_state_model)
+- shocks; var e; stderr 0.01; var e = 0.0001; end;
+Other commands (stoch_simul etc.) are kept as text in inputdict['dynarecommands']. Macro directives (@#) are not supported.
+
+Timing:
+Every endogenous variable is a control. Lags and leads become auxiliary variables in the same way as Dynare:
+- v(-1) becomes the state v_m1 with v_m1_p = v, v(-2) becomes v_m2 with v_m2_p = v_m1 etc.
+- v(+1) becomes v_p
+- v(+2) becomes v_l1_p with the control v_l1 = v_p, v(+3) becomes v_l2_p with v_l2 = v_l1_p etc.
+- lags of shocks e(-1) become states e_m1 with e_m1_p = e
+So the states are just the lagged variables.
+
+The file is tokenized with one regular expression and then parsed in one pass so the time is linear in the length of the file.
+Parsed files are cached in memory (and on disk if cachefolder is given) by the hash of their contents so reading the same file again is immediate.
+"""
+import os
+from pathlib import Path
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import copy
+import re
+
+# in-memory cache of parsed files: hash -> inputdict
+modcache = {}
+
+tokenregex = re.compile(r'''
+(?P<space>\s+)
+|(?P<comment>//[^\n]*|%[^\n]*|/\*.*?\*/)
+|(?P<macro>@\#[^\n]*)
+|(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+|(?P<name>[A-Za-z_]\w*)
+|(?P<string>'[^']*'|"[^"]*")
+|(?P<tex>\$[^$]*\$)
+|(?P<op>\*\*|\^|[-+*/=(),;:\#\[\]<>!&|.{}])
+''', re.VERBOSE | re.DOTALL)
+
+# Tokenizer:{{{1
+def tokenize(text):
+    """
+    Return a list of (kind, text, line number).
+    """
+    tokens = []
+    line = 1
+    pos = 0
+    for match in tokenregex.finditer(text):
+        if match.start() != pos:
+            raise ValueError('Line ' + str(line) + ': cannot parse ' + repr(text[pos: match.start()]) + '.')
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == 'macro':
+            raise ValueError('Line ' + str(line) + ': macro directives are not supported.')
+        if kind != 'space' and kind != 'comment':
+            tokens.append((kind, match.group(), line))
+        line = line + match.group().count('\n')
+    if pos != len(text):
+        raise ValueError('Line ' + str(line) + ': cannot parse ' + repr(text[pos: pos + 20]) + '.')
+    return(tokens)
+
+
+def splitstatements(tokens, start):
+    """
+    Split tokens from start into statements ending in ;. Stops after a statement which is just end.
+    Returns the list of statements (without the ;) and the position after the end statement.
+    """
+    statements = []
+    current = []
+    i = start
+    while i < len(tokens):
+        if tokens[i][1] == ';':
+            if len(current) == 1 and current[0][1] == 'end':
+                return(statements, i + 1)
+            statements.append(current)
+            current = []
+        else:
+            current.append(tokens[i])
+        i = i + 1
+    raise ValueError('Block starting on line ' + str(tokens[start - 1][2]) + ' has no end.')
+
+
+# Parser:{{{1
+class ModParser(object):
+    """
+    State while parsing one file.
+    """
+    def __init__(self):
+        self.endogenous = []
+        self.exogenous = []
+        self.parameters = []
+        self.endogenousset = set()
+        self.exogenousset = set()
+        self.parametersset = set()
+        self.paramssdict = {}
+        self.ssdict = {}
+        self.initvaldict = {}
+        self.shocksddict = {}
+        self.localdict = {}
+        self.equations = []
+        self.maxlag = {}
+        self.maxlead = {}
+        self.linear = False
+        self.commands = []
+
+    def gettiming(self, tokens, i):
+        """
+        tokens[i] is a variable and tokens[i + 1] is (. Return the integer timing and the position after the ).
+        """
+        j = i + 2
+        sign = 1
+        if j < len(tokens) and tokens[j][1] in ['+', '-']:
+            sign = -1 if tokens[j][1] == '-' else 1
+            j = j + 1
+        if j + 1 < len(tokens) and tokens[j][0] == 'number' and tokens[j + 1][1] == ')':
+            return(sign * int(tokens[j][1]), j + 2)
+        raise ValueError('Line ' + str(tokens[i][2]) + ': cannot read the timing of ' + tokens[i][1] + '.')
+
+    def timedname(self, name, timing, line):
+        """
+        The name of variable name at timing in the _p format. Records which auxiliary variables are needed.
+        """
+        if timing == 0:
+            return(name)
+        if name in self.exogenousset:
+            if timing > 0:
+                raise ValueError('Line ' + str(line) + ': leads of shocks are not supported (' + name + ').')
+            self.maxlag[name] = max(self.maxlag.get(name, 0), -timing)
+            return(name + '_m' + str(-timing))
+        if timing < 0:
+            self.maxlag[name] = max(self.maxlag.get(name, 0), -timing)
+            return(name + '_m' + str(-timing))
+        if timing == 1:
+            return(name + '_p')
+        self.maxlead[name] = max(self.maxlead.get(name, 0), timing)
+        return(name + '_l' + str(timing - 1) + '_p')
+
+    def render(self, tokens, timing = True):
+        """
+        Convert the tokens of an expression into a string in the project format.
+        timing: allow variables with timing (in the model block). Otherwise variables with timing raise an error.
+        """
+        output = []
+        i = 0
+        while i < len(tokens):
+            kind, text, line = tokens[i]
+            if kind == 'name' and (text in self.endogenousset or text in self.exogenousset):
+                if i + 1 < len(tokens) and tokens[i + 1][1] == '(':
+                    if timing is False:
+                        raise ValueError('Line ' + str(line) + ': variables with timing are only allowed in the model block.')
+                    t, i = self.gettiming(tokens, i)
+                    output.append(self.timedname(text, t, line))
+                    continue
+                output.append(text)
+            elif kind == 'name' and text in self.localdict:
+                output.append('(' + self.localdict[text] + ')')
+            elif text == '^':
+                output.append(' ** ')
+            elif kind == 'op' and text in ['=', '+', '-', '*', '/', '**', '<', '>']:
+                output.append(' ' + text + ' ')
+            else:
+                output.append(text)
+            i = i + 1
+        return(''.join(output).strip())
+
+    def evaluate(self, tokens, namespace):
+        import math
+
+        expr = self.render(tokens, timing = False)
+        evalnamespace = {'log': math.log, 'exp': math.exp, 'sqrt': math.sqrt, 'abs': abs, 'min': min, 'max': max, 'pi': math.pi, 'inf': math.inf}
+        evalnamespace.update(namespace)
+        try:
+            return(eval(expr, {'__builtins__': {}}, evalnamespace))
+        except Exception as e:
+            raise ValueError('Line ' + str(tokens[0][2]) + ': cannot evaluate ' + expr + ' (' + repr(e) + ').')
+
+    # blocks
+    def declaration(self, statement, names, nameset):
+        """
+        var, varexo, parameters. Skips tex names and (long_name = ...) options.
+        """
+        depth = 0
+        for kind, text, line in statement[1: ]:
+            if text == '(':
+                depth = depth + 1
+            elif text == ')':
+                depth = depth - 1
+            elif depth == 0 and kind == 'name':
+                if text in self.endogenousset or text in self.exogenousset or text in self.parametersset:
+                    raise ValueError('Line ' + str(line) + ': ' + text + ' is declared twice.')
+                names.append(text)
+                nameset.add(text)
+
+    def modelblock(self, statements):
+        for statement in statements:
+            if len(statement) == 0:
+                continue
+            # equation tags
+            if statement[0][1] == '[':
+                end = [i for i in range(len(statement)) if statement[i][1] == ']'][0]
+                statement = statement[end + 1: ]
+            if statement[0][1] == '#':
+                if len(statement) < 4 or statement[2][1] != '=':
+                    raise ValueError('Line ' + str(statement[0][2]) + ': cannot read model-local variable.')
+                self.localdict[statement[1][1]] = self.render(statement[3: ])
+                continue
+            self.equations.append(self.render(statement))
+
+    def assignmentblock(self, statements, outputdict, namespace):
+        """
+        steady_state_model, initval: name = expression; evaluated in order.
+        """
+        for statement in statements:
+            if len(statement) < 3 or statement[1][1] != '=':
+                raise ValueError('Line ' + str(statement[0][2]) + ': only name = expression is supported here.')
+            outputdict[statement[0][1]] = self.evaluate(statement[2: ], dict(namespace, **outputdict))
+
+    def shocksblock(self, statements):
+        import math
+
+        shock = None
+        for statement in statements:
+            if statement[0][1] == 'var':
+                if len(statement) > 3 and statement[2][1] == '=':
+                    # var e = variance
+                    self.shocksddict[statement[1][1]] = math.sqrt(self.evaluate(statement[3: ], self.paramssdict))
+                    shock = None
+                elif len(statement) == 2:
+                    shock = statement[1][1]
+                else:
+                    # covariances are not supported so keep as a command
+                    self.commands.append('shocks: ' + ' '.join([token[1] for token in statement]))
+            elif statement[0][1] == 'stderr' and shock is not None:
+                self.shocksddict[shock] = self.evaluate(statement[1: ], self.paramssdict)
+            else:
+                # deterministic shocks (periods, values) and corr
+                self.commands.append('shocks: ' + ' '.join([token[1] for token in statement]))
+
+    def parse(self, tokens):
+        i = 0
+        while i < len(tokens):
+            kind, text, line = tokens[i]
+            if text == ';':
+                i = i + 1
+                continue
+
+            # blocks ending in end;
+            if kind == 'name' and text in ['model', 'steady_state_model', 'initval', 'endval', 'histval', 'shocks']:
+                j = i + 1
+                if tokens[j][1] == '(':
+                    while tokens[j][1] != ')':
+                        if tokens[j][1] == 'linear':
+                            self.linear = True
+                        j = j + 1
+                    j = j + 1
+                if tokens[j][1] == ';':
+                    statements, i = splitstatements(tokens, j + 1)
+                    if text == 'model':
+                        self.modelblock(statements)
+                    elif text == 'steady_state_model':
+                        self.assignmentblock(statements, self.ssdict, self.paramssdict)
+                    elif text == 'initval':
+                        self.assignmentblock(statements, self.initvaldict, self.paramssdict)
+                    elif text == 'shocks':
+                        self.shocksblock(statements)
+                    else:
+                        self.commands.append(text + ' block')
+                    continue
+
+            # other statements
+            j = i
+            while j < len(tokens) and tokens[j][1] != ';':
+                j = j + 1
+            statement = tokens[i: j]
+            i = j + 1
+
+            if text == 'var':
+                self.declaration(statement, self.endogenous, self.endogenousset)
+            elif text == 'varexo':
+                self.declaration(statement, self.exogenous, self.exogenousset)
+            elif text == 'parameters':
+                self.declaration(statement, self.parameters, self.parametersset)
+            elif kind == 'name' and text in self.parametersset and len(statement) > 2 and statement[1][1] == '=':
+                self.paramssdict[text] = self.evaluate(statement[2: ], self.paramssdict)
+            else:
+                self.commands.append(' '.join([token[1] for token in statement]))
+
+    # inputdict
+    def getinputdict(self, logvars = False):
+        allnames = self.endogenousset | self.exogenousset | self.parametersset
+
+        states = []
+        controls = list(self.endogenous)
+        equations = list(self.equations)
+        auxss = {}
+
+        def addaux(auxname, var):
+            if auxname in allnames:
+                raise ValueError('Auxiliary variable ' + auxname + ' has the same name as a declared variable.')
+            auxss[auxname] = var
+
+        # go through variables in declaration order so the order of the states is predictable
+        for var in self.endogenous + self.exogenous:
+            for lag in range(1, self.maxlag.get(var, 0) + 1):
+                auxname = var + '_m' + str(lag)
+                addaux(auxname, var)
+                states.append(auxname)
+                previous = var if lag == 1 else var + '_m' + str(lag - 1)
+                equations.append(auxname + '_p = ' + previous)
+            for lead in range(1, self.maxlead.get(var, 0)):
+                auxname = var + '_l' + str(lead)
+                addaux(auxname, var)
+                controls.append(auxname)
+                previous = var + '_p' if lead == 1 else var + '_l' + str(lead - 1) + '_p'
+                equations.append(auxname + ' = ' + previous)
+
+        # steady state
+        ssdict = self.ssdict if len(self.ssdict) > 0 else self.initvaldict
+        varssdict = {}
+        for var in self.endogenous:
+            if var in ssdict:
+                varssdict[var] = ssdict[var]
+        for auxname in auxss:
+            if auxss[auxname] in self.exogenousset:
+                varssdict[auxname] = 0
+            elif auxss[auxname] in varssdict:
+                varssdict[auxname] = varssdict[auxss[auxname]]
+
+        inputdict = {}
+        inputdict['equations'] = equations
+        inputdict['states'] = states
+        inputdict['controls'] = controls
+        inputdict['shocks'] = list(self.exogenous)
+        inputdict['paramssdict'] = dict(self.paramssdict)
+        inputdict['varssdict'] = varssdict
+        inputdict['shocksddict'] = dict(self.shocksddict)
+        inputdict['dynarevariables'] = list(self.endogenous)
+        inputdict['dynarecommands'] = list(self.commands)
+        if self.linear is True:
+            inputdict['loglineareqs'] = True
+        elif logvars is True:
+            inputdict['logvars'] = [var for var in states + controls if auxss.get(var, var) in self.endogenousset]
+
+        return(inputdict)
+
+
+# Interface:{{{1
+def getinputdict_modtext(text, logvars = False):
+    """
+    Parse the text of a .mod file.
+    logvars: if True, linearize the model in logs of the endogenous variables (ignored for model(linear))
+    """
+    parser = ModParser()
+    parser.parse(tokenize(text))
+    return(parser.getinputdict(logvars = logvars))
+
+
+def getinputdict_mod(filename, logvars = False, cachefolder = None, usecache = True):
+    """
+    Parse a .mod file with caching.
+    cachefolder: if specified, parsed files are also saved here as pickles so the cache persists between runs
+    The inputdict returned is a copy so it can be changed without affecting the cache.
+    """
+    import hashlib
+    import pickle
+
+    with open(filename) as f:
+        text = f.read()
+    key = hashlib.sha256((text + '\n' + str(logvars)).encode('utf-8')).hexdigest()
+
+    if usecache is True:
+        if key in modcache:
+            return(copy.deepcopy(modcache[key]))
+        if cachefolder is not None and os.path.isfile(os.path.join(cachefolder, key + '.pickle')):
+            with open(os.path.join(cachefolder, key + '.pickle'), 'rb') as f:
+                modcache[key] = pickle.load(f)
+            return(copy.deepcopy(modcache[key]))
+
+    inputdict = getinputdict_modtext(text, logvars = logvars)
+
+    if usecache is True:
+        modcache[key] = inputdict
+        if cachefolder is not None:
+            if not os.path.isdir(cachefolder):
+                os.makedirs(cachefolder)
+            picklefile = os.path.join(cachefolder, key + '.pickle')
+            with open(picklefile + '_temp', 'wb') as f:
+                pickle.dump(inputdict, f)
+            os.replace(picklefile + '_temp', picklefile)
+        inputdict = copy.deepcopy(inputdict)
+
+    return(inputdict)
+
+
+# Test:{{{1
+rbc_mod = '''
+// RBC model from fromdynareformat.py with a model-local variable
+var c k a;
+varexo epsilon_a;
+parameters ALPHA $\\alpha$ BETA DELTA RHO (long_name = 'persistence');
+
+ALPHA = 0.3;
+BETA = 0.95;
+DELTA = 0.1;
+RHO = 0.9;
+
+model;
+# R = ALPHA * a(+1) * k ^ (ALPHA - 1) + 1 - DELTA;
+[name = 'euler']
+1 / c = BETA / c(+1) * R;
+c + k = a * k(-1) ^ ALPHA + (1 - DELTA) * k(-1);
+log(a) = RHO * log(a(-1)) + epsilon_a;
+end;
+
+steady_state_model;
+a = 1;
+k = ((ALPHA * a) / (1 / BETA - 1 + DELTA)) ^ (1 / (1 - ALPHA));
+c = a * k ^ ALPHA - DELTA * k;
+end;
+
+shocks;
+var epsilon_a; stderr 0.01;
+end;
+
+stoch_simul(order = 1, irf = 40);
+'''
+
+
+def getlargemodtext(numblocks = 200):
+    """
+    A .mod file with 3 * numblocks equations with lags, leads and model-local variables for timing.
+    """
+    lines = []
+    lines.append('var ' + ' '.join(['x' + str(i) + ' y' + str(i) + ' w' + str(i) for i in range(numblocks)]) + ';')
+    lines.append('varexo ' + ' '.join(['e' + str(i) for i in range(numblocks)]) + ';')
+    lines.append('parameters RHO BETA;')
+    lines.append('RHO = 0.5;')
+    lines.append('BETA = 0.9;')
+    lines.append('model;')
+    for i in range(numblocks):
+        s = str(i)
+        lines.append('# g' + s + ' = RHO ^ 2 * x' + s + '(-2);')
+        lines.append('x' + s + ' = RHO * x' + s + '(-1) + 0.1 * g' + s + ' + e' + s + ';')
+        lines.append('y' + s + ' = BETA * y' + s + '(+2) + x' + s + ';')
+        lines.append('w' + s + ' = 0.5 * y' + s + '(+1) + 0.2 * e' + s + '(-1);')
+    lines.append('end;')
+    return('\n'.join(lines) + '\n')
+
+
+def modparser_test():
+    import tempfile
+    import time
+
+    import sympy
+
+    inputdict = getinputdict_modtext(rbc_mod)
+    if inputdict['states'] != ['k_m1', 'a_m1'] or inputdict['controls'] != ['c', 'k', 'a'] or inputdict['shocks'] != ['epsilon_a']:
+        raise ValueError('Wrong variables: ' + str(inputdict['states']) + ', ' + str(inputdict['controls']) + '.')
+    if inputdict['shocksddict'] != {'epsilon_a': 0.01} or inputdict['dynarecommands'] != ['stoch_simul ( order = 1 , irf = 40 )']:
+        raise ValueError('Wrong shocks or commands.')
+
+    # the equations hold at the steady state
+    replacedict = {}
+    for var in inputdict['states'] + inputdict['controls']:
+        replacedict[sympy.Symbol(var)] = inputdict['varssdict'][var]
+        replacedict[sympy.Symbol(var + '_p')] = inputdict['varssdict'][var]
+    for param in inputdict['paramssdict']:
+        replacedict[sympy.Symbol(param)] = inputdict['paramssdict'][param]
+    replacedict[sympy.Symbol('epsilon_a')] = 0
+    for equation in inputdict['equations']:
+        lhs, rhs = equation.split('=')
+        if abs(float((sympy.sympify(lhs) - sympy.sympify(rhs)).xreplace(replacedict))) > 1e-10:
+            raise ValueError('Equation does not hold at the steady state: ' + equation + '.')
+
+    # auxiliary variables for longer lags and leads
+    inputdict = getinputdict_modtext(getlargemodtext(numblocks = 1))
+    if inputdict['states'] != ['x0_m1', 'x0_m2', 'e0_m1'] or inputdict['controls'] != ['x0', 'y0', 'w0', 'y0_l1']:
+        raise ValueError('Wrong auxiliary variables: ' + str(inputdict['states']) + ', ' + str(inputdict['controls']) + '.')
+    if 'y0 = BETA * y0_l1_p + x0' not in inputdict['equations'] or 'x0 = RHO * x0_m1 + 0.1 * (RHO ** 2 * x0_m2) + e0' not in inputdict['equations'] or 'x0_m2_p = x0_m1' not in inputdict['equations']:
+        raise ValueError('Wrong equations: ' + str(inputdict['equations']) + '.')
+
+    # timing and caching with a large file
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, 'large.mod')
+        with open(filename, 'w') as f:
+            f.write(getlargemodtext(numblocks = 300))
+
+        start = time.perf_counter()
+        inputdict = getinputdict_mod(filename, cachefolder = tempdir)
+        parsetime = time.perf_counter() - start
+        if len(inputdict['equations']) != 300 * 3 + 300 * 4:
+            raise ValueError('Wrong number of equations in the large model.')
+
+        # from the memory cache and then the disk cache
+        inputdict['equations'] = []
+        start = time.perf_counter()
+        inputdict = getinputdict_mod(filename, cachefolder = tempdir)
+        cachetime = time.perf_counter() - start
+        modcache.clear()
+        inputdict2 = getinputdict_mod(filename, cachefolder = tempdir)
+        if len(inputdict['equations']) != 2100 or inputdict2 != inputdict:
+            raise ValueError('Cache returned the wrong inputdict.')
+
+    print('Parse time for 900 equations: ' + str(parsetime) + 's. From cache: ' + str(cachetime) + 's.')
+    if parsetime > 1:
+        raise ValueError('Parsing the large model took more than a second.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    modparser_test()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Run stoch_simul for the RBC model over several values of DELTA using a pool of Octave sessions.
+If run = True, need to specify dynarepath (the matlab folder of Dynare).
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+def batchstochsimul(run = True, dynarepath = None, numworkers = 2):
+    
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+
+    plist = [{'DELTA': DELTA} for DELTA in [0.05, 0.1, 0.15, 0.2]]
+    savefolderroot = __projectdir__ / Path('python2dynare/temp/batch_stochsimul/')
+
+    # get inputdicts and write all .mod files
+    sys.path.append(str(__projectdir__ / Path('python2dynare')))
+    from batchdynare_func import getinputdictlist_params
+    inputdictlist = getinputdictlist_params(getinputdict, plist, 'stoch_simul(order=1);', savefolderroot, shocksddict = {'epsilon_a': 0.01})
+
+    sys.path.append(str(__projectdir__ / Path('python2dynare')))
+    from batchdynare_func import writemodfiles_batch
+    joblist = writemodfiles_batch(inputdictlist)
+
+    # run dynare
+    if run is True:
+        sys.path.append(str(__projectdir__ / Path('python2dynare')))
+        from batchdynare_func import rundynare_batch
+        resultlist = rundynare_batch(joblist, numworkers = numworkers, cachefolder = savefolderroot / Path('cache'), dynarepath = dynarepath, printdetails = True)
+
+        for i in range(len(plist)):
+            print('DELTA: ' + str(plist[i]['DELTA']))
+            print(resultlist[i]['irfs'])
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    batchstochsimul(run = True)
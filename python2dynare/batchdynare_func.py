@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Run many Dynare models in one go.
+
+All the .mod files are generated up front using python2dynare_inputdict. They are then run on a pool of Octave sessions which stay open between models so we only pay for starting Octave (and adding Dynare to the path) once per worker rather than once per model.
+If the .mod file for a job is unchanged from a previous run then the results are loaded from the cache instead of rerunning Dynare.
+Results are read from a .mat file saved directly from the Octave workspace (oo_ and M_) rather than by parsing text output.
+
+For testing, octavecommand can be replaced by octavestub.py which mimics the parts of Octave/Dynare that I use here.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import hashlib
+import pickle
+import queue
+import subprocess
+import threading
+
+# Defaults:{{{1
+octavecommand_default = ['octave', '--no-gui', '--quiet', '--no-window-system']
+# printed by the Octave session once a command has finished
+donemarker = '__BATCHDYNARE_DONE__'
+errormarker = '__BATCHDYNARE_ERROR__'
+# name of the .mat file I save oo_ and M_ to after each run
+resultsmatname = 'batchdynare_results.mat'
+
+# Generate .mod Files:{{{1
+def getinputdictlist_params(getinputdict, plist, python2dynare_simulation, savefolderroot, shocksddict = None):
+    """
+    Get a list of inputdicts (with the model added) from a function getinputdict(p = p) and a list of parameter dicts.
+    Each inputdict is given its own savefolder within savefolderroot.
+    """
+    import copy
+
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgesetup_func import getmodel_inputdict
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from getshocks_func import getshocksddict_inputdict
+
+    inputdictlist = []
+    for i in range(len(plist)):
+        inputdict = getinputdict(p = copy.deepcopy(plist[i]))
+        inputdict['savefolder'] = Path(savefolderroot) / Path('job' + str(i))
+
+        inputdict = getmodel_inputdict(inputdict)
+
+        if shocksddict is not None:
+            inputdict['shocksddict'] = copy.deepcopy(shocksddict)
+        inputdict = getshocksddict_inputdict(inputdict)
+
+        inputdict['python2dynare_simulation'] = python2dynare_simulation
+
+        inputdictlist.append(inputdict)
+
+    return(inputdictlist)
+
+
+def getmodfile(savefolder):
+    """
+    Find the .mod file that python2dynare_inputdict wrote to savefolder.
+    """
+    modfiles = sorted(Path(savefolder).glob('*.mod'))
+    if len(modfiles) != 1:
+        raise ValueError('Expected exactly one .mod file in ' + str(savefolder) + '. Found: ' + str(modfiles) + '.')
+    return(modfiles[0])
+
+
+def hashfile(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return(h.hexdigest())
+
+
+def writemodfiles_batch(inputdictlist):
+    """
+    Write the .mod file for every inputdict before running anything.
+    Each inputdict needs its own savefolder.
+
+    Returns a list of jobs. Each job is a dict giving the folder, the .mod file and the hash of the .mod file.
+    The .mod file includes the equations, the parameter values and the simulation command so its hash determines whether a job has changed.
+    """
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from python2dynare_func import python2dynare_inputdict
+
+    savefolders = [str(inputdict['savefolder']) for inputdict in inputdictlist]
+    if len(set(savefolders)) != len(savefolders):
+        raise ValueError('Each inputdict needs a different savefolder.')
+
+    joblist = []
+    for inputdict in inputdictlist:
+        os.makedirs(inputdict['savefolder'], exist_ok = True)
+        python2dynare_inputdict(inputdict)
+
+        job = {}
+        job['savefolder'] = Path(inputdict['savefolder'])
+        job['modfile'] = getmodfile(inputdict['savefolder'])
+        job['modname'] = job['modfile'].stem
+        job['hash'] = hashfile(job['modfile'])
+        joblist.append(job)
+
+    return(joblist)
+
+
+# Octave Sessions:{{{1
+def startoctavesession(octavecommand = None, dynarepath = None):
+    """
+    Start an Octave process which reads commands from stdin.
+    The session is a dict so that it can be passed around like the inputdicts.
+    """
+    if octavecommand is None:
+        octavecommand = octavecommand_default
+
+    process = subprocess.Popen(octavecommand, stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True, bufsize = 1)
+
+    session = {'process': process, 'numcommands': 0}
+
+    if dynarepath is not None:
+        runoctavecommand(session, "addpath('" + str(dynarepath) + "')")
+
+    return(session)
+
+
+def runoctavecommand(session, command):
+    """
+    Run a command in an open Octave session and wait for it to finish.
+    Returns the lines printed by the command. Raises an error if the command failed in Octave.
+    """
+    process = session['process']
+
+    # wrap in try/catch so an error in Dynare doesn't kill the session
+    # print a marker at the end so I know when the command has finished
+    wrapped = 'try; ' + command + '; disp(\'' + donemarker + '\'); catch err; disp([\'' + errormarker + '\' err.message]); end; fflush(stdout);\n'
+    process.stdin.write(wrapped)
+    process.stdin.flush()
+    session['numcommands'] += 1
+
+    output = []
+    while True:
+        line = process.stdout.readline()
+        if line == '':
+            raise ValueError('Octave session exited while running: ' + command + '\nOutput:\n' + ''.join(output))
+        if line.startswith(donemarker):
+            break
+        if line.startswith(errormarker):
+            raise ValueError('Octave error while running: ' + command + '\nError: ' + line[len(errormarker): ].strip() + '\nOutput:\n' + ''.join(output))
+        output.append(line)
+
+    return(output)
+
+
+def closeoctavesession(session, timeout = 10):
+    process = session['process']
+    if process.poll() is None:
+        try:
+            process.stdin.write('exit\n')
+            process.stdin.flush()
+            process.wait(timeout = timeout)
+        except (BrokenPipeError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+
+
+# Reading Results:{{{1
+def matstructtodict(matobj):
+    """
+    Convert the mat_struct objects returned by scipy.io.loadmat into nested dicts.
+    """
+    import numpy as np
+    import scipy.io
+
+    if isinstance(matobj, scipy.io.matlab.mat_struct):
+        return({field: matstructtodict(getattr(matobj, field)) for field in matobj._fieldnames})
+    elif isinstance(matobj, np.ndarray) and matobj.dtype == object:
+        return([matstructtodict(element) for element in matobj])
+    else:
+        return(matobj)
+
+
+def readdynareresults_mat(matfile):
+    """
+    Read the oo_ and M_ structures saved after a Dynare run and return the parts I use.
+    irfs are stored under the same var_shock keys Dynare uses.
+    simulated paths in oo_.endo_simul are returned as a dict by variable name.
+    """
+    import numpy as np
+    import scipy.io
+
+    mat = scipy.io.loadmat(matfile, squeeze_me = True, struct_as_record = False, chars_as_strings = True)
+    oo_ = matstructtodict(mat['oo_'])
+    M_ = matstructtodict(mat['M_'])
+
+    retdict = {}
+    retdict['endo_names'] = [str(name).strip() for name in np.atleast_1d(M_['endo_names'])]
+    retdict['exo_names'] = [str(name).strip() for name in np.atleast_1d(M_['exo_names'])]
+
+    if 'irfs' in oo_ and isinstance(oo_['irfs'], dict):
+        retdict['irfs'] = {name: np.atleast_1d(value) for name, value in oo_['irfs'].items()}
+    else:
+        retdict['irfs'] = {}
+
+    if 'endo_simul' in oo_ and np.size(oo_['endo_simul']) > 0:
+        endo_simul = np.atleast_2d(oo_['endo_simul'])
+        retdict['endo_simul'] = {retdict['endo_names'][i]: endo_simul[i, :] for i in range(len(retdict['endo_names']))}
+
+    # theoretical moments from stoch_simul
+    for name in ['mean', 'var', 'autocorr', 'variance_decomposition', 'steady_state']:
+        if name in oo_:
+            retdict[name] = oo_[name]
+
+    return(retdict)
+
+
+# Cache:{{{1
+def loadcache(cachefolder, hashvalue):
+    cachefile = Path(cachefolder) / Path(hashvalue + '.pkl')
+    if not cachefile.exists():
+        return(None)
+    with open(cachefile, 'rb') as f:
+        results = pickle.load(f)
+    return(results)
+
+
+def savecache(cachefolder, hashvalue, results):
+    """
+    Write to a temporary file and then rename so a crash never leaves a partially written cache file.
+    """
+    os.makedirs(cachefolder, exist_ok = True)
+    cachefile = Path(cachefolder) / Path(hashvalue + '.pkl')
+    tempfile = Path(cachefolder) / Path(hashvalue + '.pkl.tmp' + str(threading.get_ident()))
+    with open(tempfile, 'wb') as f:
+        pickle.dump(results, f)
+    os.replace(tempfile, cachefile)
+
+
+# Running Jobs:{{{1
+def rundynarejob(session, job):
+    """
+    Run one job in an open session and read back the results.
+    """
+    resultsmat = job['savefolder'] / Path(resultsmatname)
+    if resultsmat.exists():
+        os.remove(resultsmat)
+
+    command = "cd('" + str(job['savefolder']) + "'); dynare " + job['modname'] + " noclearall nograph; save('-v7', '" + resultsmatname + "', 'oo_', 'M_')"
+    runoctavecommand(session, command)
+
+    return(readdynareresults_mat(resultsmat))
+
+
+def dynareworker(jobqueue, resultdict, cachefolder, octavecommand, dynarepath, printdetails):
+    """
+    Each worker thread owns one Octave session and keeps taking jobs until the queue is empty.
+    The threads only wait on Octave so the GIL is not an issue.
+    """
+    session = None
+    try:
+        while True:
+            try:
+                jobi, job = jobqueue.get_nowait()
+            except queue.Empty:
+                break
+
+            # start the session lazily so no Octave is started if every job is cached
+            if session is None:
+                session = startoctavesession(octavecommand = octavecommand, dynarepath = dynarepath)
+
+            try:
+                results = rundynarejob(session, job)
+                if cachefolder is not None:
+                    savecache(cachefolder, job['hash'], results)
+                if printdetails is True:
+                    print('Ran job ' + str(jobi) + ': ' + str(job['modfile']))
+            except Exception as e:
+                results = {'error': str(e)}
+                if printdetails is True:
+                    print('Failed job ' + str(jobi) + ': ' + str(job['modfile']) + '. Error: ' + str(e))
+                # the session may not be usable after a failure so start a new one for the next job
+                if session['process'].poll() is not None:
+                    session = None
+
+            resultdict[jobi] = results
+    finally:
+        if session is not None:
+            closeoctavesession(session)
+
+
+def rundynare_batch(joblist, numworkers = None, cachefolder = None, octavecommand = None, dynarepath = None, printdetails = False):
+    """
+    Run a list of jobs from writemodfiles_batch on a pool of Octave sessions.
+    If cachefolder is specified, jobs whose .mod file hash matches a previous run are loaded from the cache rather than rerun.
+
+    Returns a list of results dicts in the same order as joblist. Failed jobs return {'error': message}.
+    """
+    if numworkers is None:
+        numworkers = os.cpu_count()
+
+    resultdict = {}
+    jobqueue = queue.Queue()
+    for jobi, job in enumerate(joblist):
+        results = None
+        if cachefolder is not None:
+            results = loadcache(cachefolder, job['hash'])
+        if results is not None:
+            resultdict[jobi] = results
+            if printdetails is True:
+                print('Cached job ' + str(jobi) + ': ' + str(job['modfile']))
+        else:
+            jobqueue.put((jobi, job))
+
+    numworkers = max(min(numworkers, jobqueue.qsize()), 0)
+    threads = []
+    for i in range(numworkers):
+        thread = threading.Thread(target = dynareworker, args = (jobqueue, resultdict, cachefolder, octavecommand, dynarepath, printdetails))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    resultlist = [resultdict[jobi] for jobi in range(len(joblist))]
+    return(resultlist)
+
+
+def rundynare_batch_inputdict(inputdictlist, numworkers = None, cachefolder = None, octavecommand = None, dynarepath = None, printdetails = False):
+    """
+    Write the .mod files for a list of inputdicts and then run them all.
+    The results for each model are saved to inputdict['dynareresults'].
+    """
+    joblist = writemodfiles_batch(inputdictlist)
+    resultlist = rundynare_batch(joblist, numworkers = numworkers, cachefolder = cachefolder, octavecommand = octavecommand, dynarepath = dynarepath, printdetails = printdetails)
+    for i in range(len(inputdictlist)):
+        inputdictlist[i]['dynareresults'] = resultlist[i]
+
+    return(inputdictlist)
+
+
+# Test:{{{1
+def batchdynare_test():
+    """
+    Run stoch_simul for the RBC model with several values of DELTA using octavestub.py in place of Octave.
+    The second run should be loaded entirely from the cache.
+    """
+    import shutil
+
+    savefolderroot = __projectdir__ / Path('python2dynare/temp/batchdynare_test/')
+    cachefolder = savefolderroot / Path('cache')
+    if os.path.isdir(savefolderroot):
+        shutil.rmtree(savefolderroot)
+
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+    plist = [{'DELTA': DELTA} for DELTA in [0.05, 0.1, 0.15, 0.2]]
+
+    octavecommand = [sys.executable, str(__projectdir__ / Path('python2dynare/octavestub.py'))]
+
+    for runi in range(2):
+        inputdictlist = getinputdictlist_params(getinputdict, plist, 'stoch_simul(order=1);', savefolderroot, shocksddict = {'epsilon_a': 0.01})
+        inputdictlist = rundynare_batch_inputdict(inputdictlist, numworkers = 2, cachefolder = cachefolder, octavecommand = octavecommand, printdetails = True)
+
+        for inputdict in inputdictlist:
+            if 'error' in inputdict['dynareresults']:
+                raise ValueError('Job failed: ' + inputdict['dynareresults']['error'])
+            if len(inputdict['dynareresults']['irfs']) == 0:
+                raise ValueError('No IRFs returned.')
+
+    # no new files should be written to the cache on the second run
+    if len(list(cachefolder.glob('*.pkl'))) != len(plist):
+        raise ValueError('Cache should contain one file per parameter set.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    batchdynare_test()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Stand-in for an Octave session running Dynare. Used to test batchdynare_func.py without Octave or Dynare installed.
+
+Reads the commands sent by batchdynare_func.runoctavecommand from stdin and handles:
+- addpath(...): ignored
+- cd('folder')
+- dynare modname ...: reads the var and varexo declarations from modname.mod and creates fake results
+- save('-v7', 'file', 'oo_', 'M_'): writes the fake results to a .mat file
+- exit
+
+The fake IRFs decay geometrically so they are nonzero but they have nothing to do with the model.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import re
+
+import numpy as np
+
+# Defaults:{{{1
+donemarker = '__BATCHDYNARE_DONE__'
+errormarker = '__BATCHDYNARE_ERROR__'
+irfperiods = 40
+
+# Fake Dynare:{{{1
+def readdeclarations(modfile):
+    """
+    Get the names in the var and varexo blocks of a .mod file.
+    """
+    with open(modfile) as f:
+        text = f.read()
+    # remove comments
+    text = re.sub(r'//[^\n]*', '', text)
+    text = re.sub(r'%[^\n]*', '', text)
+
+    declarations = {}
+    for blockname in ['var', 'varexo']:
+        match = re.search(r'(?:^|;|\n)\s*' + blockname + r'\s+([^;]*);', text)
+        if match is None:
+            declarations[blockname] = []
+        else:
+            declarations[blockname] = re.findall(r'[A-Za-z_]\w*', match.group(1))
+
+    return(declarations)
+
+
+def fakedynare(modfile):
+    declarations = readdeclarations(modfile)
+    endo_names = declarations['var']
+    exo_names = declarations['varexo']
+
+    irfs = {}
+    for i, var in enumerate(endo_names):
+        for j, shock in enumerate(exo_names):
+            irfs[var + '_' + shock] = 0.01 * (i + 1) * 0.9 ** np.arange(irfperiods)
+
+    oo_ = {}
+    oo_['irfs'] = irfs
+    oo_['endo_simul'] = np.zeros([len(endo_names), irfperiods])
+    oo_['steady_state'] = np.zeros(len(endo_names))
+    oo_['var'] = np.eye(len(endo_names))
+
+    M_ = {}
+    M_['endo_names'] = np.array(endo_names, dtype = object)
+    M_['exo_names'] = np.array(exo_names, dtype = object)
+
+    return(oo_, M_)
+
+
+# Command Loop:{{{1
+def runcommand(command, state):
+    # addpath commands need no action here
+
+    cdmatch = re.search(r"cd\('([^']*)'\)", command)
+    if cdmatch is not None:
+        os.chdir(cdmatch.group(1))
+
+    dynarematch = re.search(r'dynare\s+(\w+)', command)
+    if dynarematch is not None:
+        modfile = dynarematch.group(1) + '.mod'
+        if not os.path.isfile(modfile):
+            raise ValueError('modfile ' + modfile + ' not found in ' + os.getcwd())
+        state['oo_'], state['M_'] = fakedynare(modfile)
+        print('Fake Dynare run of ' + modfile)
+
+    savematch = re.search(r"save\('-v7',\s*'([^']*)'", command)
+    if savematch is not None:
+        import scipy.io
+        if 'oo_' not in state:
+            raise ValueError('oo_ not defined')
+        scipy.io.savemat(savematch.group(1), {'oo_': state['oo_'], 'M_': state['M_']})
+
+
+def main():
+    state = {}
+    for line in sys.stdin:
+        line = line.strip()
+        if line == 'exit':
+            break
+        if line == '':
+            continue
+        # strip the try/catch wrapper added by runoctavecommand
+        command = re.sub(r'^try;\s*', '', line)
+        command = command.split("disp('" + donemarker + "')")[0]
+        try:
+            runcommand(command, state)
+            print(donemarker)
+        except Exception as e:
+            print(errormarker + str(e))
+        sys.stdout.flush()
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    main()
@@ -7,9 +7,10 @@ __projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
 
 import numpy as np
 
-def simul(run = False, shockpathspecify = False):
+def simul(run = False, shockpathspecify = False, stream = False):
     """
     If run = True, need to specify inputdict['dynarepath'] and (if you want to use Octave) inputdict['runwithoctave'] = True
+    If stream = True, write the .mod file with streammod_func.py (long shock paths go to a side file).
     """
     
     sys.path.append(str(__projectdir__ / Path('dsgesetup')))
@@ -34,9 +35,14 @@ def simul(run = False, shockpathspecify = False):
 
     # python2dynare
     inputdict['python2dynare_simulation'] = 'simul(periods = 300);'
-    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
-    from python2dynare_func import python2dynare_inputdict
-    python2dynare_inputdict(inputdict)
+    if stream is True:
+        sys.path.append(str(__projectdir__ / Path('python2dynare')))
+        from streammod_func import python2dynare_stream_inputdict
+        python2dynare_stream_inputdict(inputdict)
+    else:
+        sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+        from python2dynare_func import python2dynare_inputdict
+        python2dynare_inputdict(inputdict)
 
     # run dynare
     if run is True:
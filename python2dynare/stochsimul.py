@@ -36,6 +36,69 @@ def stochsimul(run = True):
         rundynare_inputdict(inputdict)
 
 
+def stochsimul_native():
+    """
+    Get the same output as stoch_simul(order=1) without calling Dynare.
+    """
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+    inputdict = getinputdict()
+
+    # add model
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsgesetup_func import getmodel_inputdict
+    inputdict = getmodel_inputdict(inputdict) 
+
+    # add shocksddict
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from getshocks_func import getshocksddict_inputdict
+    inputdict = getshocksddict_inputdict(inputdict)
+
+    # get policy function
+    sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+    from dsge_bkdiscrete_func import polfunc_inputdict
+    inputdict = polfunc_inputdict(inputdict)
+
+    # get moments, variance decomposition and irfs
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from moments_func import stochsimul_inputdict
+    inputdict = stochsimul_inputdict(inputdict)
+
+    print(inputdict['stochsimul']['varnames'])
+    print(inputdict['stochsimul']['std'])
+    print(inputdict['stochsimul']['vardecomp'])
+
+
+def savereference(dynarepath = None):
+    """
+    Run stoch_simul(order=1) in Dynare and save oo_ and M_ as the reference used by moments_func.stochsimul_dynarereference_test.
+    """
+    import shutil
+
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+
+    savefolderroot = __projectdir__ / Path('python2dynare/temp/stochsimul_reference/')
+    sys.path.append(str(__projectdir__ / Path('python2dynare')))
+    from batchdynare_func import getinputdictlist_params
+    inputdictlist = getinputdictlist_params(getinputdict, [{}], 'stoch_simul(order=1);', savefolderroot)
+
+    sys.path.append(str(__projectdir__ / Path('python2dynare')))
+    from batchdynare_func import writemodfiles_batch
+    joblist = writemodfiles_batch(inputdictlist)
+
+    sys.path.append(str(__projectdir__ / Path('python2dynare')))
+    from batchdynare_func import rundynare_batch
+    resultlist = rundynare_batch(joblist, numworkers = 1, dynarepath = dynarepath)
+    if 'error' in resultlist[0]:
+        raise ValueError('Dynare failed: ' + resultlist[0]['error'])
+
+    sys.path.append(str(__projectdir__ / Path('python2dynare')))
+    from batchdynare_func import resultsmatname
+    os.makedirs(__projectdir__ / Path('python2dynare/reference/'), exist_ok = True)
+    shutil.copyfile(joblist[0]['savefolder'] / Path(resultsmatname), __projectdir__ / Path('python2dynare/reference/stochsimul_rbc_results.mat'))
+
+
 # Run:{{{1
 if __name__ == '__main__':
     stochsimul(run = True)
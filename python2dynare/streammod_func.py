@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Write a .mod file for an inputdict block by block rather than building the whole text in memory.
+
+genmodtext is a generator which yields the .mod file in pieces (one declaration, equation or line of shocks at a time) and writestream writes them to the file as they come. Long shock paths are written to a side .csv file which the .mod file loads with csvread and uses in the shocks block (values can be a vector in Dynare) so the .mod file stays small however long the path is.
+
+Both files are written to a temporary file while computing their hash and only replace the existing file if the hash has changed. So the modification times stay the same when nothing changed and batchdynare_func.py can reuse cached results. The hash of the shocks file is written as a comment in the .mod file so the .mod file changes whenever the shocks do.
+
+Timing is converted from the _p format to Dynare: state x becomes x(-1) and x_p becomes x. Control y_p becomes y(+1).
+Steady states written as var_ss in the equations are declared as parameters.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import hashlib
+import re
+
+import numpy as np
+
+modname_default = 'dynarefile.mod'
+shockfilename_default = 'shockpath.csv'
+# shock paths with more periods than this are written to the side file
+inlinemaxperiods_default = 100
+# number of rows of the shock path written at a time
+chunkrows_default = 10000
+
+nameregex = re.compile(r'[A-Za-z_]\w*')
+
+# Streaming Writes:{{{1
+def hashfile(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return(h.hexdigest())
+
+
+def writestream(chunks, filename):
+    """
+    Write the strings from the iterable chunks to filename.
+    The file is only replaced if its contents have changed.
+    Returns whether the file was changed and the hash of its contents.
+    """
+    filename = str(filename)
+    tempfilename = filename + '_temp'
+    h = hashlib.sha256()
+    with open(tempfilename, 'w') as f:
+        for chunk in chunks:
+            h.update(chunk.encode('utf-8'))
+            f.write(chunk)
+    newhash = h.hexdigest()
+
+    if os.path.isfile(filename) and hashfile(filename) == newhash:
+        os.remove(tempfilename)
+        return(False, newhash)
+    os.replace(tempfilename, filename)
+    return(True, newhash)
+
+
+def genshockpathcsv(shockpath, chunkrows = chunkrows_default):
+    """
+    Yield the shock path as csv text chunkrows rows at a time.
+    """
+    import io
+
+    shockpath = np.asarray(shockpath, dtype = float)
+    for start in range(0, np.shape(shockpath)[0], chunkrows):
+        buffer = io.StringIO()
+        np.savetxt(buffer, shockpath[start: start + chunkrows], delimiter = ',', fmt = '%.17g')
+        yield(buffer.getvalue())
+
+
+# Mod Text:{{{1
+def converttiming(equation, states, controls):
+    """
+    Convert an equation from the _p format to Dynare timing.
+    """
+    states = set(states)
+    controls = set(controls)
+
+    def replace(match):
+        name = match.group()
+        if name.endswith('_p'):
+            if name[: -2] in states:
+                return(name[: -2])
+            if name[: -2] in controls:
+                return(name[: -2] + '(+1)')
+        elif name in states:
+            return(name + '(-1)')
+        return(name)
+
+    return(nameregex.sub(replace, equation).replace('**', '^'))
+
+
+def getssparams(inputdict):
+    """
+    Values of the var_ss symbols used in the equations.
+    """
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from secondorder_func import getssdict_inputdict
+    ssdict = getssdict_inputdict(inputdict)
+
+    used = set()
+    for equation in inputdict['equations']:
+        used.update(nameregex.findall(equation))
+    return({var + '_ss': ssdict[var] for var in ssdict if var + '_ss' in used})
+
+
+def genmodtext(inputdict, shockfilename = None, shockfilehash = None):
+    """
+    Yield the .mod file for inputdict in pieces.
+    shockfilename: the name of the side file the shock path has been written to (if None, the shock path is written inline)
+    """
+    states = inputdict['states']
+    controls = inputdict['controls']
+    shocks = inputdict['shocks']
+
+    paramssdict = {param: inputdict['paramssdict'][param] for param in inputdict['paramssdict'] if param not in states + controls and isinstance(inputdict['paramssdict'][param], (int, float, np.floating, np.integer))}
+    paramssdict.update(getssparams(inputdict))
+
+    # declarations
+    yield('var ' + ' '.join(states + controls) + ';\n')
+    if len(shocks) > 0:
+        yield('varexo ' + ' '.join(shocks) + ';\n')
+    if len(paramssdict) > 0:
+        yield('parameters ' + ' '.join(paramssdict) + ';\n')
+    yield('\n')
+    for param in paramssdict:
+        yield(param + ' = ' + repr(float(paramssdict[param])) + ';\n')
+    yield('\n')
+
+    # model
+    if inputdict.get('loglineareqs') is True:
+        yield('model(linear);\n')
+    else:
+        yield('model;\n')
+    for equation in inputdict['equations']:
+        yield(converttiming(equation, states, controls) + ';\n')
+    yield('end;\n\n')
+
+    # steady state
+    if inputdict.get('loglineareqs') is not True:
+        sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+        from secondorder_func import getssdict_inputdict
+        ssdict = getssdict_inputdict(inputdict)
+        yield('initval;\n')
+        for var in states + controls:
+            yield(var + ' = ' + repr(float(ssdict[var])) + ';\n')
+        for shock in shocks:
+            yield(shock + ' = 0;\n')
+        yield('end;\n\n')
+        yield('steady;\n\n')
+
+    # shocks
+    if 'shockpath' in inputdict:
+        shockpath = np.asarray(inputdict['shockpath'], dtype = float)
+        numperiods = np.shape(shockpath)[0]
+        if shockfilename is not None:
+            yield('// shock path file hash: ' + str(shockfilehash) + '\n')
+            yield("shockpath_ = csvread('" + shockfilename + "');\n")
+        yield('shocks;\n')
+        for j in range(len(shocks)):
+            yield('var ' + shocks[j] + ';\n')
+            if shockfilename is not None:
+                yield('periods 1:' + str(numperiods) + ';\n')
+                yield('values (shockpath_(:, ' + str(j + 1) + '));\n')
+            else:
+                periods = [t for t in range(numperiods) if shockpath[t, j] != 0]
+                if len(periods) == 0:
+                    periods = [0]
+                yield('periods ' + ' '.join([str(t + 1) for t in periods]) + ';\n')
+                yield('values ' + ' '.join([repr(float(shockpath[t, j])) for t in periods]) + ';\n')
+        yield('end;\n\n')
+    elif 'shocksddict' in inputdict:
+        yield('shocks;\n')
+        for shock in shocks:
+            yield('var ' + shock + ' = ' + repr(float(inputdict['shocksddict'][shock]) ** 2) + ';\n')
+        yield('end;\n\n')
+
+    if 'python2dynare_simulation' in inputdict:
+        yield(inputdict['python2dynare_simulation'] + '\n')
+
+
+# Interface:{{{1
+def python2dynare_stream_inputdict(inputdict, inlinemaxperiods = inlinemaxperiods_default, chunkrows = chunkrows_default):
+    """
+    Write the .mod file (and the shocks file if needed) to inputdict['savefolder'].
+    Adds inputdict['modfile'] and inputdict['modfile_changed'].
+    """
+    savefolder = Path(inputdict['savefolder'])
+    if not os.path.isdir(savefolder):
+        os.makedirs(savefolder)
+
+    shockfilename = None
+    shockfilehash = None
+    if 'shockpath' in inputdict and np.shape(inputdict['shockpath'])[0] > inlinemaxperiods:
+        shockfilename = shockfilename_default
+        shockchanged, shockfilehash = writestream(genshockpathcsv(inputdict['shockpath'], chunkrows = chunkrows), savefolder / shockfilename)
+
+    inputdict['modfile'] = savefolder / modname_default
+    inputdict['modfile_changed'], modhash = writestream(genmodtext(inputdict, shockfilename = shockfilename, shockfilehash = shockfilehash), inputdict['modfile'])
+
+    return(inputdict)
+
+
+# Test:{{{1
+def streammod_test():
+    import tempfile
+    import time
+    import tracemalloc
+
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+
+    # timing
+    inputdict = getinputdict(loglineareqs = False)
+    text = ''.join(genmodtext(inputdict))
+    if 'K(-1)' not in text or 'C(+1)' not in text or 'K_p' in text:
+        raise ValueError('Timing not converted: ' + text)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        # short shock path is inline
+        inputdict = getinputdict()
+        inputdict['savefolder'] = tempdir
+        inputdict['shockpath'] = np.array([[1, 1, 1] + [0] * 17]).transpose()
+        inputdict['python2dynare_simulation'] = 'simul(periods = 300);'
+        python2dynare_stream_inputdict(inputdict)
+        with open(inputdict['modfile']) as f:
+            text = f.read()
+        if 'periods 1 2 3;' not in text or os.path.isfile(os.path.join(tempdir, shockfilename_default)):
+            raise ValueError('Short shock path should be inline.')
+
+        # rewriting the same content doesn't touch the file
+        python2dynare_stream_inputdict(inputdict)
+        if inputdict['modfile_changed'] is not False:
+            raise ValueError('Unchanged .mod file was rewritten.')
+
+        # long shock path goes to the side file and memory use does not scale with the text of the path
+        inputdict['shockpath'] = np.random.default_rng(1).standard_normal([100000, 1])
+        start = time.perf_counter()
+        python2dynare_stream_inputdict(inputdict)
+        writetime = time.perf_counter() - start
+        inputdict['shockpath'][1, 0] = 5
+        tracemalloc.start()
+        python2dynare_stream_inputdict(inputdict)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with open(inputdict['modfile']) as f:
+            text = f.read()
+        if 'values (shockpath_(:, 1));' not in text or len(text) > 10000:
+            raise ValueError('Long shock path should be in the side file.')
+        shockpath = np.loadtxt(os.path.join(tempdir, shockfilename_default), delimiter = ',')
+        if not np.array_equal(shockpath, inputdict['shockpath'][:, 0]):
+            raise ValueError('Shock path not saved exactly.')
+
+        # changing the shock path changes the .mod file
+        inputdict['shockpath'][0, 0] = 10
+        python2dynare_stream_inputdict(inputdict)
+        if inputdict['modfile_changed'] is not True:
+            raise ValueError('.mod file not changed when the shock path changed.')
+
+    print('Time to write 100000 period shock path: ' + str(writetime) + 's. Peak memory: ' + str(peak / 1e6) + 'MB.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    streammod_test()
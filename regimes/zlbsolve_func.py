@@ -272,4 +272,8 @@ def myoccbin_test(p = None, simshock = False):
     sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
     from myoccbin_func import myoccbin
     myoccbin(inputdict_nozlb, inputdict_zlb, 'Ihat > -log(I_ss)', shockpath, savefolder = os.path.join(__projectdir__, 'regimes/temp/occbin2/'), printdetails = True, printvars = ['Ihat'], irf = True, printprobbind = True, regimeupdatefunc = 'occbin')
-myoccbin_test()
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    myoccbin_test()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Measure how long it takes to import the heavy dependencies and the main modules of this repository.
+Each import is timed in a new process so earlier imports don't affect the result.
+
+The modules of this repository only import numpy at the top and import sympy, scipy, pandas and statsmodels inside the functions which use them. So importing a module costs about the same as importing numpy and the heavy packages are only loaded when a symbolic or data function is called. I also print which heavy packages are loaded by each import to check this.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import subprocess
+
+# folders containing the modules which are timed
+folders = ['bayes', 'dsge_bkdiscrete', 'dsgediff', 'dsgesetup', 'runtime', 'submodules/dsge-perturbation/']
+heavymodules = ['sympy', 'scipy', 'pandas', 'statsmodels']
+
+def importtime(modulename, numrepeats = 3):
+    """
+    Return the minimum time over numrepeats of importing modulename in a new process and the heavy modules which were loaded by the import.
+    """
+    code = 'import sys, time\n'
+    for folder in folders:
+        code = code + 'sys.path.append(' + repr(str(__projectdir__ / Path(folder))) + ')\n'
+    code = code + 'start = time.perf_counter()\nimport ' + modulename + '\nprint(time.perf_counter() - start)\nprint(",".join([name for name in ' + repr(heavymodules) + ' if name in sys.modules]))'
+
+    times = []
+    for i in range(numrepeats):
+        output = subprocess.run([sys.executable, '-c', code], capture_output = True)
+        if output.returncode != 0:
+            return(None, None)
+        lines = output.stdout.decode('utf-8').splitlines()
+        times.append(float(lines[-2]))
+        loaded = [name for name in lines[-1].split(',') if name != '']
+
+    return(min(times), loaded)
+
+
+def importtime_all(modulenames = None, numrepeats = 3):
+    if modulenames is None:
+        modulenames = ['numpy', 'scipy.linalg', 'sympy', 'pandas', 'statsmodels.api', 'numericruntime_func', 'moments_func', 'sparsediff_func', 'lazymodel_func', 'model_func']
+
+    for modulename in modulenames:
+        t, loaded = importtime(modulename, numrepeats = numrepeats)
+        if t is None:
+            print(modulename + ': failed to import')
+        else:
+            print(modulename + ': ' + str(round(t, 3)) + 's. Heavy modules loaded: ' + (', '.join(loaded) if len(loaded) > 0 else 'none'))
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    importtime_all()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Numeric-only runtime for a solved model.
+
+Once a model has been solved, simulating it or computing IRFs only needs hx, gx, the shock standard deviations and the variable names. I save these in a .npz file so they can be loaded and used with NumPy alone, without importing sympy or the dsge-perturbation submodule. This makes scripts that only simulate a cached solution (and pool workers) start much faster.
+
+The solution is written in terms of z = [states; shocks] as in dsge_bkdiscrete/moments_func.py:
+z_{t+1} = hx z_t + eta epsilon_{t+1}
+controls_t = gx z_t
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+# Save and Load:{{{1
+def savesolved(filename, states, shocks, controls, hx, gx, shocksddict = None, varssdict = None):
+    """
+    Save a solved model to a .npz file.
+    shocksddict: standard deviation of each shock (default 1).
+    varssdict: steady state of the variables (only saved for variables which have one).
+    """
+    if shocksddict is None:
+        shocksddict = {}
+    if varssdict is None:
+        varssdict = {}
+
+    ssnames = [var for var in states + controls if var in varssdict]
+
+    arrays = {}
+    arrays['states'] = np.array(states, dtype = str)
+    arrays['shocks'] = np.array(shocks, dtype = str)
+    arrays['controls'] = np.array(controls, dtype = str)
+    arrays['hx'] = np.array(hx, dtype = float)
+    arrays['gx'] = np.array(gx, dtype = float)
+    arrays['shocksds'] = np.array([shocksddict.get(shock, 1) for shock in shocks], dtype = float)
+    arrays['ssnames'] = np.array(ssnames, dtype = str)
+    arrays['ssvalues'] = np.array([varssdict[var] for var in ssnames], dtype = float)
+
+    # write to a temporary file first so a partially written file is never loaded
+    filename = str(filename)
+    if not filename.endswith('.npz'):
+        filename = filename + '.npz'
+    tempfilename = filename[: -4] + '_temp.npz'
+    np.savez(tempfilename, **arrays)
+    os.replace(tempfilename, filename)
+
+
+def savesolved_inputdict(inputdict, filename):
+    """
+    Save from an inputdict that has been through polfunc_inputdict (or a LazyModel).
+    """
+    varssdict = {}
+    if 'varssdict' in inputdict:
+        varssdict.update(inputdict['varssdict'])
+    savesolved(filename, list(inputdict['states']), list(inputdict['shocks']), list(inputdict['controls']), inputdict['hx'], inputdict['gx'], shocksddict = inputdict.get('shocksddict'), varssdict = varssdict)
+
+
+def loadsolved(filename):
+    """
+    Load a solved model saved by savesolved. Only uses NumPy.
+    """
+    data = np.load(filename)
+
+    solved = {}
+    for name in ['states', 'shocks', 'controls', 'ssnames']:
+        solved[name] = [str(var) for var in data[name]]
+    for name in ['hx', 'gx', 'shocksds', 'ssvalues']:
+        solved[name] = np.ascontiguousarray(data[name])
+
+    nx = len(solved['states'])
+    nz = nx + len(solved['shocks'])
+    solved['eta'] = np.zeros([nz, len(solved['shocks'])])
+    for j in range(len(solved['shocks'])):
+        solved['eta'][nx + j, j] = solved['shocksds'][j]
+    solved['M'] = np.concatenate((np.eye(nz), solved['gx']), axis = 0)
+
+    varnames = solved['states'] + solved['shocks'] + solved['controls']
+    solved['varnames'] = varnames
+    solved['stateshockcontrolposdict'] = {varnames[i]: i for i in range(len(varnames))}
+    solved['varssdict'] = {solved['ssnames'][i]: solved['ssvalues'][i] for i in range(len(solved['ssnames']))}
+
+    return(solved)
+
+
+# Simulation:{{{1
+def simulate(solved, shockpath = None, simperiods = None, seed = None):
+    """
+    Simulate the log deviations of every variable (in the order of varnames).
+    shockpath: simperiods x shocks array of shocks (already scaled). If None, draw standard normal shocks scaled by shocksds.
+    """
+    if shockpath is None:
+        rng = np.random.default_rng(seed)
+        shockpath = rng.standard_normal([simperiods, len(solved['shocks'])]) * solved['shocksds']
+    shockpath = np.asarray(shockpath, dtype = float)
+
+    hx = solved['hx']
+    M = solved['M']
+    nx = len(solved['states'])
+
+    z = np.zeros(np.shape(hx)[0])
+    zpath = np.empty([np.shape(shockpath)[0], len(z)])
+    for t in range(np.shape(shockpath)[0]):
+        z = hx @ z
+        z[nx: ] = shockpath[t]
+        zpath[t] = z
+
+    return(zpath @ M.transpose())
+
+
+def getirfs(solved, irfperiods = 40):
+    """
+    Impulse responses to a one standard deviation shock. Returns shocks x irfperiods x variables.
+    """
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from moments_func import getirfs
+    return(getirfs(solved['hx'], solved['M'], solved['eta'], irfperiods = irfperiods))
+
+
+# Test:{{{1
+def numericruntime_test():
+    """
+    Solve rbc_simple, save the solution and check it can be loaded and simulated in a new process without importing sympy.
+    """
+    import subprocess
+    import tempfile
+
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from lazymodel_func import getlazymodel
+    model = getlazymodel(getinputdict())
+    model['shocksddict'] = {'epsilon_a': 0.01}
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, 'rbc_simple.npz')
+        savesolved_inputdict({'states': model['states'], 'shocks': model['shocks'], 'controls': model['controls'], 'hx': model['hx'], 'gx': model['gx'], 'shocksddict': model['shocksddict'], 'varssdict': model['varssdict']}, filename)
+
+        code = 'import sys; sys.path.append(' + repr(str(__projectdir__ / Path('runtime'))) + '); from numericruntime_func import loadsolved, simulate, getirfs; solved = loadsolved(' + repr(filename) + '); varpath = simulate(solved, simperiods = 100, seed = 1); irfs = getirfs(solved); print("sympy" in sys.modules, varpath.shape, irfs.shape)'
+        output = subprocess.check_output([sys.executable, '-c', code]).decode('utf-8').strip()
+
+    print(output)
+    if not output.startswith('False'):
+        raise ValueError('The numeric runtime imported sympy.')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    numericruntime_test()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Named timers and counters for finding where the time goes in an estimation run.
+
+Usage:
+with timer('gxhx'):
+    gx, hx = gxhx(...)
+count('bkfail')
+posteriorfunc = timed('posterior', posteriorfunc)
+
+By default profiling is off. Then timer returns a shared object that does nothing and count returns immediately so the overhead is a function call and a check of one flag.
+Call enable() to start recording. getstats() returns the number of calls, total time, mean, p50 and p99 for each timer and the value of each counter.
+If enable is given a dumpfile, the stats are written to it as JSON at most every dumpinterval seconds so a long run (for example getdists_pool) can be watched while it is running. With a pool, include {pid} in dumpfile so each process writes its own file.
+
+The stats are per process.
+"""
+import os
+from pathlib import Path
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import random
+import time
+
+# maximum number of durations kept for each timer to compute percentiles
+# after this I keep a uniform random sample (reservoir sampling) while the totals stay exact
+maxsamples_default = 10000
+# private generator for reservoir sampling so profiling doesn't change the global random state used by the code being profiled
+samplerng = random.Random()
+
+profilingstate = {'enabled': False, 'timers': {}, 'counters': {}, 'dumpfile': None, 'dumpinterval': 60, 'lastdump': 0, 'maxsamples': maxsamples_default}
+
+# Enable:{{{1
+def enable(dumpfile = None, dumpinterval = 60, maxsamples = maxsamples_default):
+    profilingstate['enabled'] = True
+    profilingstate['dumpfile'] = dumpfile
+    profilingstate['dumpinterval'] = dumpinterval
+    profilingstate['lastdump'] = time.time()
+    profilingstate['maxsamples'] = maxsamples
+
+
+def disable():
+    if profilingstate['dumpfile'] is not None:
+        dumpjson()
+    profilingstate['enabled'] = False
+
+
+def reset():
+    profilingstate['timers'] = {}
+    profilingstate['counters'] = {}
+
+
+def isenabled():
+    return(profilingstate['enabled'])
+
+
+# Recording:{{{1
+class NullTimer(object):
+    """
+    Does nothing. Returned by timer when profiling is off.
+    """
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return(False)
+
+nulltimer = NullTimer()
+
+
+class Timer(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        record(self.name, time.perf_counter() - self.start)
+        return(False)
+
+
+def timer(name):
+    if profilingstate['enabled'] is False:
+        return(nulltimer)
+    return(Timer(name))
+
+
+def record(name, duration):
+    """
+    Add one duration for timer name.
+    """
+    timers = profilingstate['timers']
+    if name not in timers:
+        timers[name] = {'calls': 0, 'total': 0.0, 'samples': []}
+    entry = timers[name]
+    entry['calls'] = entry['calls'] + 1
+    entry['total'] = entry['total'] + duration
+    if len(entry['samples']) < profilingstate['maxsamples']:
+        entry['samples'].append(duration)
+    else:
+        j = samplerng.randrange(entry['calls'])
+        if j < profilingstate['maxsamples']:
+            entry['samples'][j] = duration
+
+    if profilingstate['dumpfile'] is not None and time.time() - profilingstate['lastdump'] > profilingstate['dumpinterval']:
+        dumpjson()
+
+
+def count(name, n = 1):
+    if profilingstate['enabled'] is False:
+        return(None)
+    profilingstate['counters'][name] = profilingstate['counters'].get(name, 0) + n
+
+
+def timed(name, f):
+    """
+    Return a version of f which is timed under name when profiling is on.
+    """
+    import functools
+
+    @functools.wraps(f)
+    def f_timed(*args, **kwargs):
+        if profilingstate['enabled'] is False:
+            return(f(*args, **kwargs))
+        start = time.perf_counter()
+        try:
+            return(f(*args, **kwargs))
+        finally:
+            record(name, time.perf_counter() - start)
+
+    return(f_timed)
+
+
+# Stats:{{{1
+def getstats():
+    import numpy as np
+
+    stats = {'timers': {}, 'counters': dict(profilingstate['counters'])}
+    for name in profilingstate['timers']:
+        entry = profilingstate['timers'][name]
+        samples = np.array(entry['samples'])
+        stats['timers'][name] = {'calls': entry['calls'], 'total': entry['total'], 'mean': entry['total'] / entry['calls'], 'p50': float(np.percentile(samples, 50)), 'p99': float(np.percentile(samples, 99))}
+
+    return(stats)
+
+
+def printstats():
+    stats = getstats()
+    names = sorted(stats['timers'], key = lambda name: -stats['timers'][name]['total'])
+    for name in names:
+        s = stats['timers'][name]
+        print(name + ': calls ' + str(s['calls']) + ', total ' + str(round(s['total'], 4)) + 's, p50 ' + str(round(s['p50'] * 1000, 4)) + 'ms, p99 ' + str(round(s['p99'] * 1000, 4)) + 'ms')
+    for name in sorted(stats['counters']):
+        print(name + ': ' + str(stats['counters'][name]))
+
+
+def dumpjson(filename = None):
+    """
+    Write the stats as JSON. The file is written to a temporary file first so it can be read at any time.
+    """
+    import json
+
+    if filename is None:
+        filename = profilingstate['dumpfile']
+    filename = str(filename).replace('{pid}', str(os.getpid()))
+
+    stats = getstats()
+    stats['time'] = time.time()
+    stats['pid'] = os.getpid()
+
+    with open(filename + '_temp', 'w') as f:
+        json.dump(stats, f, indent = 1, sort_keys = True)
+    os.replace(filename + '_temp', filename)
+
+    profilingstate['lastdump'] = time.time()
+
+
+# Test:{{{1
+def profiling_test():
+    import json
+    import tempfile
+
+    f = timed('sleep', lambda: time.sleep(0.001))
+
+    # nothing recorded when off
+    f()
+    with timer('off'):
+        pass
+    count('off')
+    if len(profilingstate['timers']) > 0 or len(profilingstate['counters']) > 0:
+        raise ValueError('Recorded while profiling was off.')
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        dumpfile = os.path.join(tempdir, 'profile_{pid}.json')
+        enable(dumpfile = dumpfile, dumpinterval = 0)
+        for i in range(20):
+            f()
+            with timer('loop'):
+                count('iterations')
+        disable()
+
+        with open(dumpfile.replace('{pid}', str(os.getpid()))) as fh:
+            stats = json.load(fh)
+
+    if stats['timers']['sleep']['calls'] != 20 or stats['counters']['iterations'] != 20:
+        raise ValueError('Wrong number of calls recorded.')
+    printstats()
+
+    # overhead when off
+    reset()
+    start = time.perf_counter()
+    for i in range(100000):
+        with timer('off'):
+            pass
+    print('Overhead of timer when off: ' + str((time.perf_counter() - start) / 100000 * 1e9) + 'ns')
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    profiling_test()
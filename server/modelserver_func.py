@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""
+A local asyncio server which answers IRF, simulation, moment and likelihood queries for the models in the project.
+
+Notebooks and dashboards send a JSON request over localhost HTTP rather than re-running getmodel_inputdict -> polfunc_inputdict or rebuilding getloglfunc each time.
+The solves run in a process pool. Each worker process keeps the models it has seen warm in memory:
+- the project models are kept as LazyModels (dsgesetup/lazymodel_func.py) so a new parameter value only re-evaluates the Jacobians and re-solves (the equations are parsed and differentiated once per process)
+- the likelihood functions from bayes/model_func.getloglfunc are kept for each set of estimatevars and dataset
+
+The event loop itself never solves anything. It:
+- returns results from an LRU cache keyed by the request
+- coalesces concurrent identical requests so they wait on the same solve rather than each starting one
+
+Endpoints (all POST with a JSON body except GET /health and GET /stats):
+- /irf: {"model": "rbc_simple", "params": {...}, "shocksddict": {...}, "irfperiods": 40}
+- /simulate: the same plus "simperiods" and "seed"
+- /moments: the same plus "nar" and "fevdhorizons" (the stoch_simul outputs from dsge_bkdiscrete/moments_func.py except the IRFs)
+- /likelihood: {"params": [...], "estimatevars": [...], "data": "sim" or a list of observations} for the model in bayes/model_func.py
+
+Start a server with runserver() (or python3 server/modelserver_func.py) and query it with query('/irf', {...}).
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import asyncio
+import collections
+import json
+
+import numpy as np
+
+# Defaults:{{{1
+host_default = '127.0.0.1'
+port_default = 8765
+cachesize_default = 256
+# largest request body accepted (in bytes)
+maxbodysize_default = 1 << 26
+
+# Model Registry:{{{1
+def getinputdict_rbc_simple(p = None):
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+    return(getinputdict(p = p))
+
+
+def getinputdict_nk_simple(p = None):
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from nk_simple import getinputdict
+    return(getinputdict(p = p))
+
+
+def getinputdict_synthetic(p = None):
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from synthetic_func import getinputdict
+    return(getinputdict(p = p))
+
+
+def getmodelregistry():
+    """
+    Model name -> function of p returning the inputdict.
+    """
+    registry = {}
+    registry['rbc_simple'] = getinputdict_rbc_simple
+    registry['nk_simple'] = getinputdict_nk_simple
+    registry['synthetic'] = getinputdict_synthetic
+
+    return(registry)
+
+
+# Worker:{{{1
+# per process caches of the warm models
+# model name -> LazyModel
+workermodels = {}
+# (estimatevars, data key) -> loglfunc
+workerloglfuncs = {}
+
+
+def getworkermodel(modelname, params):
+    """
+    Return the LazyModel for modelname (kept warm in this process) updated to params.
+    """
+    registry = getmodelregistry()
+    if modelname not in registry:
+        raise ValueError('Unknown model: ' + str(modelname) + '. Available models: ' + ', '.join(registry) + '.')
+
+    inputdict = registry[modelname](p = dict(params) if params is not None else None)
+    if modelname not in workermodels:
+        sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+        from lazymodel_func import getlazymodel
+        workermodels[modelname] = getlazymodel(inputdict)
+    model = workermodels[modelname]
+    model.update({'paramssdict': inputdict['paramssdict'], 'varssdict': inputdict['varssdict']})
+
+    return(model)
+
+
+def getworkerstatespace(payload):
+    """
+    The statespace dict of moments_func.getstatespace_inputdict for the model and parameters in payload.
+    Shocks without a standard deviation in payload['shocksddict'] have standard deviation 1.
+    """
+    model = getworkermodel(payload['model'], payload.get('params'))
+
+    shocksddict = {shock: 1 for shock in model['shocks']}
+    shocksddict.update(payload.get('shocksddict', {}))
+    inputdict = {'states': model['states'], 'shocks': model['shocks'], 'controls': model['controls'], 'hx': model['hx'], 'gx': model['gx'], 'shocksddict': shocksddict}
+
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from moments_func import getstatespace_inputdict
+    return(getstatespace_inputdict(inputdict))
+
+
+def work_irf(payload):
+    statespace = getworkerstatespace(payload)
+
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from moments_func import getirfs
+    irfs = getirfs(statespace['hx'], statespace['M'], statespace['eta'], irfperiods = payload.get('irfperiods', 40))
+
+    return({'varnames': statespace['varnames'], 'shocks': statespace['shocks'], 'irfs': irfs})
+
+
+def work_simulate(payload):
+    statespace = getworkerstatespace(payload)
+    nx = np.shape(statespace['hx'])[0] - len(statespace['shocks'])
+    shocksds = np.array([statespace['eta'][nx + j, j] for j in range(len(statespace['shocks']))])
+    solved = {'hx': statespace['hx'], 'M': statespace['M'], 'states': statespace['varnames'][: nx], 'shocks': statespace['shocks'], 'shocksds': shocksds}
+
+    sys.path.append(str(__projectdir__ / Path('runtime')))
+    from numericruntime_func import simulate
+    varpath = simulate(solved, simperiods = payload.get('simperiods', 100), seed = payload.get('seed'))
+
+    return({'varnames': statespace['varnames'], 'varpath': varpath})
+
+
+def work_moments(payload):
+    statespace = getworkerstatespace(payload)
+
+    sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+    from moments_func import stochsimul
+    retdict = stochsimul(statespace, irfperiods = 1, nar = payload.get('nar', 5), fevdhorizons = payload.get('fevdhorizons'))
+    del retdict['irfs']
+
+    return(retdict)
+
+
+def work_likelihood(payload):
+    estimatevars = payload.get('estimatevars')
+    if estimatevars is None:
+        sys.path.append(str(__projectdir__ / Path('bayes')))
+        from model_func import getestimatevars
+        estimatevars = getestimatevars()
+    data = payload.get('data', 'sim')
+
+    if isinstance(data, str):
+        datakey = data
+    else:
+        datakey = getrequestkey('data', data)
+    key = (tuple(estimatevars), datakey)
+
+    if key not in workerloglfuncs:
+        if data == 'sim':
+            sys.path.append(str(__projectdir__ / Path('bayes')))
+            from model_func import getsimdata
+            y = getsimdata()
+        elif data == 'real':
+            sys.path.append(str(__projectdir__ / Path('bayes')))
+            from model_func import getrealdata
+            y = getrealdata()
+        elif isinstance(data, str):
+            raise ValueError('data should be sim, real or a list of observations. data: ' + data + '.')
+        else:
+            y = np.array(data, dtype = float)
+        sys.path.append(str(__projectdir__ / Path('bayes')))
+        from model_func import getloglfunc
+        workerloglfuncs[key] = getloglfunc(list(estimatevars), y)
+
+    params = payload['params']
+    if len(params) != len(estimatevars):
+        raise ValueError('Need one value for each of ' + str(estimatevars) + '. params: ' + str(params) + '.')
+    return({'estimatevars': list(estimatevars), 'logl': float(workerloglfuncs[key](list(params)))})
+
+
+workfunctions = {'irf': work_irf, 'simulate': work_simulate, 'moments': work_moments, 'likelihood': work_likelihood}
+
+
+def runrequest(kind, payload):
+    """
+    Run a request in a worker process. Returns the result as something json can write.
+    """
+    sys.path.append(str(__projectdir__ / Path('runtime')))
+    from profiling_func import timer
+
+    with timer('server_' + kind):
+        result = workfunctions[kind](payload)
+    return(tojson(result))
+
+
+# JSON:{{{1
+def tojson(value):
+    """
+    Convert numpy arrays and numbers in value into lists and floats.
+    """
+    if isinstance(value, dict):
+        return({str(key): tojson(value[key]) for key in value})
+    if isinstance(value, (list, tuple)):
+        return([tojson(v) for v in value])
+    if isinstance(value, np.ndarray):
+        return(value.tolist())
+    if isinstance(value, np.integer):
+        return(int(value))
+    if isinstance(value, np.floating):
+        return(float(value))
+    return(value)
+
+
+def getrequestkey(kind, payload):
+    """
+    Requests with the same kind and payload (whatever the order of the keys) have the same key.
+    """
+    import hashlib
+    return(hashlib.sha256(json.dumps([kind, payload], sort_keys = True).encode('utf-8')).hexdigest())
+
+
+# Server:{{{1
+class ModelServer(object):
+    """
+    The asyncio server. Call start() within an event loop (or use runserver).
+    """
+
+    def __init__(self, host = host_default, port = port_default, numprocesses = None, cachesize = cachesize_default):
+        self.host = host
+        self.port = port
+        self.numprocesses = numprocesses
+        self.cachesize = cachesize
+        # request key -> result (most recently used last)
+        self.cache = collections.OrderedDict()
+        # request key -> future of the solve that is running
+        self.inflight = {}
+        self.stats = {'requests': 0, 'cachehits': 0, 'coalesced': 0, 'computed': 0, 'errors': 0}
+        self.pool = None
+        self.server = None
+
+    async def start(self):
+        import concurrent.futures
+
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers = self.numprocesses)
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        # in case port = 0 was used to get a free port
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    async def getresult(self, kind, payload):
+        """
+        Return the result from the cache, from a solve of the same request that is already running or from a new solve.
+        """
+        key = getrequestkey(kind, payload)
+        self.stats['requests'] = self.stats['requests'] + 1
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.stats['cachehits'] = self.stats['cachehits'] + 1
+            return(self.cache[key])
+
+        if key in self.inflight:
+            self.stats['coalesced'] = self.stats['coalesced'] + 1
+            # shield so one client disconnecting doesn't cancel the solve for the others
+            return(await asyncio.shield(self.inflight[key]))
+
+        loop = asyncio.get_running_loop()
+        future = asyncio.ensure_future(loop.run_in_executor(self.pool, runrequest, kind, payload))
+        self.inflight[key] = future
+        self.stats['computed'] = self.stats['computed'] + 1
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            del self.inflight[key]
+
+        self.cache[key] = result
+        if len(self.cache) > self.cachesize:
+            self.cache.popitem(last = False)
+
+        return(result)
+
+    async def handle(self, reader, writer):
+        """
+        Answer one HTTP/1.1 request per connection.
+        """
+        try:
+            requestline = await reader.readline()
+            parts = requestline.decode('latin-1').split()
+            if len(parts) < 2:
+                return
+            method, path = parts[0], parts[1]
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in [b'\r\n', b'\n', b'']:
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            contentlength = int(headers.get('content-length', 0))
+            if contentlength > maxbodysize_default:
+                await self.respond(writer, 413, {'error': 'Request body too large.'})
+                return
+            body = await reader.readexactly(contentlength) if contentlength > 0 else b''
+
+            status, response = await self.route(method, path, body)
+            await self.respond(writer, status, response)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        path = path.split('?')[0].strip('/')
+
+        if method == 'GET' and path == 'health':
+            return(200, {'status': 'ok'})
+        if method == 'GET' and path == 'stats':
+            return(200, dict(self.stats, cachesize = len(self.cache), inflight = len(self.inflight)))
+        if path not in workfunctions:
+            return(404, {'error': 'Unknown endpoint: /' + path + '. Endpoints: ' + ', '.join(['/' + kind for kind in workfunctions]) + ', /health, /stats.'})
+        if method != 'POST':
+            return(405, {'error': 'Use POST for /' + path + '.'})
+
+        try:
+            payload = json.loads(body.decode('utf-8')) if len(body) > 0 else {}
+        except ValueError as e:
+            return(400, {'error': 'Request body is not valid JSON: ' + str(e)})
+
+        try:
+            result = await self.getresult(path, payload)
+        except Exception as e:
+            self.stats['errors'] = self.stats['errors'] + 1
+            return(400, {'error': type(e).__name__ + ': ' + str(e)})
+
+        return(200, result)
+
+    async def respond(self, writer, status, response):
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large'}
+        body = json.dumps(response).encode('utf-8')
+        header = 'HTTP/1.1 ' + str(status) + ' ' + reasons[status] + '\r\nContent-Type: application/json\r\nContent-Length: ' + str(len(body)) + '\r\nConnection: close\r\n\r\n'
+        writer.write(header.encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(host = host_default, port = port_default, numprocesses = None, cachesize = cachesize_default):
+    server = ModelServer(host = host, port = port, numprocesses = numprocesses, cachesize = cachesize)
+    await server.start()
+    print('Serving on http://' + server.host + ':' + str(server.port))
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+def runserver(host = host_default, port = port_default, numprocesses = None, cachesize = cachesize_default):
+    """
+    Run the server until interrupted.
+    Only bind to localhost: there is no authentication.
+    """
+    asyncio.run(serve(host = host, port = port, numprocesses = numprocesses, cachesize = cachesize))
+
+
+# Client:{{{1
+def query(path, payload = None, host = host_default, port = port_default, timeout = 600):
+    """
+    Send a request to the server and return the decoded JSON response.
+    Raises a ValueError if the server returns an error.
+    """
+    import http.client
+
+    connection = http.client.HTTPConnection(host, port, timeout = timeout)
+    try:
+        if payload is None:
+            connection.request('GET', path)
+        else:
+            connection.request('POST', path, body = json.dumps(tojson(payload)), headers = {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        retdict = json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
+
+    if response.status != 200:
+        raise ValueError('Server returned ' + str(response.status) + ' for ' + path + ': ' + str(retdict.get('error')))
+    return(retdict)
+
+
+# Test:{{{1
+def server_test():
+    """
+    Start a server on a free localhost port in a background thread and query it.
+    """
+    import concurrent.futures
+    import threading
+
+    loop = asyncio.new_event_loop()
+    server = ModelServer(host = host_default, port = 0, numprocesses = 2, cachesize = 2)
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target = loop.run_forever, daemon = True)
+    thread.start()
+
+    try:
+        port = server.port
+        if query('/health', port = port)['status'] != 'ok':
+            raise ValueError('Health check failed.')
+
+        # concurrent identical requests are only solved once
+        payload = {'model': 'rbc_simple', 'params': {'RHO': 0.9}, 'shocksddict': {'epsilon_a': 0.01}, 'irfperiods': 20}
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda i: query('/irf', payload, port = port), range(8)))
+        stats = query('/stats', port = port)
+        if stats['computed'] != 1 or stats['cachehits'] + stats['coalesced'] != 7:
+            raise ValueError('Identical requests were not coalesced or cached: ' + str(stats) + '.')
+        for result in results[1: ]:
+            if result != results[0]:
+                raise ValueError('Coalesced requests returned different results.')
+
+        # results match a direct solve
+        sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+        from rbc_simple import getinputdict
+        sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+        from dsgesetup_func import getmodel_inputdict
+        sys.path.append(str(__projectdir__ / Path('submodules/dsge-perturbation/')))
+        from dsge_bkdiscrete_func import polfunc_inputdict
+        sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+        from moments_func import getstatespace_inputdict
+        sys.path.append(str(__projectdir__ / Path('dsge_bkdiscrete')))
+        from moments_func import getirfs
+        inputdict = getinputdict(p = {'RHO': 0.9})
+        inputdict = getmodel_inputdict(inputdict)
+        inputdict = polfunc_inputdict(inputdict)
+        inputdict['shocksddict'] = {'epsilon_a': 0.01}
+        statespace = getstatespace_inputdict(inputdict)
+        irfs = getirfs(statespace['hx'], statespace['M'], statespace['eta'], irfperiods = 20)
+        if results[0]['varnames'] != statespace['varnames'] or not np.allclose(np.array(results[0]['irfs']), irfs):
+            raise ValueError('Server IRFs differ from a direct solve.')
+
+        # a new parameter value is solved again and the LRU drops the oldest result
+        payload2 = dict(payload, params = {'RHO': 0.5})
+        query('/irf', payload2, port = port)
+        query('/moments', payload, port = port)
+        if query('/stats', port = port)['computed'] != 3:
+            raise ValueError('New requests not computed.')
+        query('/irf', payload, port = port)
+        stats = query('/stats', port = port)
+        if stats['computed'] != 4 or stats['cachesize'] != 2:
+            raise ValueError('LRU cache did not evict the oldest result: ' + str(stats) + '.')
+
+        # moments and simulation
+        moments = query('/moments', payload, port = port)
+        var = np.array(moments['var'])
+        if not np.allclose(var, var.transpose()) or 'irfs' in moments:
+            raise ValueError('Bad moments returned.')
+        sim = query('/simulate', dict(payload, simperiods = 50, seed = 1), port = port)
+        if np.shape(sim['varpath']) != (50, len(sim['varnames'])):
+            raise ValueError('Simulation has the wrong shape.')
+        if sim != query('/simulate', dict(payload, simperiods = 50, seed = 1), port = port):
+            raise ValueError('Same seed gave a different simulation.')
+
+        # errors are returned rather than crashing the server
+        try:
+            query('/irf', {'model': 'notamodel'}, port = port)
+            raise RuntimeError('Unknown model did not raise an error.')
+        except ValueError:
+            pass
+        if query('/health', port = port)['status'] != 'ok':
+            raise ValueError('Server not running after an error.')
+    finally:
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    print('Server test passed. Stats: ' + str(stats))
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    runserver()
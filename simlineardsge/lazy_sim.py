@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Same as simple_sim.py but using the lazy model in dsgesetup/lazymodel_func.py.
+Changing the shocks only re-simulates and changing a parameter only re-evaluates the steady state and the Jacobians and re-solves.
+"""
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/../')
+
+import numpy as np
+
+def simlinear_lazy():
+    
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getinputdict
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from rbc_simple import getss
+    inputdict = getinputdict()
+
+    sys.path.append(str(__projectdir__ / Path('dsgesetup')))
+    from lazymodel_func import getlazymodel
+    # pass getss so the steady state is updated when a parameter changes
+    model = getlazymodel(inputdict, getss = getss)
+
+    model['pathsimperiods'] = 100
+    model['shocksddict'] = {'epsilon_a': 0.01}
+
+    # standard deviation of consumption
+    print(np.std(model['varpath'][:, model['stateshockcontrolposdict']['C']]))
+
+    # larger shocks: the model is not re-solved
+    model['shocksddict'] = {'epsilon_a': 0.02}
+    print(np.std(model['varpath'][:, model['stateshockcontrolposdict']['C']]))
+
+    # less persistent productivity: the equations are not re-parsed
+    model['paramssdict']['RHO'] = 0.8
+    print(np.std(model['varpath'][:, model['stateshockcontrolposdict']['C']]))
+
+    # more patient households: the steady state is recomputed with getss
+    model['paramssdict']['BETA'] = 0.99
+    print(np.std(model['varpath'][:, model['stateshockcontrolposdict']['C']]))
+
+    print(model.computecounts)
+
+
+# Run:{{{1
+if __name__ == '__main__':
+    simlinear_lazy()